@@ -1,6 +1,6 @@
-import atexit
 import streamlit as st
 from helper_functions import llm, helper  # modules exported by __init__.py
+from helper_functions import chunker, tracing
 
 #configurations
 VALID_USERNAME = "test_user"
@@ -62,13 +62,8 @@ with st.expander("⚠️ Disclaimer"):
 #App config
 st.set_page_config(layout="centered", page_title="My Streamlit App")
 
-#for uploaded documents, a temp vector db will be created to process the documents and then deleted at end of session
-def _cleanup_on_exit():
-    try:
-        helper.clear_temp_chroma()
-    except Exception:
-        pass
-atexit.register(_cleanup_on_exit)
+#uploaded documents go into a shared in-memory index, one namespace per session. it is cleared with the
+#button below or on logout, idle sessions are evicted after UPLOAD_SESSION_TTL_S, and nothing is written to disk
 
 #only allow access if login successful
 if not show_login():
@@ -136,38 +131,58 @@ form.subheader("Prompt")
 user_prompt = form.text_area("Enter your prompt here", height=200)
 submitted = form.form_submit_button("Submit")
 
+#answer token stream for the main knowledge base; through the shared async loop unless ASYNC_ASK=0
+def _answer_stream(query, metrics):
+    if llm.ASYNC_ASK:
+        return llm.iterate_async(llm.ask_stream_async(query, metrics=metrics))
+    return llm.ask_stream(query, metrics=metrics)
+
 if submitted:
     if not user_prompt.strip():
         st.warning("Ask a question on PUB Code of Practice, or upload your own document.")
     else:
         st.toast(f"User Input Submitted - {user_prompt}")
 
-        if use_uploaded_context and uploaded:
-            # 1) Parse → chunk → segments
-            segments = helper.build_segments_from_uploads(uploaded) # processing of uploaded doc to create temp vectorDB
-            if not segments:
-                st.info("No readable content found in the uploaded files. Proceeding with direct chat.")
-                response = llm.ask(user_prompt)
+        # one trace per question (upload indexing, retrieval, LLM call), see pages/3_Metrics.py
+        with tracing.trace("question", user=st.session_state.username, uploaded=bool(use_uploaded_context and uploaded)):
+            metrics = {}  # filled by the answer stream: ttft_ms, total_ms, cache_hit
+            if use_uploaded_context and uploaded:
+                # 1+2) Parse → chunk → embed → index into temp Chroma, streamed page by page
+                progress = st.progress(0.0, text="Indexing uploaded documents…")
+                def _on_progress(name, done, total):
+                    progress.progress(min(1.0, done / max(total, 1)), text=f"Indexing {name} — page {done}/{total}")
+                try:
+                    n_indexed = helper.index_uploads(uploaded, on_progress=_on_progress) # processing of uploaded doc to create temp vectorDB
+                except helper.UploadQuotaExceeded as e:
+                    progress.empty()
+                    st.error(str(e))
+                    st.stop()
+                progress.empty()
+                if not n_indexed:
+                    st.info("No readable content found in the uploaded files. Proceeding with direct chat.")
+                    answer_stream = _answer_stream(user_prompt, metrics)
+                else:
+                    # 3) Retrieve top-k
+                    excerpts = helper.chroma_query(user_prompt, top_k=k)
+                    # 4) Ask with uploaded context retrieved from vector store
+                    answer_stream = helper.ask_with_temp_context(user_prompt, excerpts, strict=strict,
+                                                                 stream=True, metrics=metrics, use_async=llm.ASYNC_ASK)
+
+                    with st.expander("🔎 Context used (from uploaded docs)"):
+                        for i, e in enumerate(excerpts, 1):
+                            src = e.get("metadata", {}).get("source", "uploaded")
+                            loc = chunker.locator(e.get("metadata", {}))
+                            st.markdown(f"**{i}. {src} — {loc}**" if loc else f"**{i}. {src}**")
+                            st.write(e["text"])
             else:
-                # 2) Index into temp Chroma
-                helper.chroma_add_segments(segments)
-                # 3) Retrieve top-k
-                excerpts = helper.chroma_query(user_prompt, top_k=k)
-                # 4) Ask with uploaded context retrieved from vector store
-                response = helper.ask_with_temp_context(user_prompt, excerpts, strict=strict)
-
-                with st.expander("🔎 Context used (from uploaded docs)"):
-                    for i, e in enumerate(excerpts, 1):
-                        src = e.get("metadata", {}).get("source", "uploaded")
-                        page = e.get("metadata", {}).get("page", "?")
-                        st.markdown(f"**{i}. {src} — p.{page}**")
-                        st.write(e["text"])
-        else:
-            # The default - using vector store
-            if use_uploaded_context and not uploaded:
-                st.info("‘Use uploaded docs’ is on, but no files were uploaded. Answering from the main knowledge base.")
-            response = llm.ask(user_prompt)
-
-        st.markdown("### Answer")
-        st.write(response)
+                # The default - using vector store
+                if use_uploaded_context and not uploaded:
+                    st.info("‘Use uploaded docs’ is on, but no files were uploaded. Answering from the main knowledge base.")
+                answer_stream = _answer_stream(user_prompt, metrics)
+
+            st.markdown("### Answer")
+            response = st.write_stream(answer_stream)  # render tokens as they arrive
+            if metrics.get("ttft_ms") is not None:
+                st.caption(f"First token {metrics['ttft_ms']:.0f} ms · total {metrics['total_ms']:.0f} ms"
+                           + (" · cached" if metrics.get("cache_hit") else ""))
         print(f"User Input is {user_prompt}")
\ No newline at end of file
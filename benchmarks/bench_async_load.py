@@ -0,0 +1,193 @@
+"""Load test: N concurrent questions against the local mock OpenAI server (default 50).
+
+Starts benchmarks/mock_openai_server.py in a subprocess (so it does not compete with the client for the
+GIL), points the app at it (OPENAI_BASE_URL) and fires all questions at once, comparing
+  async - LLM.ask_async on the shared event loop: pooled AsyncOpenAI client, OPENAI_MAX_CONCURRENCY calls in
+          flight, retry with backoff on 429, ASK_TIMEOUT_S per request
+  sync  - LLM.ask_stream from one thread per question (what N Streamlit script threads did before)
+Paths:
+  temp - the uploaded-documents path (generation only, no vector store needed)
+  rag  - the full path over chroma_parent_child (query expansion, MMR, rerank, ...); the answer cache is
+         disabled and every OpenAI call, embeddings included, goes to the mock server
+Both stream the answer. One warm-up question per mode (client creation, imports) is not timed.
+Reports wall time, p50/p95 latency and time to first token, failures, retries and the peak number of
+requests the server saw at once. With --server-max-concurrent the server answers 429 above that
+many in-flight requests, to check that rate limits are retried instead of failing questions.
+
+    python benchmarks/bench_async_load.py [--questions 50] [--path temp|rag] [--modes async sync]
+        [--concurrency 16] [--timeout-s 60] [--ttft-ms 400] [--token-ms 15] [--tokens 60]
+        [--server-max-concurrent 0] [--error-rate 0] [--out benchmarks/results/async_load.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+os.chdir(ROOT)
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else None
+
+
+#run the mock server in its own interpreter; returns (process, base_url)
+def _start_server(args):
+    cmd = [sys.executable, os.path.join(ROOT, "benchmarks", "mock_openai_server.py"), "--port", "0",
+           "--ttft-ms", str(args.ttft_ms), "--token-ms", str(args.token_ms), "--tokens", str(args.tokens),
+           "--max-concurrent", str(args.server_max_concurrent), "--error-rate", str(args.error_rate)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()  # "mock OpenAI listening on http://127.0.0.1:PORT/v1 ..."
+    if "listening on" not in line:
+        proc.kill()
+        raise RuntimeError(f"mock server did not start: {line!r}")
+    return proc, line.split("listening on", 1)[1].split()[0]
+
+
+def _server_stats(base_url: str, reset_peak: bool = False) -> dict:
+    url = base_url.rsplit("/v1", 1)[0] + "/stats" + ("?reset=1" if reset_peak else "")
+    with urllib.request.urlopen(url) as r:
+        return json.loads(r.read())
+
+
+def _questions(n: int):
+    with open(os.path.join(ROOT, "benchmarks", "example_questions.json"), "r", encoding="utf-8") as f:
+        base = [q["question"] for q in json.load(f)]
+    # numbered so the answer cache / expansion cache never short-circuit a repeat
+    return [f"{base[i % len(base)]} (#{i})" for i in range(n)]
+
+
+def _summary(mode, latencies, ttfts, errors, wall_s, server_before, server_after, extra=None) -> dict:
+    ok = [x for x in latencies if x is not None]
+    out = {
+        "mode": mode,
+        "questions": len(latencies),
+        "ok": len(ok),
+        "failed": len(latencies) - len(ok),
+        "errors": sorted({e for e in errors if e}),
+        "wall_s": round(wall_s, 2),
+        "questions_per_s": round(len(ok) / wall_s, 2) if wall_s else None,
+        "p50_ms": round(_pct(ok, .5) or 0, 1),
+        "p95_ms": round(_pct(ok, .95) or 0, 1),
+        "server_chat_requests": server_after["chat"] - server_before["chat"],
+        "server_rate_limited": server_after["rate_limited"] - server_before["rate_limited"],
+        "server_max_in_flight": server_after["max_in_flight"],
+    }
+    if ttfts:
+        out["ttft_p50_ms"] = round(_pct(ttfts, .5), 1)
+        out["ttft_p95_ms"] = round(_pct(ttfts, .95), 1)
+    out.update(extra or {})
+    return out
+
+
+def run_async(llm, questions, temp_context, timeout_s, base_url) -> dict:
+    import asyncio
+    pool = llm.get_async_pool()
+    llm.run_async(llm.ask_async(questions[0], temp_context=temp_context))  # warm-up
+    before_pool = dict(pool.stats)
+    pool.stats["max_in_flight"] = 0
+    before = _server_stats(base_url, reset_peak=True)
+
+    async def one(q):
+        metrics = {}
+        t0 = time.perf_counter()
+        try:
+            await llm.ask_async(q, temp_context=temp_context, timeout_s=timeout_s, metrics=metrics)
+            return (time.perf_counter() - t0) * 1000, metrics.get("ttft_ms"), None
+        except Exception as exc:
+            return None, None, type(exc).__name__
+
+    async def all_of_them():
+        return await asyncio.gather(*(one(q) for q in questions))
+
+    t0 = time.perf_counter()
+    results = llm.run_async(all_of_them())
+    wall = time.perf_counter() - t0
+    after = _server_stats(base_url)
+    return _summary("async", [r[0] for r in results], [r[1] for r in results if r[1] is not None],
+                    [r[2] for r in results], wall, before, after,
+                    {"retries": pool.stats["retries"] - before_pool["retries"],
+                     "timeouts": pool.stats["timeouts"] - before_pool["timeouts"],
+                     "client_max_in_flight": pool.stats["max_in_flight"]})
+
+
+def run_sync(llm, questions, temp_context, base_url) -> dict:
+    "".join(llm.ask_stream(questions[0], temp_context=temp_context))  # warm-up
+    before = _server_stats(base_url, reset_peak=True)
+
+    def one(q):
+        metrics = {}
+        t0 = time.perf_counter()
+        try:
+            "".join(llm.ask_stream(q, temp_context=temp_context, metrics=metrics))
+            return (time.perf_counter() - t0) * 1000, metrics.get("ttft_ms"), None
+        except Exception as exc:
+            return None, None, type(exc).__name__
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(questions)) as ex:
+        results = list(ex.map(one, questions))
+    wall = time.perf_counter() - t0
+    after = _server_stats(base_url)
+    return _summary("sync", [r[0] for r in results], [r[1] for r in results if r[1] is not None],
+                    [r[2] for r in results], wall, before, after)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--questions", type=int, default=50)
+    ap.add_argument("--path", default="temp", choices=["temp", "rag"])
+    ap.add_argument("--modes", nargs="+", default=["async", "sync"], choices=["async", "sync"])
+    ap.add_argument("--concurrency", type=int, default=16, help="OPENAI_MAX_CONCURRENCY for the async pool")
+    ap.add_argument("--timeout-s", type=float, default=60.0, help="per-question deadline (ASK_TIMEOUT_S)")
+    ap.add_argument("--ttft-ms", type=float, default=400.0)
+    ap.add_argument("--token-ms", type=float, default=15.0)
+    ap.add_argument("--tokens", type=int, default=60)
+    ap.add_argument("--server-max-concurrent", type=int, default=0, help="mock 429s above this (0 = off)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock 500s")
+    ap.add_argument("--out", default=None, help="JSON results (default benchmarks/results/async_load_<time>.json)")
+    args = ap.parse_args()
+
+    server, base_url = _start_server(args)
+    # before helper_functions is imported: its settings are read at import time
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["OPENAI_MAX_CONCURRENCY"] = str(args.concurrency)
+    os.environ["ANSWER_CACHE_ENABLED"] = "0"
+    from helper_functions import LLM as llm
+
+    questions = _questions(args.questions)
+    temp_context = args.path == "temp"
+    if temp_context:
+        questions = [f"Context excerpts:\n[upload.pdf p.1]\nGrease traps shall be cleaned weekly.\n"
+                     f"User question: {q}" for q in questions]
+    else:
+        llm.get_retriever()  # load the store, BM25 and label map before the clock starts
+
+    results = {"config": vars(args), "base_url": base_url, "runs": []}
+    try:
+        for mode in args.modes:
+            run = (run_async(llm, questions, temp_context, args.timeout_s, base_url) if mode == "async"
+                   else run_sync(llm, questions, temp_context, base_url))
+            results["runs"].append(run)
+            print(json.dumps(run))
+    finally:
+        server.terminate()
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"async_load_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
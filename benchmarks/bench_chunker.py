@@ -0,0 +1,197 @@
+"""Chunking strategies on the Code of Practice: index size and retrieved tokens for the same recall.
+
+Chunkers:
+  words          - the previous upload chunker: 220-word windows with 40 words of overlap
+  recursive      - the previous corpus chunker: RecursiveCharacterTextSplitter(1000, 100)
+                   (skipped when langchain is missing)
+  structure-<n>  - helper_functions.chunker.StructureChunker with max_tokens=n (clause, heading and table aware),
+                   one row per --max-tokens value
+Pages are read from data/*.pdf with pypdf and numbered from 0 like the labels in example_questions.json.
+Every labelled question retrieves its top chunks with --retriever:
+  dense  - cosine similarity over the offline HashingEmbeddings from fakes.py (no API key), or over OpenAI
+           embeddings with --embeddings openai (needs OPENAI_API_KEY)
+  bm25   - the lexical index of lexical_index.py
+  hybrid - reciprocal rank fusion of the two, like AnnexAwareRetriever
+Per chunker the script reports
+  chunks, tokens_total, index_mb     - size of the index: text + float32 vectors (--dim) + metadata
+  recall@k, tokens@k                 - share of the answer pages found in the top k, and the tokens of those k
+  k_same_recall, tokens_same_recall  - the smallest k whose recall reaches the baseline's recall@--k, and the
+                                       tokens retrieved at that k (what the prompt pays for the same recall)
+  tokens_to_full_recall_mean         - per question, the tokens retrieved until all of its answer pages are in
+                                       (mean over the questions that get there within --max-k)
+
+    python benchmarks/bench_chunker.py [--k 5] [--max-k 20] [--max-tokens 128 192 256 320]
+                                       [--retriever dense|bm25|hybrid] [--embeddings hashing|openai]
+                                       [--baseline recursive] [--dim 384] [--out ...]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+os.chdir(ROOT)
+
+from helper_functions.chunker import StructureChunker, chunk_pages  # noqa: E402
+from helper_functions.lexical_index import BM25Index  # noqa: E402
+from helper_functions.tokens import count_tokens  # noqa: E402
+
+TOKEN_MODEL = "text-embedding-ada-002"
+
+
+def load_pages(paths):
+    from pypdf import PdfReader
+    pages = []
+    for path in paths:
+        source = os.path.basename(path)
+        for i, page in enumerate(PdfReader(path).pages):
+            text = page.extract_text() or ""
+            if text.strip():
+                pages.append((text, {"source": source, "page": i}))
+    return pages
+
+
+#the 220/40 word windows helper.chunk_text used for uploads
+def _word_windows(text, size=220, overlap=40):
+    words = text.split()
+    out = []
+    for start in range(0, len(words), max(1, size - overlap)):
+        out.append(" ".join(words[start:start + size]))
+        if start + size >= len(words):
+            break
+    return out
+
+
+def chunkers(max_tokens):
+    out = {"words": lambda pages: [(c, m) for t, m in pages for c in _word_windows(t)]}
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+        out["recursive"] = lambda pages: [(c, m) for t, m in pages for c in splitter.split_text(t)]
+    except ImportError:
+        print("langchain is not installed, skipping the recursive chunker")
+    for n in max_tokens:
+        chunker = StructureChunker(max_tokens=n, overlap_tokens=min(32, n // 8), model=TOKEN_MODEL)
+        out[f"structure-{n}"] = lambda pages, _c=chunker: chunk_pages(_c, pages)
+    return out
+
+
+#ranker(question) -> chunk indices, best first
+def make_ranker(kind, texts, metas, emb, depth):
+    vecs = np.asarray(emb.embed_documents(texts), dtype=np.float32) if kind != "bm25" else None
+    bm25 = BM25Index.build(texts, metas) if kind != "dense" else None
+
+    def dense(q):
+        return list(np.argsort(-(vecs @ np.asarray(emb.embed_query(q), dtype=np.float32)), kind="stable")[:depth])
+
+    def lexical(q):
+        return [i for i, _ in bm25.search(q, k=depth)]
+
+    def hybrid(q):
+        fused = {}
+        for ranking in (dense(q), lexical(q)):
+            for rank, i in enumerate(ranking):
+                fused[int(i)] = fused.get(int(i), 0.0) + 1.0 / (60 + rank)
+        return sorted(fused, key=lambda i: -fused[i])[:depth]
+
+    return {"dense": dense, "bm25": lexical, "hybrid": hybrid}[kind], (vecs.shape[1] if vecs is not None else 0)
+
+
+def evaluate(name, chunks, questions, emb, max_k, retriever):
+    t0 = time.perf_counter()
+    texts = [c for c, _ in chunks]
+    rank, dim = make_ranker(retriever, texts, [m for _, m in chunks], emb, max_k)
+    tokens = np.array([count_tokens(t, TOKEN_MODEL) for t in texts])
+    pages = [(m["source"], int(m["page"])) for _, m in chunks]
+    recall = np.zeros(max_k)
+    used = np.zeros(max_k)
+    to_full = []  # per question: tokens retrieved until every answer page is in
+    for q in questions:
+        wanted = {(a["source"], int(a["page"])) for a in q["answer_pages"]}
+        hits = rank(q["question"])
+        got = set()
+        for k, row in enumerate(hits):
+            got.add(pages[row])
+            recall[k] += len(wanted & got) / len(wanted)
+            used[k] += tokens[row]
+        recall[len(hits):] += len(wanted & got) / len(wanted)  # bm25 may return fewer than max_k
+        full = next((k for k in range(len(hits)) if wanted <= {pages[r] for r in hits[:k + 1]}), None)
+        to_full.append(int(tokens[hits[:full + 1]].sum()) if full is not None else None)
+    recall /= len(questions)
+    used = np.cumsum(used) / len(questions)  # tokens of the top k, per question
+    size = sum(len(t.encode("utf-8")) + 4 * dim + len(json.dumps(m)) for t, m in chunks)
+    return {
+        "chunker": name,
+        "chunks": len(chunks),
+        "tokens_total": int(tokens.sum()),
+        "tokens_per_chunk_mean": round(float(tokens.mean()), 1),
+        "tokens_per_chunk_max": int(tokens.max()),
+        "index_mb": round(size / 2**20, 3),
+        "recall": [round(float(r), 4) for r in recall],
+        "tokens": [round(float(u), 1) for u in used],
+        "questions_full_recall": sum(t is not None for t in to_full),
+        "tokens_to_full_recall_mean": (round(float(np.mean([t for t in to_full if t is not None])), 1)
+                                       if any(t is not None for t in to_full) else None),
+        "seconds": round(time.perf_counter() - t0, 2),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pdf", nargs="+", default=sorted(glob.glob("./data/*.pdf")))
+    ap.add_argument("--questions", default=os.path.join(ROOT, "benchmarks", "example_questions.json"))
+    ap.add_argument("--k", type=int, default=5, help="k of the baseline whose recall the others must reach")
+    ap.add_argument("--max-k", type=int, default=20)
+    ap.add_argument("--max-tokens", type=int, nargs="+", default=[128, 192, 256, 320])
+    ap.add_argument("--baseline", default="recursive", help="chunker the recall target is taken from")
+    ap.add_argument("--retriever", default="dense", choices=["dense", "bm25", "hybrid"])
+    ap.add_argument("--embeddings", default="hashing", choices=["hashing", "openai"])
+    ap.add_argument("--dim", type=int, default=1536, help="hashing embeddings dimension (ada-002 is 1536)")
+    ap.add_argument("--out", default=None, help="JSON results (default benchmarks/results/chunker_<time>.json)")
+    args = ap.parse_args()
+
+    if args.embeddings == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        emb = OpenAIEmbeddings()
+    else:
+        from fakes import HashingEmbeddings
+        emb = HashingEmbeddings(dim=args.dim)
+    pages = load_pages(args.pdf)
+    sources = {m["source"] for _, m in pages}
+    questions = [q for q in json.load(open(args.questions, encoding="utf-8"))
+                 if q.get("answer_pages") and all(a["source"] in sources for a in q["answer_pages"])]
+    print(f"{len(pages)} pages, {len(questions)} labelled questions")
+
+    rows = [evaluate(name, fn(pages), questions, emb, args.max_k, args.retriever)
+            for name, fn in chunkers(args.max_tokens).items()]
+    base = next((r for r in rows if r["chunker"] == args.baseline), rows[0])
+    target = base["recall"][args.k - 1]
+    for r in rows:
+        k_same = next((k + 1 for k, rec in enumerate(r["recall"]) if rec >= target - 1e-9), None)
+        r[f"recall@{args.k}"] = r["recall"][args.k - 1]
+        r[f"tokens@{args.k}"] = r["tokens"][args.k - 1]
+        r["k_same_recall"] = k_same
+        r["tokens_same_recall"] = r["tokens"][k_same - 1] if k_same else None
+        r["index_mb_vs_baseline"] = round(r["index_mb"] / base["index_mb"], 3)
+        if k_same and base["tokens"][args.k - 1]:
+            r["tokens_same_recall_vs_baseline"] = round(r["tokens_same_recall"] / base["tokens"][args.k - 1], 3)
+        print(json.dumps({k: v for k, v in r.items() if k not in ("recall", "tokens")}))
+    print(f"baseline {base['chunker']}: recall@{args.k}={target}")
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"chunker_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"config": vars(args), "baseline": base["chunker"], "target_recall": target, "results": rows},
+                  f, indent=2)
+    print(f"results written to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
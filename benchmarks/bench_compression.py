@@ -0,0 +1,149 @@
+"""Compressed vector exports (VECTOR_COMPRESSION) against the current Chroma store: recall@k, size and latency.
+
+For every --compression setting the float32 export of the store is compressed (mmap_index.compress_export) and
+searched like VECTOR_BACKEND=mmap does, with and without the float32 re-scoring pass (--rescore values, 0 = off).
+Rows:
+  chroma        - the store itself: collection.query(n_results=k) per sub-query (HNSW), size of the store directory
+  none          - the float32 export, exact search; its top k is the ground truth for recall@k
+  int8, pca<d>  - the compressed copies, per --rescore value
+Columns:
+  recall@k         - share of the exact top k found, per sub-query (plain similarity search)
+  mmr_same         - share of the k documents the MMR selection has in common with the float32 export's MMR
+  request_p50_ms   - one request of --sub-queries sub-queries (scan, re-scoring, MMR), p95 too
+  scan_mb          - what every query reads and what should stay in memory: the compressed matrix + per-row data
+  disk_mb          - files the setting needs on disk (float32 matrix, sidecar and the compressed copy)
+  *_vs_store       - the same divided by the store directory's size
+The store is --db-dir (collection "langchain") or a synthetic one built like bench_mmap_index.py. Random synthetic
+vectors spread their variance over all dimensions, so PCA loses more recall on them than on real embeddings;
+run it on chroma_parent_child before picking a setting.
+
+    python benchmarks/bench_compression.py [--db-dir chroma_parent_child] [--rows 3000] [--dim 1536]
+                                           [--compression none int8 pca128 pca256 pca512] [--rescore 0 80]
+                                           [--requests 100] [--sub-queries 4] [--k 5] [--out ...]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+os.chdir(ROOT)
+
+from bench_mmap_index import make_requests, synthetic_store  # noqa: E402
+from helper_functions.mmap_index import (ROWS_FILENAME, VECTORS_FILENAME, MmapVectorIndex,  # noqa: E402
+                                         compress_export, compressed_filenames, export_from_chroma)
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else None
+
+
+def _dir_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files) / 2**20
+
+
+def _overlap(a, b) -> float:
+    return float(np.mean([len(set(x) & set(y)) / max(1, len(x)) for x, y in zip(a, b)]))
+
+
+def run_chroma(coll, index, requests, k, truth):
+    lat, got = [], []
+    for queries in requests:
+        t0 = time.perf_counter()
+        for q in queries:
+            res = coll.query(query_embeddings=[q.tolist()], n_results=k, include=[])
+            got.append(res["ids"][0])
+        lat.append((time.perf_counter() - t0) * 1000)
+    ids = [[index.ids[r] for r in row] for row in truth]
+    return lat, _overlap(got, ids)
+
+
+def run_index(index, requests, k, fetch_k, lambda_mult, rescore):
+    lat, plain, mmr = [], [], []
+    for queries in requests:
+        t0 = time.perf_counter()
+        mmr.extend(index.search(queries, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, rescore=rescore))
+        lat.append((time.perf_counter() - t0) * 1000)
+        plain.extend(index.search(queries, k=k, mmr=False, rescore=rescore))
+    return lat, plain, mmr
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db-dir", default=None, help="existing store (default: a synthetic one)")
+    ap.add_argument("--rows", type=int, default=3000, help="synthetic store size")
+    ap.add_argument("--dim", type=int, default=1536, help="synthetic store dimension (ada-002 is 1536)")
+    ap.add_argument("--compression", nargs="+", default=["none", "int8", "pca128", "pca256", "pca512"])
+    ap.add_argument("--rescore", type=int, nargs="+", default=[0, 80], help="rows re-scored in float32 (0 = off)")
+    ap.add_argument("--requests", type=int, default=100)
+    ap.add_argument("--sub-queries", type=int, default=4)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--fetch-k", type=int, default=20)
+    ap.add_argument("--lambda-mult", type=float, default=0.6)
+    ap.add_argument("--out", default=None, help="JSON results (default benchmarks/results/compression_<time>.json)")
+    args = ap.parse_args()
+
+    import chromadb
+    tmp = tempfile.mkdtemp(prefix="bench_compression_")
+    rows = []
+    try:
+        store_dir = args.db_dir or os.path.join(tmp, "store")
+        if args.db_dir:
+            coll = chromadb.PersistentClient(path=args.db_dir).get_collection("langchain")
+        else:
+            coll = synthetic_store(store_dir, args.rows, args.dim)
+        store_mb = _dir_mb(store_dir)
+        export_dir = os.path.join(tmp, "export")
+        export_from_chroma(coll, export_dir)
+        base_mb = sum(os.path.getsize(os.path.join(export_dir, f)) for f in (VECTORS_FILENAME, ROWS_FILENAME)) / 2**20
+        exact = MmapVectorIndex.load(export_dir)
+        requests = make_requests(exact, args.requests, args.sub_queries)
+        truth = [r for queries in requests for r in exact.search(queries, k=args.k, mmr=False)]
+        truth_mmr = [r for queries in requests
+                     for r in exact.search(queries, k=args.k, fetch_k=args.fetch_k, lambda_mult=args.lambda_mult)]
+        print(f"{exact.count()} rows x {exact.dim}, store {store_mb:.2f} MB, float32 export {base_mb:.2f} MB")
+
+        lat, recall = run_chroma(coll, exact, requests, args.k, truth)
+        rows.append({"setting": "chroma", "rescore": None, f"recall@{args.k}": round(recall, 4), "mmr_same": None,
+                     "request_p50_ms": round(_pct(lat, .5), 3), "request_p95_ms": round(_pct(lat, .95), 3),
+                     "scan_mb": None, "disk_mb": round(store_mb, 2)})
+        for spec in args.compression:
+            built = compress_export(export_dir, spec)
+            extra_mb = sum(os.path.getsize(os.path.join(export_dir, f)) for f in compressed_filenames(spec)) / 2**20
+            for rescore in ([0] if spec == "none" else args.rescore):
+                index = MmapVectorIndex.load(export_dir, compression=spec, rescore=rescore)
+                index.search(requests[0], k=args.k)  # warm-up: maps the pages
+                lat, plain, mmr = run_index(index, requests, args.k, args.fetch_k, args.lambda_mult, rescore)
+                row = {"setting": spec, "rescore": rescore if spec != "none" else None,
+                       f"recall@{args.k}": round(_overlap(plain, truth), 4),
+                       "mmr_same": round(_overlap(mmr, truth_mmr), 4),
+                       "request_p50_ms": round(_pct(lat, .5), 3), "request_p95_ms": round(_pct(lat, .95), 3),
+                       "scan_mb": round(index.scan_nbytes() / 2**20, 2), "disk_mb": round(base_mb + extra_mb, 2)}
+                if spec.startswith("pca"):
+                    row["dims"] = built.get("dims")
+                rows.append(row)
+        for r in rows:
+            r["disk_vs_store"] = round(r["disk_mb"] / store_mb, 3) if store_mb else None
+            r["scan_vs_store"] = round(r["scan_mb"] / store_mb, 3) if store_mb and r["scan_mb"] is not None else None
+            print(json.dumps(r))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"compression_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"config": vars(args), "store_mb": store_mb, "results": rows}, f, indent=2)
+    print(f"results written to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,116 @@
+"""Throughput and memory of upload embedding with 1, 10 and 50 simulated sessions.
+
+Compares the old behaviour (one all-MiniLM-L6-v2 per session, as st.session_state._embedder
+used to do) with the shared EmbeddingService micro-batching queue.
+Each configuration runs in a fresh interpreter so RSS numbers are not polluted by earlier runs.
+
+    python benchmarks/bench_embedding_service.py [--sessions 1 10 50] [--rounds 5]
+        [--max-batch-size 64] [--max-wait-ms 5] [--skip-per-session-above 10]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK = ("Grease traps shall be cleaned at least once a week; the standard cleaning procedure for "
+         "a circular grease trap is described in Annex J of the Code of Practice. ")
+
+
+def _rss_mb() -> float:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+#one simulated session: upload a few chunks, then ask a question against them, `rounds` times
+def _session(encode, rounds: int, counter: list):
+    for r in range(rounds):
+        encode([f"{CHUNK} chunk {i} round {r}" for i in range(8)])
+        encode([f"What is the cleaning procedure for grease traps? ({r})"])
+        counter.append(9)
+
+
+def run_one(mode: str, sessions: int, rounds: int, max_batch_size: int, max_wait_ms: float) -> dict:
+    sys.path.insert(0, ROOT)
+    from sentence_transformers import SentenceTransformer
+    from helper_functions.embedding_service import EmbeddingService
+
+    rss_before = _rss_mb()
+    t_load = time.perf_counter()
+    if mode == "shared":
+        service = EmbeddingService(lambda: SentenceTransformer(MODEL_NAME),
+                                   max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        service.model  # load once up front, like the first session would
+        encoders = [service.encode] * sessions
+    else:
+        service = None
+        encoders = []
+        for _ in range(sessions):
+            model = SentenceTransformer(MODEL_NAME)
+            encoders.append(lambda texts, m=model: m.encode(texts, normalize_embeddings=True))
+    load_s = time.perf_counter() - t_load
+
+    counter: list = []
+    threads = [threading.Thread(target=_session, args=(enc, rounds, counter)) for enc in encoders]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return {
+        "mode": mode,
+        "sessions": sessions,
+        "texts": sum(counter),
+        "model_load_s": round(load_s, 2),
+        "elapsed_s": round(elapsed, 3),
+        "texts_per_s": round(sum(counter) / elapsed, 1) if elapsed else None,
+        "rss_mb": round(_rss_mb(), 1),
+        "rss_delta_mb": round(_rss_mb() - rss_before, 1),
+        "batches": service.stats["batches"] if service else None,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50])
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--max-batch-size", type=int, default=64)
+    ap.add_argument("--max-wait-ms", type=float, default=5.0)
+    ap.add_argument("--skip-per-session-above", type=int, default=10,
+                    help="per-session baseline loads one model per session; skip it above this count")
+    ap.add_argument("--_child", nargs=2, metavar=("MODE", "SESSIONS"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args._child:
+        mode, sessions = args._child[0], int(args._child[1])
+        print(json.dumps(run_one(mode, sessions, args.rounds, args.max_batch_size, args.max_wait_ms)))
+        return 0
+
+    rows = []
+    for n in args.sessions:
+        for mode in ("per_session", "shared"):
+            if mode == "per_session" and n > args.skip_per_session_above:
+                continue
+            cmd = [sys.executable, __file__, "--_child", mode, str(n), "--rounds", str(args.rounds),
+                   "--max-batch-size", str(args.max_batch_size), "--max-wait-ms", str(args.max_wait_ms)]
+            out = subprocess.run(cmd, capture_output=True, text=True, check=True, cwd=ROOT)
+            rows.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'mode':<12}{'sessions':>9}{'texts/s':>10}{'elapsed s':>11}{'load s':>8}{'RSS MB':>9}{'batches':>9}")
+    for r in rows:
+        print(f"{r['mode']:<12}{r['sessions']:>9}{r['texts_per_s']:>10}{r['elapsed_s']:>11}"
+              f"{r['model_load_s']:>8}{r['rss_mb']:>9}{str(r['batches']):>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Retrieval quality vs latency: dense MMR, BM25 and the hybrid (RRF) fusion used by AnnexAwareRetriever.
+
+Runs every labelled question in example_questions.json through
+  - dense:  Chroma MMR over OpenAI embeddings (k=5, lambda 0.6)
+  - bm25:   the lexical index in chroma_parent_child/bm25_index.json.gz (no API call)
+  - hybrid: RRF fusion of the two
+and reports recall@k against the labelled answer pages plus p50/p95 latency.
+
+Needs OPENAI_API_KEY (for the dense path) and the chroma_parent_child store. Run from the repo root:
+    python benchmarks/bench_hybrid_retrieval.py [--k 5] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def recall_at_k(docs, answer_pages, k):
+    wanted = {(a["source"], int(a["page"])) for a in answer_pages}
+    got = set()
+    for d in docs[:k]:
+        page = d.metadata.get("page")
+        if page is not None:
+            got.add((d.metadata.get("source"), int(page)))
+    return len(wanted & got) / len(wanted)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--questions", default=os.path.join(ROOT, "benchmarks", "example_questions.json"))
+    args = ap.parse_args()
+
+    from helper_functions import llm
+    from helper_functions.query_expansion import rrf_fuse
+
+    questions = [q for q in json.load(open(args.questions, encoding="utf-8")) if q.get("answer_pages")]
+    dense = llm.get_vectordb().as_retriever(search_type="mmr", search_kwargs={"k": args.k, "lambda_mult": 0.6})
+    lexical = llm.get_lexical_index()
+
+    paths = {
+        "dense": lambda q: dense.invoke(q),
+        "bm25": lambda q: lexical.get_relevant_documents(q, k=args.k),
+        "hybrid": lambda q: rrf_fuse([dense.invoke(q), lexical.get_relevant_documents(q, k=args.k)]),
+    }
+    print(f"{len(questions)} labelled questions, k={args.k}, {args.repeat} timed repeats")
+    print(f"{'path':<8}{'recall@k':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for name, fn in paths.items():
+        recalls, latencies = [], []
+        for q in questions:
+            docs = fn(q["question"])
+            recalls.append(recall_at_k(docs, q["answer_pages"], args.k))
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                fn(q["question"])
+                latencies.append((time.perf_counter() - t0) * 1000)
+        print(f"{name:<8}{sum(recalls) / len(recalls):>10.2f}{_pct(latencies, .5):>9.1f}{_pct(latencies, .95):>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Dense MMR retrieval per request: Chroma (VECTOR_BACKEND=chroma) against the memory-mapped export (=mmap).
+
+A request is --sub-queries query vectors, like the sub-queries ParallelMultiQueryRetriever sends for one question.
+  chroma - what vectordb.as_retriever(search_type="mmr") does for every sub-query, on the retrieval thread pool:
+           collection.query(n_results=fetch_k) with documents, metadatas and embeddings, then MMR over the
+           candidates (vector_index.mmr_select, the selection rule of langchain's maximal_marginal_relevance)
+  mmap   - mmap_index.MmapVectorIndex.search: one matrix multiply for all sub-queries, argpartition, batched MMR
+Query embedding is not part of the timing (the same batched call feeds both paths).
+The store is --db-dir (a chroma_parent_child-style store, collection "langchain") or, by default, a synthetic
+PersistentClient store of --rows random unit vectors around topic centroids in a temporary directory. Queries are
+stored vectors plus noise. Reported per backend: p50/p95 per request, export time and size, load time of the
+export, and how often both paths pick the same documents (HNSW is approximate, the export is exact).
+
+    python benchmarks/bench_mmap_index.py [--db-dir chroma_parent_child] [--rows 3000] [--dim 1536]
+                                          [--requests 200] [--sub-queries 4] [--k 5] [--fetch-k 20] [--out ...]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from helper_functions.mmap_index import MmapVectorIndex, export_from_chroma  # noqa: E402
+from helper_functions.vector_index import mmr_select  # noqa: E402
+
+BATCH = 1000
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else None
+
+
+def synthetic_store(path: str, rows: int, dim: int, seed: int = 0):
+    import chromadb
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((max(8, rows // 40), dim)).astype(np.float32)
+    vecs = centroids[rng.integers(0, len(centroids), rows)] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    coll = chromadb.PersistentClient(path=path).get_or_create_collection("langchain")
+    for i in range(0, rows, BATCH):
+        j = min(rows, i + BATCH)
+        coll.add(ids=[f"chunk::{r}" for r in range(i, j)], embeddings=vecs[i:j].tolist(),
+                 documents=[f"clause {r} of a code of practice, topic {r % 97}" for r in range(i, j)],
+                 metadatas=[{"source": "COP.pdf", "page": r // 12, "section": f"{r % 9}.{r % 7}"} for r in range(i, j)])
+    return coll
+
+
+def make_requests(index: MmapVectorIndex, n: int, sub_queries: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    base = np.asarray(index.vectors[rng.integers(0, index.count(), n)], dtype=np.float32)
+    out = []
+    for b in base:
+        q = b + 0.35 * rng.standard_normal((sub_queries, index.dim)).astype(np.float32)
+        out.append(q / np.linalg.norm(q, axis=1, keepdims=True))
+    return out
+
+
+def chroma_request(coll, pool, queries, k, fetch_k, lambda_mult):
+    def one(q):
+        res = coll.query(query_embeddings=[q.tolist()], n_results=fetch_k,
+                         include=["documents", "metadatas", "distances", "embeddings"])
+        cand = np.asarray(res["embeddings"][0], dtype=np.float32)
+        cand /= np.linalg.norm(cand, axis=1, keepdims=True)
+        keep = mmr_select(q, cand, k, lambda_mult)
+        return [(res["ids"][0][i], res["documents"][0][i], res["metadatas"][0][i]) for i in keep]
+    return list(pool.map(one, queries))
+
+
+def mmap_request(index, queries, k, fetch_k, lambda_mult):
+    rows = index.search(queries, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult)
+    return [[(index.ids[r], index.documents[r], index.metadatas[r]) for r in hits] for hits in rows]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db-dir", default=None, help="existing store (default: a synthetic one)")
+    ap.add_argument("--rows", type=int, default=3000, help="synthetic store size")
+    ap.add_argument("--dim", type=int, default=1536, help="synthetic store dimension (ada-002 is 1536)")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--sub-queries", type=int, default=4, help="QUERY_EXPANSION_N + the question itself")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--fetch-k", type=int, default=20)
+    ap.add_argument("--lambda-mult", type=float, default=0.6)
+    ap.add_argument("--workers", type=int, default=8, help="retrieval thread pool of the chroma path")
+    ap.add_argument("--out", default=None, help="JSON results (default benchmarks/results/mmap_index_<time>.json)")
+    args = ap.parse_args()
+
+    import chromadb
+    tmp = tempfile.mkdtemp(prefix="bench_mmap_")
+    try:
+        if args.db_dir:
+            coll = chromadb.PersistentClient(path=args.db_dir).get_collection("langchain")
+        else:
+            coll = synthetic_store(os.path.join(tmp, "store"), args.rows, args.dim)
+        t0 = time.perf_counter()
+        export = export_from_chroma(coll, os.path.join(tmp, "export"))
+        export_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        index = MmapVectorIndex.load(os.path.join(tmp, "export"))
+        load_ms = (time.perf_counter() - t0) * 1000
+        files_mb = sum(os.path.getsize(os.path.join(tmp, "export", f)) for f in os.listdir(os.path.join(tmp, "export")))
+        print(f"{index.count()} rows x {index.dim}, export {export_s:.2f} s, load {load_ms:.1f} ms")
+
+        requests = make_requests(index, args.requests, args.sub_queries)
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+        params = (args.k, args.fetch_k, args.lambda_mult)
+        chroma_request(coll, pool, requests[0], *params)  # warm-up
+        mmap_request(index, requests[0], *params)
+        lat = {"chroma": [], "mmap": []}
+        same = []
+        for queries in requests:
+            t1 = time.perf_counter()
+            a = chroma_request(coll, pool, queries, *params)
+            lat["chroma"].append((time.perf_counter() - t1) * 1000)
+            t1 = time.perf_counter()
+            b = mmap_request(index, queries, *params)
+            lat["mmap"].append((time.perf_counter() - t1) * 1000)
+            for x, y in zip(a, b):
+                same.append(len({r[0] for r in x} & {r[0] for r in y}) / max(1, len(x)))
+        pool.shutdown()
+
+        rows = []
+        for name, values in lat.items():
+            rows.append({"backend": name, "request_p50_ms": round(_pct(values, .5), 3),
+                         "request_p95_ms": round(_pct(values, .95), 3),
+                         "per_sub_query_p50_ms": round(_pct(values, .5) / args.sub_queries, 3)})
+        rows[1].update(speedup_p50=round(rows[0]["request_p50_ms"] / rows[1]["request_p50_ms"], 1),
+                       export_s=round(export_s, 2), load_ms=round(load_ms, 1),
+                       vector_mb=round(index.nbytes() / 2**20, 2),
+                       files_mb=round(files_mb / 2**20, 2), same_docs=round(float(np.mean(same)), 4))
+        for r in rows:
+            print(json.dumps(r))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"mmap_index_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"config": vars(args), "export": export, "results": rows}, f, indent=2)
+    print(f"results written to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,275 @@
+"""Offline end-to-end benchmark: no network, no API key.
+
+OpenAI is replaced by the deterministic fakes in benchmarks/fakes.py (HashingEmbeddings, FakeChatModel).
+Two paths are exercised with the questions in example_questions.json:
+  qa     - the steps of LLM.ask: query expansion -> MMR -> BM25 fusion -> annex boost -> dedup/rerank ->
+           parent expansion -> token packing -> "stuff" prompt -> chat model -> _format_citations
+  upload - build_segments_from_uploads -> chroma_add_segments -> chroma_query on a PDF "uploaded" as bytes
+and reported per stage (p50/p95 ms), with Chroma I/O time per operation, peak RSS and recall@k against the
+labelled answer pages. Results are written as JSON so runs can be compared.
+
+The corpus store is a copy of chroma_parent_child re-embedded with the fake model (documents, metadata,
+parent docstore and BM25 index are reused as they are); without a store it is ingested from data/*.pdf.
+Everything is written to a temp dir, the real store and caches are never touched.
+
+Needs chromadb, langchain and langchain_community (no torch: the reranker defaults to the lexical one).
+Run from the repo root:
+    python benchmarks/bench_offline.py [--repeat 3] [--k 5] [--expansion rules] [--reranker lexical]
+                                       [--llm-latency-ms 0] [--out benchmarks/results/offline.json]
+"""
+import argparse
+import functools
+import glob
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+os.chdir(ROOT)
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux; children covers the pdf page-extraction pool
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self": round(self_kb / 1024, 1), "children": round(children_kb / 1024, 1)}
+
+
+class StageTimer:
+    def __init__(self):
+        self.phase = "setup"
+        self.samples = defaultdict(lambda: defaultdict(list))
+        self._lock = threading.Lock()
+
+    def add(self, stage, ms):
+        with self._lock:
+            self.samples[self.phase][stage].append(ms)
+
+    #replace owner.attr (module function, class method) with a timed version
+    def wrap(self, owner, attr, stage):
+        fn = getattr(owner, attr)
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, (time.perf_counter() - t0) * 1000)
+
+        setattr(owner, attr, timed)
+
+    def report(self):
+        out = {}
+        for phase, stages in self.samples.items():
+            out[phase] = {
+                stage: {"n": len(v), "p50_ms": round(_pct(v, .5), 2), "p95_ms": round(_pct(v, .95), 2),
+                        "total_ms": round(sum(v), 1)}
+                for stage, v in stages.items()
+            }
+        return out
+
+
+class Upload:
+    """Just enough of Streamlit's UploadedFile for helper.index_uploads & co."""
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self._data = f.read()
+
+    def getvalue(self):
+        return self._data
+
+
+def pages_of(docs, k, offset=0):
+    got = []
+    for d in docs:
+        md = d.metadata if hasattr(d, "metadata") else d.get("metadata", {})
+        if md.get("page") is not None and (md.get("source"), int(md["page"]) - offset) not in got:
+            got.append((md.get("source"), int(md["page"]) - offset))
+    return got[:k]
+
+
+def recall(got, answer_pages):
+    wanted = {(a["source"], int(a["page"])) for a in answer_pages}
+    return len(wanted & set(got)) / len(wanted)
+
+
+def build_store(src_dir, dst_dir, emb, label_map_path):
+    import chromadb
+    from helper_functions.ref_index import REF_INDEX_FILENAME, build_ref_index_from_chroma, save_ref_index
+    ref_index_path = os.path.join(os.path.dirname(label_map_path), REF_INDEX_FILENAME)
+    if not os.path.isdir(src_dir):
+        from helper_functions.ingest import run_ingest
+        run_ingest(sorted(glob.glob("./data/*.pdf")), db_dir=dst_dir, embed_fn=emb.embed_documents,
+                   ref_index_path=ref_index_path, log=lambda *a: None)
+        return
+    src = chromadb.PersistentClient(path=src_dir).get_collection("langchain")
+    res = src.get(include=["documents", "metadatas"])
+    dst = chromadb.PersistentClient(path=dst_dir).get_or_create_collection("langchain")
+    for i in range(0, len(res["ids"]), 256):
+        docs = res["documents"][i:i + 256]
+        dst.upsert(ids=res["ids"][i:i + 256], documents=docs, metadatas=res["metadatas"][i:i + 256],
+                   embeddings=emb.embed_documents(docs))
+    for name in ("parents.sqlite3", "bm25_index.json.gz"):
+        if os.path.exists(os.path.join(src_dir, name)):
+            shutil.copy(os.path.join(src_dir, name), os.path.join(dst_dir, name))
+    save_ref_index(build_ref_index_from_chroma(dst), ref_index_path)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--k", type=int, default=5, help="recall@k cut-off")
+    ap.add_argument("--repeat", type=int, default=3, help="passes over the question set")
+    ap.add_argument("--questions", default=os.path.join(ROOT, "benchmarks", "example_questions.json"))
+    ap.add_argument("--store", default="chroma_parent_child", help="store to copy (re-embedded with the fake model)")
+    ap.add_argument("--upload", default=(sorted(glob.glob("./data/*Sewerage*.pdf")) or [None])[0])
+    ap.add_argument("--expansion", default="rules", choices=["rules", "none"])
+    ap.add_argument("--reranker", default="lexical", choices=["lexical", "cross_encoder", "none"])
+    ap.add_argument("--embed-latency-ms", type=float, default=0.0, help="fake per-call embedding latency")
+    ap.add_argument("--llm-latency-ms", type=float, default=0.0, help="fake per-call chat latency")
+    ap.add_argument("--out", default=None, help="JSON results (default benchmarks/results/offline_<time>.json)")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="pub_rag_bench_")
+    label_map_path = os.path.join(tmp, "label_map.json")
+    shutil.copy(os.path.join(ROOT, "helper_functions", "label_map.json"), label_map_path)
+    # settings are read at import time
+    os.environ.update({
+        "PUB_RAG_VECTOR_DB_DIR": os.path.join(tmp, "store"),
+        "PUB_RAG_LABEL_MAP": label_map_path,
+        "PUB_RAG_CACHE_DIR": os.path.join(tmp, "cache"),
+        "QUERY_EXPANSION": args.expansion,
+        "RERANKER": args.reranker,
+        "ANSWER_CACHE_ENABLED": "0",
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "offline"),
+    })
+
+    from chromadb.api.models.Collection import Collection
+    from langchain_community.vectorstores import Chroma
+    from fakes import FakeChatModel, HashingEmbeddings
+    from helper_functions import LLM as llm, context_budget, helper, lexical_index, parent_store, query_expansion
+
+    emb = HashingEmbeddings(dim=1536, latency_ms=args.embed_latency_ms)
+    upload_emb = HashingEmbeddings(dim=384, latency_ms=args.embed_latency_ms)
+    chat = FakeChatModel(latency_ms=args.llm_latency_ms)
+    timer = StageTimer()
+    t0 = time.perf_counter()
+    build_store(args.store, os.environ["PUB_RAG_VECTOR_DB_DIR"], emb, label_map_path)
+    setup_s = time.perf_counter() - t0
+
+    # models: the fakes instead of OpenAI / sentence-transformers
+    llm.get_embedding = lambda: emb
+    llm.get_llm = lambda: chat
+    helper.get_embedding_service = lambda: upload_emb
+    # st.session_state does not persist outside `streamlit run`: pin the session's namespace in the upload index
+    helper.current_session_id = lambda: "bench"
+
+    for op in ("query", "get", "upsert", "add", "delete", "count"):
+        timer.wrap(Collection, op, f"chroma.{op}")
+    # legacy retrievers get their get_relevant_documents moved to _get_relevant_documents, which invoke() calls
+    timer.wrap(llm.AnnexAwareRetriever, "_get_relevant_documents", "retrieve")
+    timer.wrap(query_expansion.CachedExpander, "expand", "expansion")
+    timer.wrap(Chroma, "max_marginal_relevance_search", "mmr")
+    timer.wrap(lexical_index.BM25Index, "get_relevant_documents", "bm25")
+    timer.wrap(llm, "fetch_annex_boost", "annex_boost")
+    timer.wrap(context_budget, "select_context", "dedup_rerank")
+    timer.wrap(parent_store, "expand_to_parents", "parent_expand")
+    timer.wrap(context_budget, "pack_to_budget", "token_pack")
+    timer.wrap(FakeChatModel, "_generate", "llm")
+    timer.wrap(llm, "_format_citations", "citations")
+    timer.wrap(helper, "build_segments_from_uploads", "parse_chunk")
+    timer.wrap(helper.UPLOAD_CHUNKER, "chunk", "chunk")
+    timer.wrap(helper, "embed_chunks", "embed")
+    timer.wrap(helper, "chroma_add_segments", "embed_insert")
+    timer.wrap(helper, "chroma_query", "query")
+
+    questions = json.load(open(args.questions, encoding="utf-8"))
+    labelled = [q for q in questions if q.get("answer_pages")]
+    rss = {"after_setup": _peak_rss_mb()}
+
+    # --- qa path
+    timer.phase = "qa"
+    qa_recall = {}
+    for r in range(args.repeat):
+        for q in questions:
+            t1 = time.perf_counter()
+            # LLM.ask without the answer cache
+            source_docs = llm._retrieve(q["question"])
+            llm.get_llm().invoke(llm._prompt_for(q["question"], source_docs))
+            llm._format_citations(source_docs)
+            timer.add("ask_total", (time.perf_counter() - t1) * 1000)
+            if r == 0 and q.get("answer_pages"):
+                qa_recall[q["id"]] = recall(pages_of(source_docs, args.k), q["answer_pages"])
+    rss["after_qa"] = _peak_rss_mb()
+
+    # --- upload path
+    timer.phase = "upload"
+    upload_recall = {}
+    if args.upload:
+        t1 = time.perf_counter()
+        segments = helper.build_segments_from_uploads([Upload(args.upload)])
+        helper.chroma_add_segments(segments)
+        timer.add("index_total", (time.perf_counter() - t1) * 1000)
+        source = os.path.basename(args.upload)
+        for r in range(args.repeat):
+            for q in labelled:
+                hits = helper.chroma_query(q["question"], top_k=args.k)
+                if r == 0 and any(a["source"] == source for a in q["answer_pages"]):
+                    # uploads number pages from 1, the labels from 0
+                    upload_recall[q["id"]] = recall(pages_of(hits, args.k, offset=1), q["answer_pages"])
+    rss["after_upload"] = _peak_rss_mb()
+
+    stages = timer.report()
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": dict({k: v for k, v in vars(args).items() if k != "out"}, **{
+            "hybrid_retrieval": llm.HYBRID_RETRIEVAL, "retrieval_mode": llm.RETRIEVAL_MODE,
+            "context_token_budget": llm.CONTEXT_TOKEN_BUDGET, "rerank_top_n": llm.RERANK_TOP_N}),
+        "setup_s": round(setup_s, 2),
+        "stages": {phase: {s: v for s, v in sv.items() if not s.startswith("chroma.")} for phase, sv in stages.items()},
+        "chroma_io": {phase: {s[len("chroma."):]: v for s, v in sv.items() if s.startswith("chroma.")}
+                      for phase, sv in stages.items()},
+        "recall_at_k": {
+            "k": args.k,
+            "qa": round(sum(qa_recall.values()) / len(qa_recall), 3) if qa_recall else None,
+            "upload": round(sum(upload_recall.values()) / len(upload_recall), 3) if upload_recall else None,
+            "per_question": {"qa": qa_recall, "upload": upload_recall},
+        },
+        "peak_rss_mb": rss,
+        "fake_model_calls": {"corpus_embed": emb.calls, "upload_embed": upload_emb.calls},
+    }
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"offline_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    for phase in ("qa", "upload"):
+        print(f"[{phase}]")
+        print(f"  {'stage':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, s in sorted(stages.get(phase, {}).items()):
+            print(f"  {name:<16}{s['n']:>6}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}")
+    print(f"recall@{args.k}: qa={results['recall_at_k']['qa']} upload={results['recall_at_k']['upload']}")
+    print(f"peak RSS MB: {rss['after_upload']}")
+    print(f"wrote {out}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Ingestion wall time: the notebook's two passes vs the single-pass page scanner.
+
+legacy  - detect_last_occurrences as in create_vector_db.ipynb (ocr_page reopens the pdf and OCRs at
+          300 dpi), then PyPDFLoader reads every page again and extract_annex_refs runs over every chunk
+scanner - helper_functions.page_scanner.scan_pdf (one read per page, adaptive-DPI OCR), label map
+          and chunk annotation from the scans; timed with a cold and a warm OCR cache
+
+Needs PyMuPDF, pytesseract (+ the tesseract binary), pypdf and langchain. Run from the repo root:
+    python benchmarks/bench_page_scanner.py [--pdf "data/Code of Practice on Sewerage ... .pdf"] [--workers 4]
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+
+def legacy(pdf_path):
+    import fitz
+    import pytesseract
+    from PIL import Image
+    from langchain_community.document_loaders import PyPDFLoader
+    from helper_functions.ingest import get_splitter
+    from helper_functions.refs import extract_annex_refs, normalize_label, ref_regex
+
+    def ocr_page(pdf_path, page_num):
+        doc = fitz.open(pdf_path)
+        pix = doc[page_num - 1].get_pixmap(dpi=300)
+        img = Image.open(io.BytesIO(pix.tobytes("png")))
+        return pytesseract.image_to_string(img)
+
+    t0 = time.perf_counter()
+    last_seen = {}
+    doc = fitz.open(pdf_path)
+    for page_index, page in enumerate(doc):
+        page_num = page_index + 1
+        text_layer = page.get_text("text")
+        ocr_text = ""
+        if not text_layer.strip() and page.get_images(full=True):
+            ocr_text = ocr_page(pdf_path, page_num)
+        for match in ref_regex.findall((text_layer or "") + "\n" + ocr_text):
+            norm = normalize_label(match)
+            if norm not in last_seen or page_num > last_seen[norm]["page"]:
+                last_seen[norm] = {"canonical": match.strip(), "page": page_num}
+    t1 = time.perf_counter()
+    splitter, n_chunks = get_splitter(), 0
+    for page_doc in PyPDFLoader(pdf_path).load():
+        for piece in splitter.split_text(page_doc.page_content):
+            extract_annex_refs(piece)
+            n_chunks += 1
+    t2 = time.perf_counter()
+    return {"labels": len(last_seen), "chunks": n_chunks, "scan_s": t1 - t0, "chunk_s": t2 - t1, "total_s": t2 - t0}
+
+
+def scanner(pdf_path, workers, cache_path):
+    from helper_functions.figures import detect_last_occurrences
+    from helper_functions.ingest import get_splitter
+    from helper_functions.page_scanner import scan_pdf
+
+    t0 = time.perf_counter()
+    scans = list(scan_pdf(pdf_path, workers=workers, ocr_cache_path=cache_path))
+    last_seen, _ = detect_last_occurrences(scans)
+    t1 = time.perf_counter()
+    splitter, n_chunks = get_splitter(), 0
+    for s in scans:
+        for piece in splitter.split_text(s.merged_text):
+            [norm for match, norm in s.refs if match in piece]
+            n_chunks += 1
+    t2 = time.perf_counter()
+    return {"labels": len(last_seen), "chunks": n_chunks, "ocr_pages": sum(bool(s.ocr_text) for s in scans),
+            "scan_s": t1 - t0, "chunk_s": t2 - t1, "total_s": t2 - t0}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pdf", default=(sorted(glob.glob("./data/*Sewerage*.pdf")) or [None])[0])
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    results = {"pdf": os.path.basename(args.pdf)}
+    if not args.skip_legacy:
+        results["legacy"] = legacy(args.pdf)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, "ocr.sqlite3")
+        results["scanner_cold"] = scanner(args.pdf, args.workers, cache_path)
+        results["scanner_warm"] = scanner(args.pdf, args.workers, cache_path)
+    for name, r in results.items():
+        if isinstance(r, dict):
+            r.update({k: round(v, 2) for k, v in r.items() if k.endswith("_s")})
+            print(f"{name:<14} total {r['total_s']:>7.2f}s  (scan {r['scan_s']:.2f}s, chunk+annotate {r['chunk_s']:.2f}s)"
+                  f"  labels={r['labels']} chunks={r['chunks']}")
+    if "legacy" in results:
+        print(f"speedup cold {results['legacy']['total_s'] / max(results['scanner_cold']['total_s'], 1e-9):.1f}x, "
+              f"warm {results['legacy']['total_s'] / max(results['scanner_warm']['total_s'], 1e-9):.1f}x")
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
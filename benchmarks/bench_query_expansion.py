@@ -0,0 +1,91 @@
+"""Latency breakdown of the query-expansion + retrieval stage, old chain vs new strategies.
+
+For every example question on Home.py this times
+  - expansion:  generating the sub-queries
+  - retrieval:  MMR retrieval for all sub-queries
+for the original MultiQueryRetriever (GPT-4 generation, sequential retrieval) and for the
+ParallelMultiQueryRetriever strategies (rules / llm / cached_llm, concurrent retrieval + RRF).
+cached_llm is run twice so the warm-cache cost shows up separately.
+
+Needs OPENAI_API_KEY in .streamlit/secrets.toml and the chroma_parent_child store. Run from the repo root:
+    python benchmarks/bench_query_expansion.py [--strategies multiquery rules llm cached_llm]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def time_multiquery(llm_module, questions):
+    retriever = llm_module.build_expanding_retriever("multiquery")
+    rows = []
+    for q in questions:
+        t0 = time.perf_counter()
+        sub_queries = retriever.llm_chain.invoke({"question": q})
+        t1 = time.perf_counter()
+        docs = [retriever.retriever.invoke(sq) for sq in [q] + list(sub_queries)]
+        t2 = time.perf_counter()
+        rows.append({"expansion_ms": (t1 - t0) * 1000, "retrieval_ms": (t2 - t1) * 1000,
+                     "sub_queries": len(sub_queries) + 1, "docs": len({d.page_content for ds in docs for d in ds})})
+    return rows
+
+
+def time_parallel(llm_module, questions, strategy):
+    from helper_functions.query_expansion import get_retrieval_pool, rrf_fuse
+    expander = llm_module.get_query_expander(strategy)
+    base = llm_module._mmr_retriever()
+    rows = []
+    for q in questions:
+        t0 = time.perf_counter()
+        sub_queries = expander.expand(q)
+        t1 = time.perf_counter()
+        fused = rrf_fuse(list(get_retrieval_pool().map(base.invoke, sub_queries)))
+        t2 = time.perf_counter()
+        rows.append({"expansion_ms": (t1 - t0) * 1000, "retrieval_ms": (t2 - t1) * 1000,
+                     "sub_queries": len(sub_queries), "docs": len(fused)})
+    return rows
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--strategies", nargs="+", default=["multiquery", "rules", "llm", "cached_llm"])
+    ap.add_argument("--questions", default=os.path.join(ROOT, "benchmarks", "example_questions.json"))
+    args = ap.parse_args()
+
+    from helper_functions import llm
+    questions = [q["question"] for q in json.load(open(args.questions, encoding="utf-8"))]
+
+    runs = []
+    for strategy in args.strategies:
+        if strategy == "multiquery":
+            runs.append(("multiquery (GPT-4, sequential)", time_multiquery(llm, questions)))
+        else:
+            runs.append((strategy, time_parallel(llm, questions, strategy)))
+            if strategy == "cached_llm":
+                runs.append(("cached_llm (warm)", time_parallel(llm, questions, strategy)))
+
+    print(f"{'strategy':<32}{'expand p50':>11}{'expand p95':>11}{'retr p50':>10}{'retr p95':>10}"
+          f"{'total p50':>11}{'subq':>6}{'docs':>6}")
+    for name, rows in runs:
+        exp = [r["expansion_ms"] for r in rows]
+        ret = [r["retrieval_ms"] for r in rows]
+        tot = [a + b for a, b in zip(exp, ret)]
+        print(f"{name:<32}{_pct(exp, .5):>11.0f}{_pct(exp, .95):>11.0f}{_pct(ret, .5):>10.0f}{_pct(ret, .95):>10.0f}"
+              f"{_pct(tot, .5):>11.0f}{statistics.mean(r['sub_queries'] for r in rows):>6.1f}"
+              f"{statistics.mean(r['docs'] for r in rows):>6.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Startup benchmark: importing helper_functions and rendering the login page must not
+touch Chroma, sentence-transformers/torch or the OpenAI chain objects.
+
+Run from the repo root:
+    python benchmarks/bench_startup.py
+
+Two measurements, each in a fresh interpreter so nothing is warm:
+  1. `from helper_functions import llm, helper` (what Home.py imports) wall time and which heavy modules
+     got loaded
+  2. a headless run of Home.py (streamlit.testing AppTest) up to the login form
+Exits non-zero if any heavy module was imported.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["chromadb", "torch", "sentence_transformers", "transformers",
+                 "langchain_community.vectorstores", "langchain_openai", "openai"]
+
+_IMPORT_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+from helper_functions import llm, helper
+elapsed = time.perf_counter() - t0
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+_LOGIN_PROBE = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+t0 = time.perf_counter()
+at = AppTest.from_file("Home.py", default_timeout=120)
+at.secrets["OPENAI_API_KEY"] = "sk-startup-benchmark"
+at.run()
+elapsed = time.perf_counter() - t0
+print(json.dumps({
+    "seconds": elapsed,
+    "login_form": any(t.value == "🔐 Login" for t in at.title),
+    "exceptions": [str(e.value) for e in at.exception],
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def _run(code: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    imp = _run(_IMPORT_PROBE)
+    print(f"import llm, helper      : {imp['seconds'] * 1000:8.1f} ms  heavy modules: {imp['loaded'] or 'none'}")
+    login = _run(_LOGIN_PROBE)
+    print(f"login page render       : {login['seconds'] * 1000:8.1f} ms  heavy modules: {login['loaded'] or 'none'}")
+    if login["exceptions"]:
+        print("login page raised:", login["exceptions"])
+    ok = not imp["loaded"] and not login["loaded"] and login["login_form"] and not login["exceptions"]
+    print("PASS" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
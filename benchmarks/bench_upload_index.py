@@ -0,0 +1,151 @@
+"""Add and query latency of the upload index backends at 100 / 1k / 10k / 50k chunks.
+
+Backends (helper_functions/upload_index.py):
+  numpy-f32  - NumpyVectorIndex, float32 matrix, exact top-k with argpartition
+  numpy-int8 - NumpyVectorIndex, int8 rows with a per-row scale (recall@k against exact search is reported)
+  chroma     - a collection of an in-memory chromadb.EphemeralClient (skipped when chromadb is missing)
+Vectors are random unit vectors around a few hundred topic centroids, so neighbours are not all equidistant.
+Chunks are added in batches of 128, like chroma_add_segments. Query latency covers a single query
+embedding with n_results=8, plus the MMR variant (numpy: mmr=True, chroma: fetch 4*k with embeddings and
+re-select with mmr_select).
+Use the results to set UPLOAD_NUMPY_MAX_CHUNKS, where "auto" moves a session from numpy to Chroma.
+
+    python benchmarks/bench_upload_index.py [--sizes 100 1000 10000 50000] [--dim 384] [--queries 200]
+                                            [--k 8] [--backends numpy-f32 numpy-int8 chroma] [--out ...]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from helper_functions.vector_index import NumpyVectorIndex, mmr_select  # noqa: E402
+
+BATCH = 128
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else None
+
+
+def make_data(n: int, dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((max(8, n // 50), dim)).astype(np.float32)
+    vecs = centroids[rng.integers(0, len(centroids), n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    ids = [f"doc::{i}" for i in range(n)]
+    docs = [f"chunk {i} of an uploaded document about topic {i % 97}" for i in range(n)]
+    metas = [{"source": f"file{i % 5}.pdf", "page": i // 20 + 1} for i in range(n)]
+    return ids, vecs, docs, metas
+
+
+def make_queries(vecs: np.ndarray, n: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    q = vecs[rng.integers(0, len(vecs), n)] + 0.3 * rng.standard_normal((n, vecs.shape[1])).astype(np.float32)
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def make_backend(name: str, n: int):
+    if name.startswith("numpy"):
+        return NumpyVectorIndex("bench", dtype="int8" if name.endswith("int8") else "float32")
+    import chromadb
+    from chromadb.config import Settings
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False, allow_reset=True))
+    try:
+        client.delete_collection(f"bench_{n}")
+    except Exception:
+        pass
+    return client.get_or_create_collection(f"bench_{n}")
+
+
+def query(backend, name: str, q: np.ndarray, k: int, mmr: bool):
+    if not mmr:
+        return backend.query(query_embeddings=[q.tolist()], n_results=k)["ids"][0]
+    if name.startswith("numpy"):
+        return backend.query(query_embeddings=[q], n_results=k, mmr=True)["ids"][0]
+    res = backend.query(query_embeddings=[q.tolist()], n_results=4 * k, include=["embeddings"])
+    keep = mmr_select(q, np.asarray(res["embeddings"][0], dtype=np.float32), k)
+    return [res["ids"][0][i] for i in keep]
+
+
+def run(name: str, n: int, dim: int, n_queries: int, k: int) -> dict:
+    ids, vecs, docs, metas = make_data(n, dim)
+    qs = make_queries(vecs, n_queries)
+    backend = make_backend(name, n)
+    t0 = time.perf_counter()
+    for i in range(0, n, BATCH):
+        # chroma_add_segments passes python lists (embed_chunks output)
+        backend.upsert(ids=ids[i:i + BATCH], embeddings=vecs[i:i + BATCH].tolist(),
+                       documents=docs[i:i + BATCH], metadatas=metas[i:i + BATCH])
+    add_s = time.perf_counter() - t0
+
+    query(backend, name, qs[0], k, False)  # warm-up
+    lat, lat_mmr, recall = [], [], []
+    for q in qs:
+        t1 = time.perf_counter()
+        got = query(backend, name, q, k, False)
+        lat.append((time.perf_counter() - t1) * 1000)
+        exact = np.argpartition(-(vecs @ q), k - 1)[:k]
+        recall.append(len({f"doc::{j}" for j in exact} & set(got)) / k)
+    for q in qs[: max(1, n_queries // 4)]:
+        t1 = time.perf_counter()
+        query(backend, name, q, k, True)
+        lat_mmr.append((time.perf_counter() - t1) * 1000)
+    out = {
+        "backend": name,
+        "chunks": n,
+        "add_total_ms": round(add_s * 1000, 1),
+        "add_per_1k_ms": round(add_s * 1000 / (n / 1000), 1),
+        "query_p50_ms": round(_pct(lat, .5), 3),
+        "query_p95_ms": round(_pct(lat, .95), 3),
+        "mmr_p50_ms": round(_pct(lat_mmr, .5), 3),
+        f"recall@{k}": round(float(np.mean(recall)), 4),
+    }
+    if isinstance(backend, NumpyVectorIndex):
+        out["vector_mb"] = round(backend.nbytes() / 2**20, 2)
+    return out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    ap.add_argument("--dim", type=int, default=384, help="all-MiniLM-L6-v2 is 384")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--backends", nargs="+", default=["numpy-f32", "numpy-int8", "chroma"],
+                    choices=["numpy-f32", "numpy-int8", "chroma"])
+    ap.add_argument("--out", default=None, help="JSON results (default benchmarks/results/upload_index_<time>.json)")
+    args = ap.parse_args()
+
+    backends = list(args.backends)
+    if "chroma" in backends:
+        try:
+            import chromadb  # noqa: F401
+        except ImportError:
+            print("chromadb is not installed, skipping the chroma backend")
+            backends.remove("chroma")
+
+    rows = []
+    for n in args.sizes:
+        for name in backends:
+            row = run(name, n, args.dim, args.queries, args.k)
+            rows.append(row)
+            print(json.dumps(row))
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"upload_index_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"config": vars(args), "results": rows}, f, indent=2)
+    print(f"results written to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
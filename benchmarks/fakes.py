@@ -0,0 +1,81 @@
+"""Deterministic, network-free stand-ins for the OpenAI models, used by the offline benchmarks.
+
+HashingEmbeddings - feature-hashing bag of words/bigrams (same tokenizer as the BM25 index), L2 normalized.
+                    Similar texts get similar vectors, so MMR and recall@k stay meaningful.
+                    Also exposes encode() so it can replace the upload EmbeddingService.
+FakeChatModel     - a LangChain chat model that "answers" with the opening words of the context it was
+                    given, with optional fixed latency, and streams word by word.
+"""
+import hashlib
+import re
+import time
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from helper_functions.lexical_index import tokenize
+
+
+class HashingEmbeddings(Embeddings):
+    def __init__(self, dim: int = 1536, latency_ms: float = 0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self.texts = 0
+
+    def _vec(self, text: str) -> np.ndarray:
+        tokens = tokenize(text)
+        v = np.zeros(self.dim, dtype=np.float32)
+        for term in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            h = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+            v[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        self.calls += 1
+        self.texts += len(texts)
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return np.stack([self._vec(t) for t in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+_context_re = re.compile(r"Context(?: excerpts)?:\s*(.*?)(?:\n\s*(?:User )?[Qq]uestion:|$)", re.S)
+
+
+class FakeChatModel(BaseChatModel):
+    latency_ms: float = 0.0
+    answer_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, messages: List[BaseMessage]) -> str:
+        prompt = str(messages[-1].content) if messages else ""
+        m = _context_re.search(prompt)
+        words = (m.group(1) if m else prompt).split()[: self.answer_words]
+        return "According to the Code of Practice, " + " ".join(words)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        for word in self._answer(messages).split(" "):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
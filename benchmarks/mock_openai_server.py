@@ -0,0 +1,256 @@
+"""Local stand-in for the OpenAI API, for load tests without network or an API key.
+
+Implements just what the app calls:
+  POST /v1/chat/completions  - plain JSON or server-sent events (stream=true); the answer is a canned text
+                               that echoes the start of the last message, sent as --tokens word pieces
+  POST /v1/embeddings        - deterministic feature-hashing vectors (same text -> same vector)
+  GET  /stats                - request counts, peak concurrency and rate-limited responses
+                               (/stats?reset=1 also restarts the peak concurrency count)
+Latency is simulated with sleeps (time to first token plus a delay per token), so many requests can be
+in flight at once. With --max-concurrent N the server answers 429 with a retry-after-ms header whenever
+more than N chat requests are in flight, like an account-level rate limit; --error-rate adds random 500s.
+
+Point the app or a script at it with
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock
+Run standalone:
+    python benchmarks/mock_openai_server.py [--port 8765] [--ttft-ms 400] [--token-ms 15] [--tokens 60]
+                                            [--max-concurrent 0] [--retry-after-ms 200] [--error-rate 0]
+or in-process with serve(...).
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockState:
+    def __init__(self, ttft_ms=400.0, token_ms=15.0, tokens=60, max_concurrent=0, retry_after_ms=200,
+                 error_rate=0.0, embed_dim=1536, embed_ms=20.0, seed=0):
+        self.ttft_ms = ttft_ms
+        self.token_ms = token_ms
+        self.tokens = tokens
+        self.max_concurrent = max_concurrent
+        self.retry_after_ms = retry_after_ms
+        self.error_rate = error_rate
+        self.embed_dim = embed_dim
+        self.embed_ms = embed_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"chat": 0, "embeddings": 0, "rate_limited": 0, "errors": 0, "max_in_flight": 0}
+
+    #reserve a chat slot; False means the request should get a 429
+    def enter(self) -> bool:
+        with self.lock:
+            if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                self.stats["rate_limited"] += 1
+                return False
+            self.in_flight += 1
+            self.stats["chat"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def fail_randomly(self) -> bool:
+        with self.lock:
+            failed = self.error_rate > 0 and self.rng.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+            return failed
+
+    def snapshot(self, reset_peak: bool = False) -> dict:
+        with self.lock:
+            out = dict(self.stats, in_flight=self.in_flight)
+            if reset_peak:
+                self.stats["max_in_flight"] = self.in_flight
+            return out
+
+
+def _hash_embedding(text: str, dim: int):
+    vec = [0.0] * dim
+    for tok in text.lower().split():
+        h = int.from_bytes(hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def _answer_pieces(messages, n_tokens: int):
+    last = (messages[-1].get("content") if messages else "") or ""
+    if isinstance(last, list):  # content parts
+        last = " ".join(p.get("text", "") for p in last if isinstance(p, dict))
+    words = ("Mock answer: " + " ".join(last.split()[:20])).split()
+    return [(w if i == 0 else " " + w) for i, w in enumerate((words * (n_tokens // max(len(words), 1) + 1))[:n_tokens])]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "MockOpenAI/1.0"
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection pooling is exercised
+
+    @property
+    def state(self) -> MockState:
+        return self.server.state
+
+    def log_message(self, fmt, *args):  # keep the load test output readable
+        pass
+
+    def _json(self, code: int, body: dict, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path.rstrip("/").endswith("/stats"):
+            self._json(200, self.state.snapshot(reset_peak="reset=1" in query))
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path.endswith("/embeddings"):
+            self._embeddings(body)
+        elif self.path.endswith("/chat/completions"):
+            self._chat(body)
+        else:
+            self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _embeddings(self, body: dict):
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        with self.state.lock:
+            self.state.stats["embeddings"] += 1
+        time.sleep(self.state.embed_ms / 1000)
+        data = []
+        for i, text in enumerate(inputs):
+            if not isinstance(text, str):  # token ids
+                text = " ".join(map(str, text))
+            data.append({"object": "embedding", "index": i, "embedding": _hash_embedding(text, self.state.embed_dim)})
+        self._json(200, {"object": "list", "data": data, "model": body.get("model", "mock"),
+                         "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    def _chat(self, body: dict):
+        state = self.state
+        if state.fail_randomly():
+            self._json(500, {"error": {"message": "mock server error", "type": "server_error"}})
+            return
+        if not state.enter():
+            self._json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error",
+                                       "code": "rate_limit_exceeded"}},
+                       headers={"retry-after-ms": str(state.retry_after_ms)})
+            return
+        try:
+            pieces = _answer_pieces(body.get("messages") or [], state.tokens)
+            model = body.get("model", "mock")
+            created = int(time.time())
+            cid = f"chatcmpl-mock{random.getrandbits(40):x}"
+            prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages") or [])
+            time.sleep(state.ttft_ms / 1000)
+            if not body.get("stream"):
+                time.sleep(state.token_ms * len(pieces) / 1000)
+                self._json(200, {
+                    "id": cid, "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(pieces)}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces),
+                              "total_tokens": prompt_tokens + len(pieces)},
+                })
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def send(obj):
+                data = ("data: " + (obj if isinstance(obj, str) else json.dumps(obj)) + "\n\n").encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def chunk(delta, finish=None):
+                return {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+            send(chunk({"role": "assistant", "content": ""}))
+            for p in pieces:
+                send(chunk({"content": p}))
+                time.sleep(state.token_ms / 1000)
+            send(chunk({}, "stop"))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client gave up (timeout / cancelled stream)
+        finally:
+            state.leave()
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, addr, state: MockState):
+        super().__init__(addr, MockHandler)
+        self.state = state
+
+    def handle_error(self, request, client_address):
+        # clients closing idle keep-alive connections is normal under load
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+#start a server on a background thread; port 0 picks a free port. Call .shutdown() when done
+def serve(host: str = "127.0.0.1", port: int = 0, **state_kwargs) -> MockServer:
+    server = MockServer((host, port), MockState(**state_kwargs))
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--ttft-ms", type=float, default=400.0, help="delay before the first token")
+    ap.add_argument("--token-ms", type=float, default=15.0, help="delay per streamed token")
+    ap.add_argument("--tokens", type=int, default=60, help="tokens per answer")
+    ap.add_argument("--max-concurrent", type=int, default=0, help="429 above this many chat requests (0 = off)")
+    ap.add_argument("--retry-after-ms", type=int, default=200)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of chat requests answered with 500")
+    ap.add_argument("--embed-dim", type=int, default=1536)
+    args = ap.parse_args()
+    server = MockServer((args.host, args.port), MockState(
+        ttft_ms=args.ttft_ms, token_ms=args.token_ms, tokens=args.tokens, max_concurrent=args.max_concurrent,
+        retry_after_ms=args.retry_after_ms, error_rate=args.error_rate, embed_dim=args.embed_dim))
+    print(f"mock OpenAI listening on {server.base_url}  (OPENAI_BASE_URL={server.base_url} OPENAI_API_KEY=mock)",
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
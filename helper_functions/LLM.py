@@ -6,79 +6,125 @@ try:
 except Exception:
     pass
 import os
-import re
 import json
+import asyncio
+import time
+import logging
 from pathlib import Path
 import streamlit as st
 from dotenv import load_dotenv
 from langchain.schema import Document
-from langchain_community.vectorstores import Chroma
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.chains import RetrievalQA
-from langchain.retrievers.multi_query import MultiQueryRetriever
-from openai import OpenAI
 
+#Chroma, the OpenAI clients and the chains are imported inside the get_* factories below, so importing
+#this module (and rendering the login page) stays cheap. Everything heavy is built on first use and
+#shared by all sessions of the server process through st.cache_resource.
 from langchain.schema.retriever import BaseRetriever
 from typing import Optional, List
 from langchain.callbacks.manager import CallbackManagerForRetrieverRun
 from langchain.prompts import PromptTemplate
 
+from . import settings, tracing
+from .answer_cache import AnswerCache, query_specifics, store_fingerprint
+from .chunker import locator
+from .refs import extract_annex_refs, normalize_label, ref_regex  # noqa: F401 (re-exported)
+
 # load_dotenv(Path(__file__).resolve().parent / ".env")
 # API_KEY = os.getenv("OPENAI_API_KEY")
-API_KEY = st.secrets.get("OPENAI_API_KEY")
-with open("./helper_functions/label_map.json", "r", encoding="utf-8") as f:
-    global_label_map = json.load(f)
+#streamlit secrets when running the app; fall back to the environment for notebooks/CLIs without secrets.toml
+try:
+    API_KEY = st.secrets.get("OPENAI_API_KEY")
+except Exception:
+    API_KEY = None
+API_KEY = API_KEY or os.getenv("OPENAI_API_KEY")
+latency_logger = logging.getLogger("pub_rag.latency")
+LLM_MODEL = "gpt-4"
+#model for questions over uploaded documents (temp context)
+TEMP_CONTEXT_MODEL = "gpt-4o"
+
+@st.cache_resource
+def get_label_map() -> dict:
+    with open(settings.LABEL_MAP_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
 
 #load vectordb
-embedding = OpenAIEmbeddings(openai_api_key=API_KEY)
-vectordb = Chroma(
-    persist_directory="chroma_parent_child",
-    embedding_function=embedding
-)
+#query embeddings go through QueryEmbeddings: batched, in-memory LRU plus a persistent cache keyed by
+#(model, normalized text) unless QUERY_EMBEDDING_CACHE=0
+QUERY_EMBEDDING_CACHE = settings.env_bool("QUERY_EMBEDDING_CACHE", True)
+
+@st.cache_resource
+def get_query_embedding_cache():
+    from .embedding_cache import EmbeddingCache
+    return EmbeddingCache(settings.cache_path("query_embeddings.sqlite3"),
+                          max_entries=settings.env_int("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", 50_000))
+
+@st.cache_resource
+def get_embedding():
+    from langchain_openai import OpenAIEmbeddings
+    from .query_embeddings import QueryEmbeddings
+    inner = OpenAIEmbeddings(openai_api_key=API_KEY)
+    return QueryEmbeddings(inner, model=inner.model,
+                           cache=get_query_embedding_cache() if QUERY_EMBEDDING_CACHE else None,
+                           max_entries=settings.env_int("QUERY_EMBEDDING_MEMORY_ENTRIES", 4096))
+
+@st.cache_resource
+def get_vectordb():
+    from langchain_community.vectorstores import Chroma
+    return Chroma(
+        persist_directory=settings.VECTOR_DB_DIR,
+        embedding_function=get_embedding()
+    )
 
 
 ### This part is to extract the annex => map using mapping json => retrieve annex data from metadata
-# references in documents come in many different forms and need to be normalized. e.g. annex K, AnnexK, Annex  K -> annex k
-ref_regex = re.compile(
-    r"\b(?:annex|appendix)\s+[a-z\d]+\b"
-    r"|\bdrawing\s+no\.?\s*\d+\b"
-    r"|\bfigure\s+\d+(?:\.\d+)*\b",
-    re.IGNORECASE
-)
+#(ref_regex / normalize_label / extract_annex_refs live in refs.py, shared with the offline tools)
 
-def normalize_label(label: str) -> str: 
-    label = label.lower().replace("\n", " ")
-    label = re.sub(r"\s+", " ", label.strip())
-    label = re.sub(r"(\bno)\s*(\d)", r"\1 \2", label)  
-    return label
-def extract_annex_refs(text):
-    matches = ref_regex.findall(text)
-    return list(set([normalize_label(m) for m in matches]))
+#max number of boosted annex/figure docs per question (ANNEX_BOOST_CAP)
+ANNEX_BOOST_CAP = settings.env_int("ANNEX_BOOST_CAP", 6)
 
-def fetch_annex_boost(vectordb: Chroma, query_refs: list[str]) -> list[Document]:
+#label -> chunk ids / figure doc ids, built at ingestion and saved next to label_map.json
+@st.cache_resource
+def get_ref_index() -> dict:
+    from .ref_index import REF_INDEX_FILENAME, build_ref_index_from_chroma, load_ref_index, save_ref_index
+    path = os.path.join(os.path.dirname(settings.LABEL_MAP_PATH), REF_INDEX_FILENAME)
+    index = load_ref_index(path)
+    if index is None:
+        # store built before the index existed: derive it from the collection metadata once
+        index = build_ref_index_from_chroma(get_vectordb()._collection)
+        try:
+            save_ref_index(index, path)
+        except OSError:
+            pass
+    return index
+
+def _doc_key(d: Document):
+    return (d.metadata.get("source"), d.metadata.get("page"), d.page_content)
+
+#resolve the query's references through the inverted index and fetch those docs by id.
+#docs already in `base_results` are not fetched again
+def fetch_annex_boost(vectordb, query_refs: list[str], base_results: Optional[List[Document]] = None,
+                      cap: int = ANNEX_BOOST_CAP) -> list[Document]:
     if not query_refs:
         return []
+    from .ref_index import resolve_boost_ids
+    with tracing.span("annex_boost", refs=len(query_refs)) as sp:
+        base_results = base_results or []
+        ids = resolve_boost_ids(get_ref_index(), query_refs, cap=cap,
+                                exclude=[d.id for d in base_results if getattr(d, "id", None)])
+        if not ids:
+            return []
 
-    # Build a metadata filter:
-    # - annex_refs is a LIST field -> use $contains once per ref
-    # - figure_label_norm is a SCALAR -> use $in
-    where = {
-        "$or": (
-            [{"annex_refs": {"$contains": r}} for r in query_refs] +
-            [{"figure_label_norm": {"$in": query_refs}}]
+        # Access the underlying Chroma collection to avoid embeddings/query. direct get by id
+        res = vectordb._collection.get(
+            ids=ids,
+            include=["documents", "metadatas"]
         )
-    }
-
-    # Access the underlying Chroma collection to avoid embeddings/query. fetch the annex references mapped using label
-    res = vectordb._collection.get(               
-        where=where,
-        include=["documents", "metadatas"]
-    )
-
-    return [
-        Document(page_content=d, metadata=m)
-        for d, m in zip(res["documents"], res["metadatas"])
-    ]
+        # keep the index's priority order (figures first, annex body before passing mentions)
+        by_id = {i: Document(page_content=d, metadata=m)
+                 for i, d, m in zip(res["ids"], res["documents"], res["metadatas"])}
+        seen = {_doc_key(d) for d in base_results}
+        boost = [by_id[i] for i in ids if i in by_id and _doc_key(by_id[i]) not in seen]
+        sp.set(docs=len(boost))
+        return boost
 
 class AnnexAwareRetriever(BaseRetriever):
     def __init__(self, base_retriever, label_map, query=""):
@@ -95,11 +141,93 @@ class AnnexAwareRetriever(BaseRetriever):
     ) -> List[Document]:
         query_refs = extract_annex_refs(query)
         mapped_refs = [self._label_map.get(r, r) for r in query_refs]
-        base_results = self._base_retriever.get_relevant_documents(query)
+        with tracing.span("base_retrieval") as sp:
+            base_results = self._base_retriever.get_relevant_documents(query)
+            sp.set(docs=len(base_results))
+
+        # Hybrid: fuse the dense results with the BM25 lexical hits for exact tokens
+        lexical = get_lexical_index() if HYBRID_RETRIEVAL else None
+        if lexical is not None:
+            from .query_expansion import rrf_fuse
+            with tracing.span("bm25") as sp:
+                lexical_results = lexical.get_relevant_documents(query, k=BM25_K)
+                sp.set(docs=len(lexical_results))
+            base_results = rrf_fuse([base_results, lexical_results])
 
         # Boost docs with matching annex refs
-        annex_boost = fetch_annex_boost(vectordb, query_refs)
-        return annex_boost + base_results
+        annex_boost = fetch_annex_boost(get_vectordb(), query_refs, base_results)
+        retrieved = annex_boost + base_results
+
+        # Collapse near-duplicates and rerank everything but the boosts
+        from . import context_budget
+        with tracing.span("rerank", docs_in=len(retrieved)) as sp:
+            docs = context_budget.select_context(query, retrieved, pinned=len(annex_boost), reranker=get_reranker(),
+                                                 top_n=RERANK_TOP_N)
+            sp.set(docs_out=len(docs))
+
+        # Parent mode: hand the LLM whole parent pages instead of 1000-char children
+        parents = get_parent_store() if RETRIEVAL_MODE == "parent" else None
+        if parents is not None:
+            from .parent_store import expand_to_parents
+            with tracing.span("parent_expand"):
+                docs = expand_to_parents(docs, parents, token_budget=CONTEXT_TOKEN_BUDGET, model=LLM_MODEL)
+
+        # Hard token budget for the "stuff" prompt, boosts first
+        with tracing.span("pack") as sp:
+            docs, tokens_out = context_budget.pack_to_budget(docs, CONTEXT_TOKEN_BUDGET, MAX_DOC_TOKENS,
+                                                             model=LLM_MODEL)
+            sp.set(docs=len(docs), context_tokens=tokens_out)
+        context_budget.log_budget(query, retrieved, docs, tokens_out, model=LLM_MODEL)
+        return docs
+
+#sparse lexical index stored next to the Chroma store, fused with the dense results (HYBRID_RETRIEVAL)
+HYBRID_RETRIEVAL = settings.env_bool("HYBRID_RETRIEVAL", True)
+BM25_K = settings.env_int("BM25_K", 5)
+
+@st.cache_resource
+def get_lexical_index():
+    from .lexical_index import BM25_FILENAME, BM25Index
+    path = os.path.join(settings.VECTOR_DB_DIR, BM25_FILENAME)
+    if os.path.exists(path):
+        return BM25Index.load(path)
+    # store built before the lexical index existed: derive it from Chroma once and persist it
+    index = BM25Index.from_chroma_collection(get_vectordb()._collection)
+    try:
+        index.save(path)
+    except OSError:
+        pass
+    return index
+
+#retrieval mode (RETRIEVAL_MODE): "parent" expands top child hits to their deduplicated parent pages from
+#the parent docstore, within CONTEXT_TOKEN_BUDGET tokens; "child" sends the child chunks as they are.
+#parent mode silently behaves like child mode when the store was built without a parent docstore
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "parent")
+
+@st.cache_resource
+def get_parent_store():
+    from .parent_store import PARENT_STORE_FILENAME, ParentStore
+    return ParentStore.open_existing(os.path.join(settings.VECTOR_DB_DIR, PARENT_STORE_FILENAME))
+
+#post-retrieval budget: hard cap on context tokens sent to the LLM, per-doc cap (long diagram captions),
+#and how many reranked (non-boost) docs to keep. RERANKER: lexical (default), cross_encoder (local CPU) or none.
+#cross_encoder loads sentence-transformers/torch into the first question that needs it, so it is opt-in
+CONTEXT_TOKEN_BUDGET = settings.env_int("CONTEXT_TOKEN_BUDGET", 6000)
+MAX_DOC_TOKENS = settings.env_int("MAX_DOC_TOKENS", 1500)
+RERANK_TOP_N = settings.env_int("RERANK_TOP_N", 8)
+RERANKER = os.getenv("RERANKER", "lexical")
+
+@st.cache_resource
+def get_reranker():
+    from .context_budget import CrossEncoderReranker, LexicalReranker
+    if RERANKER == "cross_encoder":
+        try:
+            return CrossEncoderReranker(os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"))
+        except Exception:
+            latency_logger.warning("cross-encoder unavailable, falling back to the lexical reranker")
+            return LexicalReranker()
+    if RERANKER == "lexical":
+        return LexicalReranker()
+    return None
 
 #define prompts
 RAG_ROLE = (
@@ -135,68 +263,405 @@ RAG_PROMPT = PromptTemplate(
 
 #create QA chain
 #mmr => multi query => load my annexaware retriever
-llm = ChatOpenAI(model_name="gpt-4", temperature=0)
-base_retriever = vectordb.as_retriever(search_type="mmr", search_kwargs={"k": 5, "lambda_mult": 0.6})
-multi_query_retriever = MultiQueryRetriever.from_llm(retriever=base_retriever, llm=llm)
-retriever = AnnexAwareRetriever(base_retriever=multi_query_retriever, label_map=global_label_map)
-
-qa_chain = RetrievalQA.from_chain_type(
-    llm=llm, 
-    chain_type="stuff", 
-    retriever=retriever, 
-    return_source_documents=True,
-    chain_type_kwargs = {"prompt": RAG_PROMPT})
+@st.cache_resource
+def get_llm():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model_name=LLM_MODEL, temperature=0, openai_api_key=API_KEY)
+
+#raw OpenAI clients for the temp-context path and ask_async, pooled and shared by all sessions
+def get_openai_client():
+    from .openai_pool import get_sync_client
+    return get_sync_client(API_KEY)
+
+@st.cache_resource
+def get_async_runner():
+    from .openai_pool import AsyncRunner
+    return AsyncRunner(name="pub-rag-async")
+
+@st.cache_resource
+def get_async_pool():
+    from .openai_pool import AsyncOpenAIPool
+    return AsyncOpenAIPool(api_key=API_KEY)
+
+#query expansion strategy in front of MMR (QUERY_EXPANSION):
+#  cached_llm (default) - small/fast model, cached per normalized query
+#  llm                  - small/fast model, no cache
+#  rules                - local synonyms + label_map vocabulary, no API call
+#  none                 - the question only
+#  multiquery           - the original MultiQueryRetriever on GPT-4
+QUERY_EXPANSION = os.getenv("QUERY_EXPANSION", "cached_llm")
+
+@st.cache_resource
+def get_query_expander(strategy: str = QUERY_EXPANSION):
+    from .query_expansion import CachedExpander, LLMExpander, RuleBasedExpander
+    if strategy == "rules":
+        return CachedExpander(RuleBasedExpander(get_label_map()))
+    if strategy in ("llm", "cached_llm"):
+        from langchain_openai import ChatOpenAI
+        fast_llm = ChatOpenAI(model_name=os.getenv("QUERY_EXPANSION_MODEL", "gpt-4o-mini"),
+                              temperature=0, openai_api_key=API_KEY)
+        expander = LLMExpander(fast_llm, n=settings.env_int("QUERY_EXPANSION_N", 3))
+        return CachedExpander(expander) if strategy == "cached_llm" else expander
+    return None
+
+#dense MMR search behind query expansion (VECTOR_BACKEND):
+#  chroma (default) - vectordb.as_retriever(search_type="mmr"), one Chroma query per sub-query
+#  mmap             - mmap_index.py: the store's embeddings exported to a memory-mapped float32 matrix shared
+#                     by all processes, all sub-queries of a request scored in one matrix multiply, MMR in NumPy
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+#mmap only: rows of the compressed scan (settings.VECTOR_COMPRESSION) re-scored in float32 per sub-query
+VECTOR_RESCORE = settings.env_int("VECTOR_RESCORE", 80)
+
+@st.cache_resource
+def get_mmap_index():
+    from .mmap_index import MMAP_INDEX_DIRNAME, MmapVectorIndex, export_from_chroma
+    path = os.path.join(settings.VECTOR_DB_DIR, MMAP_INDEX_DIRNAME)
+    collection = get_vectordb()._collection
+    compression = settings.VECTOR_COMPRESSION
+    try:
+        index = MmapVectorIndex.load(path, compression=compression, rescore=VECTOR_RESCORE)
+    except (OSError, ValueError, KeyError):
+        index = None
+    # store built before the export (or the compressed copy) existed, or changed without re-running ingest
+    if index is None or index.count() != collection.count():
+        export_from_chroma(collection, path, compression=compression)
+        index = MmapVectorIndex.load(path, compression=compression, rescore=VECTOR_RESCORE)
+    return index
+
+def _mmr_retriever():
+    if VECTOR_BACKEND == "mmap":
+        from .mmap_index import MmapMMRRetriever
+        return MmapMMRRetriever(get_mmap_index(), get_embedding(), k=5, fetch_k=20, lambda_mult=0.6)
+    return get_vectordb().as_retriever(search_type="mmr", search_kwargs={"k": 5, "lambda_mult": 0.6})
+
+#base retriever with query expansion for a given strategy (see QUERY_EXPANSION)
+def build_expanding_retriever(strategy: str = QUERY_EXPANSION):
+    base_retriever = _mmr_retriever()
+    if strategy == "multiquery":
+        from langchain.retrievers.multi_query import MultiQueryRetriever
+        return MultiQueryRetriever.from_llm(retriever=base_retriever, llm=get_llm())
+    expander = get_query_expander(strategy)
+    if expander is None:
+        return base_retriever
+    from .query_expansion import ParallelMultiQueryRetriever
+    return ParallelMultiQueryRetriever(base_retriever=base_retriever, expander=expander,
+                                       prefetch=getattr(get_embedding(), "prefetch", None))
+
+@st.cache_resource
+def get_retriever() -> AnnexAwareRetriever:
+    return AnnexAwareRetriever(base_retriever=build_expanding_retriever(), label_map=get_label_map())
+
+#module attributes that used to be built eagerly at import time; resolved lazily now (PEP 562)
+_LAZY_ATTRS = {
+    "global_label_map": get_label_map,
+    "embedding": get_embedding,
+    "vectordb": get_vectordb,
+    "llm": get_llm,
+    "retriever": get_retriever,
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return _LAZY_ATTRS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+#answer cache in front of retrieval and the LLM call, shared by all sessions of this server process
+ANSWER_CACHE_ENABLED = settings.env_bool("ANSWER_CACHE_ENABLED", True)
+
+#numbers, units and normalized references ("annex j", "figure 3") of a question: a semantic cache hit must
+#have the same ones, otherwise it answers a different requirement
+def _answer_cache_specifics(query: str) -> frozenset:
+    return query_specifics(query) | frozenset(extract_annex_refs(query))
+
+@st.cache_resource
+def get_answer_cache() -> AnswerCache:
+    return AnswerCache(
+        settings.cache_path("answers.sqlite3"),
+        ttl_seconds=settings.env_float("ANSWER_CACHE_TTL_SECONDS", 7 * 24 * 3600),
+        max_entries=settings.env_int("ANSWER_CACHE_MAX_ENTRIES", 1000),
+        similarity_threshold=settings.env_float("ANSWER_CACHE_SIMILARITY", 0.95),
+        specifics=_answer_cache_specifics,
+    )
+
+#changes whenever chroma_parent_child is rebuilt or the prompt/model changes. Computed once per server
+#process (like the store itself, a rebuilt store is picked up on restart), from the ingest manifest; the
+#BM25 index and vector export this process writes into the store directory on first use are left out
+@st.cache_resource
+def _answer_fingerprint() -> str:
+    from .ingest import MANIFEST_FILENAME
+    from .lexical_index import BM25_FILENAME
+    from .mmap_index import MMAP_INDEX_DIRNAME
+    return store_fingerprint(settings.VECTOR_DB_DIR, RAG_PROMPT.template, LLM_MODEL, QUERY_EXPANSION, HYBRID_RETRIEVAL,
+                             RETRIEVAL_MODE, CONTEXT_TOKEN_BUDGET, MAX_DOC_TOKENS, RERANK_TOP_N, RERANKER,
+                             VECTOR_BACKEND, settings.VECTOR_COMPRESSION, VECTOR_RESCORE,
+                             build_file=MANIFEST_FILENAME, exclude=(BM25_FILENAME, MMAP_INDEX_DIRNAME))
+
+#exact lookup first, then semantic near-duplicate lookup.
+#returns (hit, query_embedding) so a miss can reuse the embedding when storing the answer.
+#The question is embedded as retrieval embeds it (its first sub-query), so on a miss retrieval finds the
+#vector in the query-embedding cache instead of paying a second embedding call
+def _lookup_cached_answer(query: str, fingerprint: str):
+    cache = get_answer_cache()
+    hit = cache.get_exact(query, fingerprint)
+    if hit is not None:
+        return hit, None
+    q_emb = get_embedding().embed_query(query)
+    return cache.get_similar(query, q_emb, fingerprint), q_emb
+
 #get citation
 def _format_citations(source_docs, max_refs=5) -> str:
     seen = set()
     out = []
-    for d in source_docs:
-        name = d.metadata.get("source")
-        page = d.metadata.get("page")
-        if not name:
-            continue
-        key = (name, page)
-        if key in seen:
-            continue
-        seen.add(key)
-        if page is not None:
-            out.append(f"[source: {name} p.{int(page)}]")
-        else:
-            out.append(f"[source: {name}]")
-        if len(out) >= max_refs:
-            break
+    with tracing.span("citations") as sp:
+        for d in source_docs:
+            name = d.metadata.get("source")
+            if not name:
+                continue
+            #"p.10 §1.2.4": page and clause when the chunker recorded one (docx/txt uploads have no page)
+            loc = locator(d.metadata)
+            key = (name, loc)
+            if key in seen:
+                continue
+            seen.add(key)
+            out.append(f"[source: {name} {loc}]" if loc else f"[source: {name}]")
+            if len(out) >= max_refs:
+                break
+        sp.set(refs=len(out))
     return " ".join(out)
+#system prompt for the temp-context path (uploaded documents)
+TEMP_CONTEXT_SYSTEM_MSG = (
+    '''
+    You are a concise, accurate assistant.
+    "If the user's message includes a 'Context' or 'Context excerpts' block, 
+    ground your answer strictly in it and cite like [source: p.page]. 
+    If no context is present, answer concisely from general knowledge.
+    '''
+)
+
+def _temp_context_messages(query):
+    return [
+        {"role": "system", "content": TEMP_CONTEXT_SYSTEM_MSG},
+        {"role": "user", "content": query},
+    ]
+
+#same prompt the "stuff" chain builds: documents joined by blank lines into RAG_PROMPT
+def _build_rag_prompt(query, source_docs) -> str:
+    context = "\n\n".join(d.page_content for d in source_docs)
+    return RAG_PROMPT.format(context=context, question=query)
+
+#cache lookup, traced with whether it hit
+def _cached_answer(query, fingerprint):
+    with tracing.span("answer_cache") as sp:
+        hit, q_emb = _lookup_cached_answer(query, fingerprint)
+        sp.set(cache_hit=hit is not None)
+    tracing.annotate(cache_hit=hit is not None)
+    return hit, q_emb
+
+def _retrieve(query):
+    with tracing.span("retrieve") as sp:
+        source_docs = get_retriever().invoke(query)
+        sp.set(docs=len(source_docs))
+    return source_docs
+
+def _prompt_for(query, source_docs):
+    with tracing.span("prompt") as sp:
+        prompt = _build_rag_prompt(query, source_docs)
+        if tracing.enabled():
+            sp.set(prompt_tokens=_count_tokens(prompt))
+    return prompt
+
+def _count_tokens(text):
+    from .tokens import count_tokens
+    return count_tokens(text, LLM_MODEL)
+
 #Ask Function
 def ask(query, temp_context=False):
-    #using persistant vectorDB
-    if temp_context == False:
-
-        result = qa_chain({"query": query})
-        answer = result["result"]
-        citations = _format_citations(result.get("source_documents", []))
-        if citations:
-            answer = f"{answer}{citations}"
-    elif temp_context: #only when using temp context. 
-        # temp_context=True, use OpenAI directly.
-        # Expect `query` to already contain any context block you assembled upstream (e.g., "Context excerpts: ...").
-        client = OpenAI(api_key=API_KEY)
-        system_msg = (
-            '''
-            You are a concise, accurate assistant.
-            "If the user's message includes a 'Context' or 'Context excerpts' block, 
-            ground your answer strictly in it and cite like [source: p.page]. 
-            If no context is present, answer concisely from general knowledge.
-            '''
-        )
-        resp = client.chat.completions.create(
-            model="gpt-4o",
+    with tracing.trace("ask", temp_context=bool(temp_context)):
+        #using persistant vectorDB
+        if temp_context == False:
+            fingerprint, q_emb = None, None
+            if ANSWER_CACHE_ENABLED:
+                fingerprint = _answer_fingerprint()
+                hit, q_emb = _cached_answer(query, fingerprint)
+                if hit is not None:
+                    return f"{hit['answer']}{hit['citations']}"
+
+            #retrieve -> "stuff" prompt (RAG_PROMPT) -> LLM, in steps so each stage can be traced
+            source_docs = _retrieve(query)
+            prompt = _prompt_for(query, source_docs)
+            with tracing.span("llm", model=LLM_MODEL) as sp:
+                answer = get_llm().invoke(prompt).content
+                if tracing.enabled():
+                    sp.set(completion_tokens=_count_tokens(answer))
+            citations = _format_citations(source_docs)
+            if ANSWER_CACHE_ENABLED:
+                get_answer_cache().put(query, fingerprint, answer, citations, q_emb)
+            if citations:
+                answer = f"{answer}{citations}"
+        elif temp_context: #only when using temp context. 
+            # temp_context=True, use OpenAI directly.
+            # Expect `query` to already contain any context block you assembled upstream (e.g., "Context excerpts: ...").
+            with tracing.span("llm", model=TEMP_CONTEXT_MODEL) as sp:
+                resp = get_openai_client().chat.completions.create(
+                    model=TEMP_CONTEXT_MODEL,
+                    temperature=0,
+                    messages=_temp_context_messages(query),
+                )
+                answer = resp.choices[0].message.content
+                if resp.usage is not None:
+                    sp.set(prompt_tokens=resp.usage.prompt_tokens, completion_tokens=resp.usage.completion_tokens)
+    
+
+    return answer #+"\n\n\n" + "\n\n".join(to_add)
+
+#token generators behind ask_stream
+def _stream_from_vectordb(query, metrics):
+    fingerprint, q_emb = None, None
+    if ANSWER_CACHE_ENABLED:
+        fingerprint = _answer_fingerprint()
+        hit, q_emb = _cached_answer(query, fingerprint)
+        if hit is not None:
+            metrics["cache_hit"] = True
+            yield f"{hit['answer']}{hit['citations']}"
+            return
+
+    source_docs = _retrieve(query)
+    metrics["retrieval_ms"] = (time.perf_counter() - metrics["_start"]) * 1000
+    prompt = _prompt_for(query, source_docs)
+    parts = []
+    #includes the time the caller spends rendering the streamed tokens
+    with tracing.span("llm", model=LLM_MODEL) as sp:
+        for chunk in get_llm().stream(prompt):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+        if tracing.enabled():
+            sp.set(completion_tokens=_count_tokens("".join(parts)))
+    citations = _format_citations(source_docs)
+    if ANSWER_CACHE_ENABLED:
+        get_answer_cache().put(query, fingerprint, "".join(parts), citations, q_emb)
+    if citations:
+        yield citations
+
+def _stream_from_temp_context(query, source_docs):
+    with tracing.span("llm", model=TEMP_CONTEXT_MODEL) as sp:
+        stream = get_openai_client().chat.completions.create(
+            model=TEMP_CONTEXT_MODEL,
             temperature=0,
-            messages=[
-                {"role": "system", "content": system_msg},
-                {"role": "user", "content": query},
-            ],
+            messages=_temp_context_messages(query),
+            stream=True,
         )
-        answer = resp.choices[0].message.content
-    
+        parts = []
+        for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                parts.append(event.choices[0].delta.content)
+                yield event.choices[0].delta.content
+        if tracing.enabled():
+            sp.set(prompt_tokens=_count_tokens(query), completion_tokens=_count_tokens("".join(parts)))
+    citations = _format_citations(source_docs or [])
+    if citations:
+        yield f"\n\n{citations}"
+
+#Streaming version of ask: yields the answer token by token, citations last.
+#Pass a dict as `metrics` to get ttft_ms / total_ms / cache_hit back once the stream is exhausted.
+def ask_stream(query, temp_context=False, source_docs=None, metrics=None):
+    metrics = {} if metrics is None else metrics
+    metrics.update({"_start": time.perf_counter(), "ttft_ms": None, "cache_hit": False})
+    with tracing.trace("ask_stream", temp_context=bool(temp_context)):
+        tokens = (_stream_from_temp_context(query, source_docs) if temp_context
+                  else _stream_from_vectordb(query, metrics))
+        for tok in tokens:
+            if metrics["ttft_ms"] is None:
+                metrics["ttft_ms"] = (time.perf_counter() - metrics["_start"]) * 1000
+            yield tok
+        tracing.annotate(ttft_ms=round(metrics["ttft_ms"] or -1.0, 1))
+    metrics["total_ms"] = (time.perf_counter() - metrics.pop("_start")) * 1000
+    latency_logger.info(
+        "ask_stream temp_context=%s cache_hit=%s ttft_ms=%.1f total_ms=%.1f",
+        temp_context, metrics["cache_hit"], metrics["ttft_ms"] or -1.0, metrics["total_ms"],
+    )
+
+#--- async path
+#ask_async / ask_stream_async run on the shared event loop (get_async_runner) and call OpenAI through the
+#pooled AsyncOpenAIPool: bounded global concurrency, retry with backoff on rate limits, and a deadline of
+#ASK_TIMEOUT_S for the whole request (retrieval + generation). Retrieval (Chroma, BM25, query expansion)
+#is blocking and runs in the loop's thread pool. Same prompts, cache and citations as ask / ask_stream.
+#From synchronous code (Home.py) use run_async(ask_async(...)) or iterate_async(ask_stream_async(...)).
+#Besides the timings, `metrics` gets the citations string and (unless the answer came from the cache)
+#the source, page and section of every retrieved document.
+ASK_TIMEOUT_S = settings.env_float("ASK_TIMEOUT_S", 120.0)
+#Home.py answers through the async path unless ASYNC_ASK=0
+ASYNC_ASK = settings.env_bool("ASYNC_ASK", True)
+
+def _source_ref(d):
+    return {k: d.metadata[k] for k in ("source", "page", "section") if d.metadata.get(k) is not None}
+
+async def _in_thread(deadline, fn, *args):
+    remaining = deadline - asyncio.get_running_loop().time()
+    # a timed out thread is left to finish on its own; its result is discarded
+    return await asyncio.wait_for(asyncio.to_thread(fn, *args), max(0.0, remaining))
+
+async def ask_stream_async(query, temp_context=False, source_docs=None, metrics=None, timeout_s=None):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (timeout_s or ASK_TIMEOUT_S)
+    metrics = {} if metrics is None else metrics
+    metrics.update({"_start": time.perf_counter(), "ttft_ms": None, "cache_hit": False})
+    pool = get_async_pool()
+    with tracing.trace("ask_async", temp_context=bool(temp_context)):
+        if temp_context:
+            messages, model, fingerprint, q_emb = _temp_context_messages(query), TEMP_CONTEXT_MODEL, None, None
+        else:
+            fingerprint, q_emb = None, None
+            if ANSWER_CACHE_ENABLED:
+                fingerprint = _answer_fingerprint()
+                hit, q_emb = await _in_thread(deadline, _cached_answer, query, fingerprint)
+                if hit is not None:
+                    metrics["cache_hit"] = True
+                    metrics["ttft_ms"] = (time.perf_counter() - metrics["_start"]) * 1000
+                    metrics["citations"] = hit["citations"]
+                    yield f"{hit['answer']}{hit['citations']}"
+            if not metrics["cache_hit"]:
+                source_docs = await _in_thread(deadline, _retrieve, query)
+                metrics["retrieval_ms"] = (time.perf_counter() - metrics["_start"]) * 1000
+                messages, model = [{"role": "user", "content": _prompt_for(query, source_docs)}], LLM_MODEL
+
+        if not metrics["cache_hit"]:
+            parts = []
+            with tracing.span("llm", model=model) as sp:
+                async for tok in pool.chat_stream(messages, model=model, temperature=0,
+                                                  timeout_s=max(0.001, deadline - loop.time())):
+                    if metrics["ttft_ms"] is None:
+                        metrics["ttft_ms"] = (time.perf_counter() - metrics["_start"]) * 1000
+                    parts.append(tok)
+                    yield tok
+                if tracing.enabled():
+                    sp.set(completion_tokens=_count_tokens("".join(parts)))
+            citations = _format_citations(source_docs or [])
+            metrics["citations"] = citations
+            metrics["sources"] = [_source_ref(d) for d in source_docs or []]
+            if not temp_context and ANSWER_CACHE_ENABLED:
+                await asyncio.to_thread(get_answer_cache().put, query, fingerprint, "".join(parts), citations, q_emb)
+            if citations:
+                yield f"\n\n{citations}" if temp_context else citations
+        tracing.annotate(ttft_ms=round(metrics["ttft_ms"] or -1.0, 1))
+    metrics["total_ms"] = (time.perf_counter() - metrics.pop("_start")) * 1000
+    latency_logger.info(
+        "ask_async temp_context=%s cache_hit=%s ttft_ms=%.1f total_ms=%.1f",
+        temp_context, metrics["cache_hit"], metrics["ttft_ms"] or -1.0, metrics["total_ms"],
+    )
+
+#async version of ask: the whole answer (citations included) as one string
+async def ask_async(query, temp_context=False, source_docs=None, timeout_s=None, metrics=None):
+    parts = []
+    async for tok in ask_stream_async(query, temp_context=temp_context, source_docs=source_docs,
+                                      metrics=metrics, timeout_s=timeout_s):
+        parts.append(tok)
+    return "".join(parts)
+
+#run a coroutine (e.g. ask_async(...)) on the shared loop and wait for its result
+def run_async(coro, timeout=None):
+    return get_async_runner().run(coro, timeout=timeout)
 
-    return answer #+"\n\n\n" + "\n\n".join(to_add)
\ No newline at end of file
+#consume an async generator (e.g. ask_stream_async(...)) from sync code: st.write_stream(iterate_async(...))
+def iterate_async(agen):
+    return get_async_runner().iterate(agen)
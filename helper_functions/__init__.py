@@ -1,4 +1,13 @@
-from . import LLM as llm
-from . import helper as helper 
+#the app modules (streamlit, LangChain, OpenAI) are imported on first access, so the offline tools
+#(python -m helper_functions.ingest / figures / batch_ask helpers) only load what they use
+import importlib
 
-__all__=["llm", "helper"]
\ No newline at end of file
+__all__ = ["llm", "helper"]
+
+_MODULES = {"llm": ".LLM", "helper": ".helper"}
+
+
+def __getattr__(name):
+    if name in _MODULES:
+        return importlib.import_module(_MODULES[name], __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
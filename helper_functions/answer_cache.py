@@ -0,0 +1,204 @@
+#Persistent answer cache for the main knowledge base.
+#Users tend to ask the same questions over and over, so before running the full RAG pipeline
+#(query generation, MMR retrieval, annex boost, GPT-4 call) we look for
+#   1) an exact match on the normalized query, then
+#   2) a semantic near-duplicate among the cached query embeddings. Questions that differ only in a figure or
+#      a reference ("600 mm" vs "900 mm" sewer, Annex J vs Annex K) embed almost identically but need different
+#      answers, so a near-duplicate only counts when both ask about the same numbers, units and references.
+#Entries are scoped to a fingerprint of the vector store + prompt, so rebuilding
+#chroma_parent_child (or changing the prompt/model) invalidates everything cached before. The store part is
+#the ingest manifest when there is one (it changes exactly when ingest.py changes the store); files the app
+#derives from the store on first use (BM25 index, vector export) are never part of it.
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+
+#files that sqlite touches while the store is merely being read; they must not change the fingerprint
+_VOLATILE_SUFFIXES = ("-wal", "-shm", "-journal", ".lock")
+
+#"600 mm", "1.5m", "n + 1", "clause 2.2.5": a number and the unit right after it, if any
+_number_re = re.compile(r"(\d+(?:\.\d+)*)\s*(mm|cm|km|m3/s|m/s|l/s|mg/l|m2|m3|m|ha|kg|kpa|%)?(?![a-z\d])")
+
+
+def normalize_query(query: str) -> str:
+    q = query.lower().replace("\n", " ")
+    q = re.sub(r"\s+", " ", q).strip()
+    return q.rstrip(" ?!.")
+
+
+#numbers (with units) a question is about; two questions are only near-duplicates when these are equal
+def query_specifics(query: str) -> FrozenSet[str]:
+    return frozenset(num + (unit or "") for num, unit in _number_re.findall(normalize_query(query)))
+
+
+#hash of the persistent store plus anything else that changes the answer (prompt, model).
+#The store is identified by its `build_file` (ingest manifest) if present, otherwise by its files, minus the
+#top-level entries in `exclude`
+def store_fingerprint(persist_dir: str, *parts: str, build_file: Optional[str] = None,
+                      exclude: Iterable[str] = ()) -> str:
+    h = hashlib.sha256()
+    build_path = os.path.join(persist_dir, build_file) if build_file else None
+    if build_path and os.path.isfile(build_path):
+        with open(build_path, "rb") as f:
+            h.update(f.read())
+    elif os.path.isdir(persist_dir):
+        skip = set(exclude)
+        for root, dirs, files in os.walk(persist_dir):
+            if root == persist_dir:
+                dirs[:] = [d for d in dirs if d not in skip]
+                files = [fn for fn in files if fn not in skip]
+            dirs.sort()
+            for fn in sorted(files):
+                if fn.endswith(_VOLATILE_SUFFIXES):
+                    continue
+                full = os.path.join(root, fn)
+                try:
+                    stat = os.stat(full)
+                except OSError:
+                    continue
+                rel = os.path.relpath(full, persist_dir)
+                # sqlite files get their mtime bumped on open, use their size only
+                stamp = stat.st_size if fn.endswith(".sqlite3") else (stat.st_size, stat.st_mtime_ns)
+                h.update(f"{rel}|{stamp}\n".encode("utf-8"))
+    for p in parts:
+        h.update(str(p).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _to_blob(vec: Iterable[float]) -> bytes:
+    return np.asarray(vec, dtype=np.float32).tobytes()
+
+
+def _unit(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+
+class AnswerCache:
+    def __init__(self, path: str, ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 1000,
+                 similarity_threshold: float = 0.95,
+                 specifics: Callable[[str], FrozenSet[str]] = query_specifics):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.specifics = specifics
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answers (
+                   key TEXT PRIMARY KEY,
+                   fingerprint TEXT NOT NULL,
+                   query TEXT NOT NULL,
+                   answer TEXT NOT NULL,
+                   citations TEXT NOT NULL,
+                   embedding BLOB,
+                   created_at REAL NOT NULL,
+                   last_used REAL NOT NULL
+               )"""
+        )
+        self._conn.commit()
+        self._fingerprint: Optional[str] = None
+        # in-memory mirror of the cached query embeddings for the current fingerprint
+        self._keys: List[str] = []
+        self._queries: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    @staticmethod
+    def make_key(query: str, fingerprint: str) -> str:
+        return hashlib.sha256(f"{fingerprint}|{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    #drop entries that belong to an older store/prompt and entries past their TTL
+    def _prune(self, fingerprint: str):
+        now = time.time()
+        cur = self._conn.execute(
+            "DELETE FROM answers WHERE fingerprint != ? OR created_at < ?",
+            (fingerprint, now - self.ttl_seconds),
+        )
+        self._conn.commit()
+        if cur.rowcount or self._fingerprint != fingerprint:
+            self._fingerprint = fingerprint
+            self._reload_matrix()
+
+    def _reload_matrix(self):
+        rows = self._conn.execute(
+            "SELECT key, query, embedding FROM answers WHERE fingerprint = ? AND embedding IS NOT NULL",
+            (self._fingerprint,),
+        ).fetchall()
+        self._keys = [r[0] for r in rows]
+        self._queries = [r[1] for r in rows]
+        self._matrix = (np.vstack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+                        if rows else None)
+
+    def _row_to_hit(self, row, similarity: float) -> Dict:
+        key, query, answer, citations = row
+        self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return {"query": query, "answer": answer, "citations": citations, "similarity": similarity}
+
+    def get_exact(self, query: str, fingerprint: str) -> Optional[Dict]:
+        with self._lock:
+            self._prune(fingerprint)
+            row = self._conn.execute(
+                "SELECT key, query, answer, citations FROM answers WHERE key = ?",
+                (self.make_key(query, fingerprint),),
+            ).fetchone()
+            return self._row_to_hit(row, 1.0) if row else None
+
+    #most similar cached question above the threshold that asks about the same numbers and references
+    def get_similar(self, query: str, query_embedding, fingerprint: str) -> Optional[Dict]:
+        with self._lock:
+            self._prune(fingerprint)
+            if self._matrix is None or not self._keys:
+                return None
+            q = _unit(query_embedding)
+            if q.shape[0] != self._matrix.shape[1]:
+                return None
+            sims = self._matrix @ q
+            above = np.flatnonzero(sims >= self.similarity_threshold)
+            wanted = self.specifics(query)
+            for i in above[np.argsort(-sims[above])]:
+                if self.specifics(self._queries[i]) != wanted:
+                    continue
+                row = self._conn.execute(
+                    "SELECT key, query, answer, citations FROM answers WHERE key = ?",
+                    (self._keys[i],),
+                ).fetchone()
+                return self._row_to_hit(row, float(sims[i])) if row else None
+            return None
+
+    def put(self, query: str, fingerprint: str, answer: str, citations: str, query_embedding=None):
+        now = time.time()
+        blob = _to_blob(_unit(query_embedding)) if query_embedding is not None else None
+        with self._lock:
+            self._prune(fingerprint)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.make_key(query, fingerprint), fingerprint, normalize_query(query),
+                 answer, citations, blob, now, now),
+            )
+            # LRU eviction once over capacity
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN ("
+                " SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+            self._reload_matrix()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self._keys, self._queries, self._matrix = [], [], None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
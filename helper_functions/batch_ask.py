@@ -0,0 +1,234 @@
+"""Batch question answering: questions in as JSONL, answers with citations and timings out as JSONL.
+
+For regression checks and pre-answering FAQs offline, through the same pipeline Home.py uses
+(LLM.ask_async: answer cache, query expansion, hybrid retrieval, rerank, GPT-4):
+  - every input line is a JSON object with the question under --field and an optional id under --id-field
+    (lines without an id are called "line-<n>"); a line that is just a JSON string is a question too
+  - identical questions (same normalized text as the answer cache uses) are answered once, and a row is
+    written for every record that asked them
+  - questions are answered in waves of --wave. Before a wave starts, its query expansions are computed and
+    all of its sub-queries (and answer-cache lookups) are embedded in batched embedding calls
+    (query_embeddings.QueryEmbeddings.prefetch), while the previous wave is still being answered
+  - at most --concurrency questions are in retrieval or generation at once; the OpenAI calls additionally go
+    through the pooled client (OPENAI_MAX_CONCURRENCY, retry with backoff on 429s), ASK_TIMEOUT_S each
+  - --out is the checkpoint: a row is appended and flushed as soon as its answer is complete, and a re-run
+    with the same --out skips every record that already has an answer (failed ones are tried again)
+
+Output rows:
+  {"id", "question", "answer", "citations", "sources", "cache_hit", "timings": {...}, "duplicate_of"?}
+  {"id", "question", "error", "timings": {...}}
+
+Usage (from the repo root):
+    python -m helper_functions.batch_ask --in questions.jsonl --out answers.jsonl [--concurrency 8]
+    ANSWER_CACHE_ENABLED=0 python -m helper_functions.batch_ask ...   # regression run, no cached answers
+Against the local stand-in for the OpenAI endpoints (canned answers, hashing embeddings):
+    python benchmarks/mock_openai_server.py --port 8765 &
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock python -m helper_functions.batch_ask ...
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+from . import LLM as llm
+from .answer_cache import normalize_query
+
+
+def _log(msg: str):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def read_questions(path: str, field: str = "question", id_field: str = "id", log=_log) -> List[Dict]:
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            question = row if isinstance(row, str) else row.get(field)
+            if not isinstance(question, str) or not question.strip():
+                log(f"{path}:{n}: no question under {field!r}, skipped")
+                continue
+            rid = row.get(id_field) if isinstance(row, dict) else None
+            records.append({"id": str(rid) if rid is not None else f"line-{n}", "question": question.strip()})
+    return records
+
+
+#rows already answered in a previous run, by record id. A row cut off by an interrupt is ignored
+def load_checkpoint(path: str) -> Dict[str, Dict]:
+    done: Dict[str, Dict] = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(row, dict) and "id" in row and "error" not in row:
+                done[row["id"]] = row
+    return done
+
+
+class JsonlWriter:
+    """Appends one row per line and flushes it, so an interrupted run loses at most the rows in flight."""
+
+    def __init__(self, path: str):
+        torn = False
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+        self._f = open(path, "a", encoding="utf-8")
+        if torn:
+            self._f.write("\n")
+
+    def write(self, row: Dict):
+        self._f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+#embed everything a wave of questions will look up in a few large embedding calls: every sub-query (the
+#answer cache embeds the question the same way, as the first sub-query). Only cached/deterministic expansions
+#are computed ahead; a plain LLMExpander would rephrase again at retrieval time, so for it (and for
+#multiquery) only the question itself is prefetched
+def prefetch_embeddings(questions: Sequence[str], workers: int = 8) -> Dict:
+    from .query_expansion import CachedExpander
+    emb = llm.get_embedding()
+    if not hasattr(emb, "prefetch") or not questions:
+        return {}
+    t0 = time.perf_counter()
+    texts: List[str] = list(questions)
+    expander = llm.get_query_expander(llm.QUERY_EXPANSION) if llm.QUERY_EXPANSION != "multiquery" else None
+    if isinstance(expander, CachedExpander):
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch-expand") as pool:
+            for subs in pool.map(expander.expand, questions):
+                texts.extend(subs)
+    embedded = emb.prefetch(texts)
+    return {"texts": len(texts), "embedded": embedded, "ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+
+async def answer_one(question: str, timeout_s: Optional[float] = None) -> Dict:
+    metrics: Dict = {}
+    t0 = time.perf_counter()
+    try:
+        answer = await llm.ask_async(question, metrics=metrics, timeout_s=timeout_s)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}",
+                "timings": {"total_ms": round((time.perf_counter() - t0) * 1000, 1)}}
+    citations = metrics.get("citations") or ""
+    if citations and answer.endswith(citations):
+        answer = answer[: -len(citations)].rstrip()
+    return {
+        "answer": answer,
+        "citations": citations,
+        "sources": metrics.get("sources", []),
+        "cache_hit": metrics.get("cache_hit", False),
+        "timings": {k: round(metrics[k], 1) for k in ("ttft_ms", "retrieval_ms", "total_ms")
+                    if metrics.get(k) is not None},
+    }
+
+
+#answer every group of identical questions once, `concurrency` at a time, writing one row per record
+async def run_batch(groups: Dict[str, List[Dict]], write: Callable[[Dict], None], concurrency: int = 8,
+                    wave: int = 64, timeout_s: Optional[float] = None, log=_log) -> Dict:
+    summary = {"answered": 0, "failed": 0, "rows": 0, "embedding_texts": 0, "embedded": 0}
+    slots = asyncio.Semaphore(max(1, concurrency))
+    keys = list(groups)
+    waves = [keys[i:i + max(1, wave)] for i in range(0, len(keys), max(1, wave))]
+
+    async def prefetch(wave_keys):
+        try:
+            return await asyncio.to_thread(prefetch_embeddings, [groups[k][0]["question"] for k in wave_keys],
+                                           concurrency)
+        except Exception as e:
+            # not fatal: retrieval embeds whatever is missing on its own
+            log(f"embedding prefetch failed ({type(e).__name__}: {e}), continuing without it")
+            return {}
+
+    async def one(key):
+        records = groups[key]
+        async with slots:
+            result = await answer_one(records[0]["question"], timeout_s)
+        summary["failed" if "error" in result else "answered"] += 1
+        for i, r in enumerate(records):
+            row = {"id": r["id"], "question": r["question"], **result}
+            if i:
+                row["duplicate_of"] = records[0]["id"]
+            write(row)
+            summary["rows"] += 1
+
+    pending = asyncio.ensure_future(prefetch(waves[0])) if waves else None
+    for i, wave_keys in enumerate(waves):
+        stats = await pending
+        summary["embedding_texts"] += stats.get("texts", 0)
+        summary["embedded"] += stats.get("embedded", 0)
+        if i + 1 < len(waves):
+            pending = asyncio.ensure_future(prefetch(waves[i + 1]))
+        await asyncio.gather(*(one(k) for k in wave_keys))
+        log(f"wave {i + 1}/{len(waves)}: {summary['answered']} answered, {summary['failed']} failed "
+            f"({stats.get('texts', 0)} queries prefetched, {stats.get('embedded', 0)} of them embedded, "
+            f"{stats.get('ms', 0)} ms)")
+    return summary
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m helper_functions.batch_ask", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--in", dest="inp", required=True, help="questions, one JSON object per line")
+    ap.add_argument("--out", required=True, help="answers, one JSON object per line; also the checkpoint")
+    ap.add_argument("--field", default="question", help="key of the question in an input object")
+    ap.add_argument("--id-field", default="id", help="key of the record id in an input object")
+    ap.add_argument("--concurrency", type=int, default=8, help="questions in retrieval/generation at once")
+    ap.add_argument("--wave", type=int, default=64, help="questions whose query embeddings are fetched together")
+    ap.add_argument("--timeout-s", type=float, default=None, help="per question (default ASK_TIMEOUT_S)")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    records = read_questions(args.inp, args.field, args.id_field)
+    done = load_checkpoint(args.out)
+    answered = {normalize_query(row["question"]): row for row in done.values() if "question" in row}
+    todo = [r for r in records if r["id"] not in done]
+    summary = {"records": len(records), "already_done": len(records) - len(todo)}
+
+    writer = JsonlWriter(args.out)
+    groups: Dict[str, List[Dict]] = {}
+    reused = 0
+    for r in todo:
+        key = normalize_query(r["question"])
+        prev = answered.get(key)
+        if prev is not None:
+            # asked before under another id, in this file or a previous run
+            writer.write({**prev, "id": r["id"], "question": r["question"], "duplicate_of": prev["id"]})
+            reused += 1
+        else:
+            groups.setdefault(key, []).append(r)
+    summary.update(reused=reused, unique_questions=len(groups),
+                   duplicates=sum(len(g) - 1 for g in groups.values()))
+    _log(f"plan: {summary}")
+
+    try:
+        summary.update(llm.run_async(run_batch(groups, writer.write, concurrency=args.concurrency,
+                                               wave=args.wave, timeout_s=args.timeout_s)))
+    except KeyboardInterrupt:
+        _log(f"interrupted; run the same command again to resume from {args.out}")
+        return 130
+    finally:
+        writer.close()
+    emb = llm.get_embedding()
+    if hasattr(emb, "stats"):
+        summary["query_embeddings"] = emb.stats()
+    summary["seconds"] = round(time.perf_counter() - t0, 1)
+    print(json.dumps(summary, indent=2))
+    return 1 if summary.get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,343 @@
+#Structure-aware chunking shared by the persistent corpus (ingest.py) and uploaded documents (helper.py).
+#Fixed windows (RecursiveCharacterTextSplitter(1000, 100) for the corpus, 220-word windows for uploads) cut
+#clauses, tables and numbered requirements in half, so more and larger chunks had to be retrieved to get one
+#answer back. Here a page (or a whole docx/txt) is first split into blocks:
+#   - clause / heading lines ("1.2.4 Structures over Sewer", "J.1 Scope", "ANNEX J - ...") open a new section
+#   - list items ("a.", "(b)", "iii.", "•") and blank lines separate paragraphs
+#   - a table caption ("Table 1- ...") and the rows under it, or a run of short number-heavy rows, form one
+#     table block (footnotes "* ..." / "Note ..." included)
+#and the blocks are packed into chunks of at most `max_tokens` tokens (tokens.count_tokens), starting a new
+#chunk at a clause heading once the current one holds `min_tokens`. Only a block larger than a chunk on its
+#own is split: prose on sentence boundaries with `overlap_tokens` of overlap, tables on row boundaries with
+#the caption and header repeated. Every chunk records the clause(s) it covers (`section`) and the heading of
+#its first clause, so a citation can point at "p.10 §1.2.4", and a docx at its clause instead of a fake page.
+#Running page headers/footers ("3 | P a g e") are dropped.
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .tokens import count_tokens
+
+#bump when the chunking rules change: ingest.py re-chunks every page stored under another version
+CHUNKER_VERSION = 3
+
+_noise_re = re.compile(r"^(?:\d+\s*\|\s*P\s*a\s*g\s*e|page\s+\d+(?:\s+of\s+\d+)?)$", re.IGNORECASE)
+#"1.2.4 Structures over Sewer", "4.2.2 Grease Trap Requirements", "J.1 Scope" (title starts upper case, so
+#"1.5 m from ..." in a table or sentence is not a clause)
+_clause_re = re.compile(r"^((?:\d{1,2}|[A-Z])(?:\.\d{1,3}){1,4})\.?\s+(?=[A-Z(\"'“‘])")
+#"4 SEWERAGE WORKS": a chapter number followed by an upper case title
+_chapter_re = re.compile(r"^(\d{1,2})\.?\s+(?=[A-Z][A-Z &,/()'’-]{3,}$)")
+#"ANNEX J - PUB'S RECOMMENDED ...", "Appendix 2", "PART III", "Section 3: Design", "Annex K Grease Traps".
+#The text cross-references annexes all the time, so a wrapped line such as "Annex J for grease traps. See"
+#is prose: the label must end the line or be followed by a dash, a colon or an upper case title, with no sentence
+#punctuation after it
+_annex_re = re.compile(r"^(annex|appendix|chapter|part|section)\s+([A-Z]{1,2}|\d{1,2}|[IVX]{1,5})\b(?![a-z])"
+                       r"\s*(.*)$", re.IGNORECASE)
+_annex_title_re = re.compile(r"^(?:$|[-–—:]|[A-Z(\"'“‘])")
+_sentence_punct_re = re.compile(r"[.;!?](?:\s|$)")
+_item_re = re.compile(r"^(?:\(?[a-z]{1,2}\)|[a-z]\.|\(?[ivx]{1,5}\)|[ivx]{1,5}\.|[•▪◦·●–-])\s+")
+_caption_re = re.compile(r"^table\s+[A-Z]?\d+(?:\.\d+)*\b", re.IGNORECASE)
+_note_re = re.compile(r"^(?:\*|†|notes?\b)", re.IGNORECASE)
+_number_re = re.compile(r"^[<>≤≥±~+×x-]?\(?[\d.,/:]+\)?[a-zA-Z%²³]{0,3}\*?$")
+_sentence_re = re.compile(r"(?<=[.;:!?])\s+(?=[A-Z(\"'“‘\d•])")
+
+#longest heading kept on a chunk (and repeated on the continuation of a split clause), in characters
+_HEADING_CHARS = 120
+
+
+class TextChunk(NamedTuple):
+    text: str
+    section: Optional[str]  # clause label, or "first-last" when the chunk spans several clauses
+    heading: Optional[str]  # heading line of the chunk's first clause
+    tokens: int
+
+
+class _Block(NamedTuple):
+    kind: str               # "text" or "table"
+    lines: List[str]
+    section: Optional[str]
+    heading: Optional[str]
+    opens_section: bool     # starts with a clause / heading line
+
+
+#section label of a heading line, or None for any other line
+def heading_label(line: str) -> Optional[str]:
+    line = line.strip()
+    m = _clause_re.match(line)
+    if m:
+        return m.group(1)
+    m = _chapter_re.match(line)
+    if m:
+        return m.group(1)
+    m = _annex_re.match(line)
+    if (m and len(line.split()) <= 16 and not m.group(2).islower() and _annex_title_re.match(m.group(3))
+            and not _sentence_punct_re.search(m.group(3))):
+        return f"{m.group(1).capitalize()} {m.group(2).upper()}"
+    return None
+
+
+#short, number-heavy line ("≤ 600 ≤3 1.0", "> 600 to 1500 All 0.5D + 2.5") or an explicitly delimited row
+def _is_row(raw: str) -> bool:
+    line = raw.strip()
+    if not line or len(line) > 100:
+        return False
+    if "|" in line or "\t" in raw or len(re.findall(r"\S {3,}\S", line)) >= 2:
+        return True
+    toks = line.split()
+    nums = sum(1 for t in toks if _number_re.match(t))
+    return len(toks) <= 14 and nums >= 1 and nums / len(toks) >= 0.3
+
+
+#short line of a captioned table (column headers, row labels): not a sentence and not a list item
+def _is_cell(line: str) -> bool:
+    return len(line.split()) <= 8 and not line.endswith(".") and not _item_re.match(line)
+
+
+def locator(metadata: Dict) -> str:
+    """"p.10 §1.2.4" / "§3.1" / "Annex J" / "p.10" for a chunk's metadata ("" when it has neither)."""
+    parts = []
+    page = metadata.get("page")
+    if page not in (None, ""):
+        try:
+            parts.append(f"p.{int(page)}")
+        except (TypeError, ValueError):
+            parts.append(f"p.{page}")
+    section = metadata.get("section")
+    if section:
+        parts.append(f"§{section}" if section[0].isdigit() else str(section))
+    return " ".join(parts)
+
+
+class StructureChunker:
+    def __init__(self, max_tokens: int = 256, overlap_tokens: int = 32, min_tokens: Optional[int] = None,
+                 model: str = "text-embedding-ada-002"):
+        if max_tokens <= overlap_tokens:
+            raise ValueError("max_tokens must be larger than overlap_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = max_tokens // 4 if min_tokens is None else min_tokens
+        self.model = model
+
+    #identifies the chunking rules and sizes (stored in the ingest manifest)
+    @property
+    def signature(self) -> str:
+        return f"structure-v{CHUNKER_VERSION}:{self.max_tokens}:{self.overlap_tokens}:{self.min_tokens}:{self.model}"
+
+    def _tokens(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    #heading line of the clause still open at the end of `text`; pass it on when chunking the next page
+    def last_heading(self, text: str, heading: Optional[str] = None) -> Optional[str]:
+        for raw in text.splitlines():
+            line = " ".join(raw.split())
+            if heading_label(line):
+                heading = line[:_HEADING_CHARS]
+        return heading
+
+    #text -> blocks, with the clause each one belongs to
+    def _blocks(self, text: str, heading: Optional[str]) -> List[_Block]:
+        blocks: List[_Block] = []
+        section = heading_label(heading) if heading else None
+        kind, lines, opens = "text", [], False
+        table_caption = False  # current table started with a "Table n" caption
+        in_note = False        # inside a table footnote, which runs until the next blank line
+        pending_rows: List[str] = []  # uncaptioned row-like lines, a table once there are two
+
+        def close():
+            nonlocal kind, lines, opens, table_caption, in_note
+            if lines:
+                blocks.append(_Block(kind, lines, section, heading, opens))
+            kind, lines, opens, table_caption, in_note = "text", [], False, False, False
+
+        def flush_rows():
+            nonlocal kind, lines
+            if len(pending_rows) >= 2:
+                close()
+                kind, lines = "table", list(pending_rows)
+                close()
+            else:
+                lines.extend(pending_rows)
+            pending_rows.clear()
+
+        for raw in text.splitlines():
+            line = " ".join(raw.split())
+            if not line:
+                in_note = False
+                if kind == "table":
+                    continue  # blank lines inside a table do not end it
+                flush_rows()
+                close()
+                continue
+            if _noise_re.match(line):
+                continue
+            label = heading_label(line)
+            if label:
+                flush_rows()
+                close()
+                section, heading, opens = label, line[:_HEADING_CHARS], True
+                lines = [line]
+                continue
+            if kind == "table":
+                if in_note or _note_re.match(line) or _is_row(raw) or (table_caption and _is_cell(line)):
+                    in_note = in_note or bool(_note_re.match(line))
+                    lines.append(line)
+                    continue
+                close()
+            if _caption_re.match(line):
+                flush_rows()
+                close()
+                kind, lines, table_caption = "table", [line], True
+                continue
+            if _is_row(raw):
+                pending_rows.append(line)
+                continue
+            flush_rows()
+            if _item_re.match(line) and lines and not (opens and len(lines) == 1):
+                close()
+            lines.append(line)
+        flush_rows()
+        close()
+        return blocks
+
+    #join a block's lines: prose lines are re-flowed, table rows and a heading keep their own line
+    @staticmethod
+    def _join(block: _Block) -> str:
+        if block.kind == "table":
+            return "\n".join(block.lines)
+        if block.opens_section and len(block.lines) > 1:
+            return f"{block.lines[0]}\n{' '.join(block.lines[1:])}"
+        return " ".join(block.lines)
+
+    #"<heading> (cont.)" line put in front of a chunk that starts inside a clause ("" without a heading)
+    @staticmethod
+    def _continued(block: _Block) -> str:
+        return f"{block.heading} (cont.)" if block.heading else ""
+
+    #pieces of `text` of at most `limit` tokens: groups of words, and a single word longer than that
+    #(a URL, a run of dots or digits from the PDF) cut by characters
+    def _fit(self, text: str, limit: int) -> List[str]:
+        limit = max(1, limit)
+        tokens = self._tokens(text)
+        if tokens <= limit:
+            return [text]
+        words = text.split()
+        if len(words) > 1:
+            step = max(1, len(words) * limit // tokens)
+            return [p for i in range(0, len(words), step) for p in self._fit(" ".join(words[i:i + step]), limit)]
+        step = max(1, len(text) * limit // tokens)
+        return [p for i in range(0, len(text), step) for p in self._fit(text[i:i + step], limit)]
+
+    #split a block larger than a chunk into pieces of at most `budget` tokens
+    def _split_block(self, block: _Block, budget: int) -> List[str]:
+        head = block.lines[:2] if len(block.lines) > 2 else block.lines[:1]
+        if block.kind == "table" and self._tokens("\n".join(head)) + 1 <= budget // 2:
+            units, sep, repeat = block.lines[len(head):], "\n", "\n".join(head)
+            budget -= self._tokens(repeat) + 1
+            units = [p for u in units for p in self._fit(u, budget)]
+            overlap = 0  # the repeated caption/header gives every piece its context
+        elif block.kind == "table":
+            # a header too large to repeat: rows only
+            units, sep, repeat = [p for u in block.lines for p in self._fit(u, budget)], "\n", ""
+            overlap = 0
+        else:
+            units, sep, repeat = [], " ", ""
+            for sentence in _sentence_re.split(self._join(block)):
+                if self._tokens(sentence) <= budget // 2:
+                    units.append(sentence)
+                else:
+                    units.extend(self._fit(sentence, budget // 4))
+            overlap = self.overlap_tokens
+        sizes = [self._tokens(u) + 1 for u in units]
+        pieces, start = [], 0
+        while start < len(units):
+            end, size = start, 0
+            while end < len(units) and (end == start or size + sizes[end] <= budget):
+                size += sizes[end]
+                end += 1
+            body = sep.join(units[start:end])
+            pieces.append(f"{repeat}{sep}{body}" if repeat else body)
+            if end >= len(units):
+                break
+            # step back over up to `overlap` tokens, always moving forward
+            back, nxt = 0, end
+            while nxt - 1 > start and back + sizes[nxt - 1] <= overlap:
+                nxt -= 1
+                back += sizes[nxt]
+            start = nxt
+        return pieces or [repeat]
+
+    def chunk(self, text: str, open_heading: Optional[str] = None) -> List[TextChunk]:
+        """Chunks of one page / document. `open_heading` is the heading of the clause still open from the
+        previous page (last_heading)."""
+        chunks: List[TextChunk] = []
+        parts: List[str] = []
+        sections: List[str] = []
+        heading: Optional[str] = None
+        size = 0
+
+        def emit():
+            nonlocal parts, sections, heading, size
+            if parts:
+                body = "\n".join(parts)
+                label = None
+                if sections:
+                    label = sections[0] if sections[0] == sections[-1] else f"{sections[0]}-{sections[-1]}"
+                chunks.append(TextChunk(body, label, heading, self._tokens(body)))
+            parts, sections, heading, size = [], [], None, 0
+
+        def add(body: str, tokens: int, block: _Block, continued: bool):
+            nonlocal size, heading
+            if not parts:
+                heading = block.heading
+                cont = self._continued(block) if continued else ""
+                if cont:
+                    parts.append(cont)
+                    size += self._tokens(cont) + 1
+            parts.append(body)
+            if block.section and block.section not in sections:
+                sections.append(block.section)
+            size += tokens
+
+        for block in self._blocks(text, open_heading):
+            body = self._join(block)
+            tokens = self._tokens(body) + 1
+            if parts and block.opens_section and size >= self.min_tokens:
+                emit()
+            if parts and size + tokens > self.max_tokens:
+                emit()
+            cont = self._continued(block)
+            reserve = self._tokens(cont) + 1 if cont else 0
+            if tokens + (0 if parts or block.opens_section else reserve) <= self.max_tokens:
+                add(body, tokens, block, not block.opens_section)
+                continue
+            emit()
+            pieces = self._split_block(block, self.max_tokens - reserve)
+            for i, piece in enumerate(pieces):
+                add(piece, self._tokens(piece) + 1, block, i > 0 or not block.opens_section)
+                if i < len(pieces) - 1:
+                    emit()
+        emit()
+        return chunks
+
+    #LangChain TextSplitter-compatible: chunk texts only
+    def split_text(self, text: str) -> List[str]:
+        return [c.text for c in self.chunk(text)]
+
+
+#metadata fields a chunk adds to its page's metadata
+def chunk_metadata(chunk: TextChunk) -> Dict[str, str]:
+    md = {}
+    if chunk.section:
+        md["section"] = chunk.section
+    if chunk.heading:
+        md["heading"] = chunk.heading
+    return md
+
+
+#(text, metadata) pairs of a whole document, carrying the open clause from one page to the next
+def chunk_pages(chunker: StructureChunker, pages: List[Tuple[str, Dict]]) -> List[Tuple[str, Dict]]:
+    out, heading = [], None
+    for text, meta in pages:
+        for c in chunker.chunk(text, heading):
+            out.append((c.text, dict(meta, **chunk_metadata(c))))
+        heading = chunker.last_heading(text, heading)
+    return out
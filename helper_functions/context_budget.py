@@ -0,0 +1,141 @@
+#Post-retrieval stage between AnnexAwareRetriever and the "stuff" chain.
+#Several sub-queries x k MMR hits + every annex boost used to be stuffed into RAG_PROMPT unbounded.
+#This stage
+#   1) collapses near-duplicate chunks (word-shingle Jaccard),
+#   2) reranks the non-boosted docs with a local CPU cross-encoder (or a lexical fallback),
+#   3) trims over-long docs (diagram captions) and packs everything into a hard token budget,
+#keeping the annex/figure boosts first. Token savings are logged per question.
+import logging
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain.schema import Document
+
+from .tokens import count_tokens
+
+context_logger = logging.getLogger("pub_rag.context")
+
+_word_re = re.compile(r"\w+")
+
+
+def _shingles(text: str, n: int = 5) -> frozenset:
+    words = _word_re.findall(text.lower())
+    if len(words) < n:
+        return frozenset([" ".join(words)])
+    return frozenset(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+
+
+#drop docs whose shingles overlap an earlier (higher ranked) doc by >= threshold.
+#`kept_shingles` holds the shingles of docs kept before (extended in place), so a second list can be
+#collapsed against the first
+def collapse_near_duplicates(docs: Sequence[Document], threshold: float = 0.8,
+                             kept_shingles: Optional[List[frozenset]] = None) -> List[Document]:
+    kept: List[Document] = []
+    kept_shingles = [] if kept_shingles is None else kept_shingles
+    for d in docs:
+        sh = _shingles(d.page_content)
+        dup = False
+        for other in kept_shingles:
+            inter = len(sh & other)
+            if inter and inter / len(sh | other) >= threshold:
+                dup = True
+                break
+        if not dup:
+            kept.append(d)
+            kept_shingles.append(sh)
+    return kept
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def scores(self, query: str, docs: Sequence[Document]) -> List[float]:
+        return [float(s) for s in self.model.predict([(query, d.page_content) for d in docs])]
+
+
+#no-model fallback: BM25-style term overlap using the lexical index tokenizer (keeps "N+1", "900mm", ...)
+class LexicalReranker:
+    def scores(self, query: str, docs: Sequence[Document]) -> List[float]:
+        from .lexical_index import BM25Index
+        index = BM25Index.build([d.page_content for d in docs], [{} for _ in docs])
+        scored = dict(index.search(query, k=len(docs)))
+        return [scored.get(i, 0.0) for i in range(len(docs))]
+
+
+def rerank(query: str, docs: Sequence[Document], reranker, top_n: Optional[int] = None) -> List[Document]:
+    if reranker is None or len(docs) < 2:
+        return list(docs)[:top_n] if top_n else list(docs)
+    scores = reranker.scores(query, docs)
+    order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+    ranked = [docs[i] for i in order]
+    return ranked[:top_n] if top_n else ranked
+
+
+#character offset in `text` where `snippet` starts, comparing word by word (the chunker collapses
+#whitespace, the parent page keeps the PDF's); None when it is not there
+def _find_words(text: str, snippet: str, n: int = 12) -> Optional[int]:
+    want = snippet.split()[:n]
+    if not want:
+        return None
+    words = [(m.start(), m.group()) for m in re.finditer(r"\S+", text)]
+    for i in range(len(words) - len(want) + 1):
+        if all(words[i + j][1] == w for j, w in enumerate(want)):
+            return words[i][0]
+    return None
+
+
+def _truncate(d: Document, max_tokens: int, model: str) -> Tuple[Document, int]:
+    tokens = count_tokens(d.page_content, model)
+    if tokens <= max_tokens:
+        return d, tokens
+    text = d.page_content
+    n_chars = max(1, len(text) * max_tokens // tokens)
+    child = d.metadata.get("child_text")
+    if child:
+        # a parent page: keep the part around the child chunk that was retrieved, or the child itself
+        start = _find_words(text, child)
+        if start is None:
+            return _truncate(Document(page_content=child, metadata=dict(d.metadata, is_parent=False)), max_tokens,
+                             model)
+        start = max(0, min(start - n_chars // 8, len(text) - n_chars))
+        cut = text[start:start + n_chars]
+        cut = ("… " if start else "") + cut + (" …" if start + n_chars < len(text) else "")
+        return Document(page_content=cut, metadata=dict(d.metadata, truncated=True)), count_tokens(cut, model)
+    # proportional character cut, good enough for captions
+    cut = text[:n_chars]
+    return Document(page_content=cut + " …", metadata=dict(d.metadata, truncated=True)), count_tokens(cut, model)
+
+
+#hard budget: greedy in order, so pinned (boosted) docs are packed first
+def pack_to_budget(docs: Sequence[Document], token_budget: int, max_doc_tokens: int,
+                   model: str = "gpt-4") -> Tuple[List[Document], int]:
+    out, used = [], 0
+    for d in docs:
+        d, tokens = _truncate(d, max_doc_tokens, model)
+        if used + tokens > token_budget:
+            continue
+        out.append(d)
+        used += tokens
+    return out, used
+
+
+#steps 1 + 2: the first `pinned` docs (annex boosts) keep their place, the rest are deduplicated and reranked.
+#The pinned docs are collapsed among themselves first and the rest against what is kept of them, so a
+#duplicate boost never shifts the first dense/BM25 result into the pinned slots
+def select_context(query: str, docs: Sequence[Document], pinned: int = 0, reranker=None,
+                   top_n: Optional[int] = None, dup_threshold: float = 0.8) -> List[Document]:
+    seen: List[frozenset] = []
+    pinned_docs = collapse_near_duplicates(docs[:pinned], dup_threshold, seen)
+    rest = collapse_near_duplicates(docs[pinned:], dup_threshold, seen)
+    return pinned_docs + rerank(query, rest, reranker, top_n)
+
+
+def log_budget(query: str, docs_in: Sequence[Document], docs_out: Sequence[Document], tokens_out: int,
+               model: str = "gpt-4") -> Dict[str, int]:
+    tokens_in = sum(count_tokens(d.page_content, model) for d in docs_in)
+    stats = {"docs_in": len(docs_in), "docs_out": len(docs_out), "tokens_in": tokens_in,
+             "tokens_out": tokens_out, "tokens_saved": max(0, tokens_in - tokens_out)}
+    context_logger.info("context_budget query=%r %s", query[:80], " ".join(f"{k}={v}" for k, v in stats.items()))
+    return stats
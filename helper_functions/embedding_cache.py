@@ -0,0 +1,111 @@
+#Persistent embedding cache keyed by (model name, sha256 of the text).
+#Shared by every session of the server process and across restarts, so a chunk that has been
+#embedded once is never sent through the model again. Least recently used entries are evicted
+#once the cache grows past `max_entries`.
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def bytes_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_entries: int = 200_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                   model TEXT NOT NULL,
+                   key TEXT NOT NULL,
+                   vec BLOB NOT NULL,
+                   last_used REAL NOT NULL,
+                   PRIMARY KEY (model, key)
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def get_many(self, model: str, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            # stay well below sqlite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                for key, vec in rows:
+                    found[key] = np.frombuffer(vec, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                    [(now, model, k) for k in found],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, model: str, items: Dict[str, Iterable[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(model, k, np.asarray(v, dtype=np.float32).tobytes(), now) for k, v in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._puts_since_evict += len(rows)
+            # counting rows is not free; only check capacity every so often
+            if self._puts_since_evict >= max(1, self.max_entries // 100):
+                self._puts_since_evict = 0
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN ("
+                    " SELECT rowid FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+#embed `texts` with `encode_fn`, only sending the texts that are not cached yet (each distinct text once).
+#pass a dict as `stats` to get this call's cache hits/misses back
+def embed_with_cache(cache: EmbeddingCache, model: str, texts: List[str], encode_fn,
+                     stats: Optional[Dict[str, int]] = None) -> List[np.ndarray]:
+    keys = [text_hash(t) for t in texts]
+    found = cache.get_many(model, keys)
+    missing: Dict[str, str] = {}
+    for k, t in zip(keys, texts):
+        if k not in found and k not in missing:
+            missing[k] = t
+    if stats is not None:
+        stats.update(cache_hits=len(found), cache_misses=len(missing))
+    if missing:
+        embs = encode_fn(list(missing.values()))
+        new = {k: np.asarray(e, dtype=np.float32) for k, e in zip(missing.keys(), embs)}
+        cache.put_many(model, new)
+        found.update(new)
+    return [found[k] for k in keys]
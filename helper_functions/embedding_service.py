@@ -0,0 +1,95 @@
+#Process-wide embedding service for uploaded documents.
+#One SentenceTransformer is shared by every Streamlit session. Calls from different sessions go
+#through a queue and a single worker thread coalesces them into one `encode` batch, waiting at
+#most `max_wait_ms` for company and never exceeding `max_batch_size` texts (a single large request
+#still goes through on its own, encode splits it internally).
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+
+import numpy as np
+
+
+class _Request:
+    __slots__ = ("texts", "future")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+
+
+class EmbeddingService:
+    def __init__(self, model_loader: Callable, max_batch_size: int = 64, max_wait_ms: float = 5.0,
+                 normalize: bool = True):
+        self._model_loader = model_loader
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.normalize = normalize
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._model = None
+        self._start_lock = threading.Lock()
+        self._worker = None
+        self.stats: Dict[str, int] = {"requests": 0, "texts": 0, "batches": 0}
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self._model_loader()
+        return self._model
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+                self._worker.start()
+
+    #blocks until this request's embeddings are ready; returns a float32 (n, dim) array
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        self._ensure_worker()
+        req = _Request(list(texts))
+        self._queue.put(req)
+        return req.future.result()
+
+    #collect requests until the batch is full or the oldest one has waited max_wait
+    def _next_batch(self) -> List[_Request]:
+        first = self._queue.get()
+        batch, size = [first], len(first.texts)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                req = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(req)
+            size += len(req.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            texts = [t for req in batch for t in req.texts]
+            try:
+                embs = self.model.encode(texts, batch_size=self.max_batch_size,
+                                         normalize_embeddings=self.normalize, convert_to_numpy=True)
+                embs = np.asarray(embs, dtype=np.float32)
+            except Exception as e:
+                for req in batch:
+                    req.future.set_exception(e)
+                continue
+            self.stats["requests"] += len(batch)
+            self.stats["texts"] += len(texts)
+            self.stats["batches"] += 1
+            start = 0
+            for req in batch:
+                end = start + len(req.texts)
+                req.future.set_result(embs[start:end])
+                start = end
@@ -0,0 +1,322 @@
+"""Figure-description pipeline for create_vector_db.ipynb (step 2).
+
+The notebook version reloaded BLIP for every image, reopened the PDF with fitz for every page and
+called the vision model one image at a time; its only cache was the all-or-nothing figure_docs.pkl.
+Here
+  - pages are read once by page_scanner (text, OCR, reference hits, image xrefs); the images of the
+    selected pages are extracted on a process pool, one opened document per worker
+  - BLIP is loaded once and captions images in batches
+  - vision-model descriptions run with bounded concurrency
+  - every result is cached by the image's content hash (.cache/figures.sqlite3), so adding one drawing
+    only describes that drawing
+StubVisionDescriber stands in for the vision API (tests, offline runs).
+
+Usage (from the repo root):
+    python -m helper_functions.figures --stub-vision
+"""
+import argparse
+import base64
+import glob
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain.schema import Document
+
+from . import settings
+from .embedding_cache import bytes_hash
+from .page_scanner import PageScan, scan_pdf
+
+OUTPUT_IMAGE_DIR = "auto_figures"
+BLIP_MODEL = "Salesforce/blip-image-captioning-base"
+VISION_MODEL = "gpt-4o"
+VISION_PROMPT = "Describe this engineering diagram in detail."
+
+
+class FigureCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS figures (
+                   kind TEXT NOT NULL,
+                   key TEXT NOT NULL,
+                   text TEXT NOT NULL,
+                   created_at REAL NOT NULL,
+                   PRIMARY KEY (kind, key)
+               )"""
+        )
+        self._conn.commit()
+
+    #kind is the producer ("blip:<model>", "vision:<model>"), key the sha256 of the image bytes
+    def get_many(self, kind: str, keys: Iterable[str]) -> Dict[str, str]:
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, str] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, text FROM figures WHERE kind = ? AND key IN ({','.join('?' * len(part))})",
+                    [kind, *part],
+                ).fetchall()
+                found.update(rows)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, kind: str, key: str, text: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO figures VALUES (?, ?, ?, ?)", (kind, key, text, time.time()))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0}
+
+
+#--- process-pool workers: one fitz document per worker process, opened by the initializer
+_worker_doc = None
+
+
+def _open_worker_doc(pdf_path: str):
+    global _worker_doc
+    import fitz  # PyMuPDF
+    _worker_doc = fitz.open(pdf_path)
+
+
+#save the given images of a (1-based) page as png; returns [(image_path, sha256 of the png bytes)]
+def _extract_page_images(page_number: int, xrefs: List[int], output_dir: str) -> List[Tuple[str, str]]:
+    import fitz
+    doc = _worker_doc
+    out = []
+    for img_index, xref in enumerate(xrefs):
+        pix = fitz.Pixmap(doc, xref)
+        if pix.n >= 5:  # CMYK → RGB
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        data = pix.tobytes("png")
+        img_path = os.path.join(output_dir, f"{os.path.basename(doc.name)}_p{page_number}_{img_index}.png")
+        with open(img_path, "wb") as f:
+            f.write(data)
+        out.append((img_path, bytes_hash(data)))
+    return out
+
+
+#as reference diagrams e.g. figure 1 may be mentioned multiple times, we assume that the last mention
+#of the figure is the page where the image/drawing is
+def detect_last_occurrences(scans: Iterable[PageScan]) -> Tuple[Dict[str, Dict], set]:
+    last_seen: Dict[str, Dict] = {}
+    unlabelled_pages = set()
+    for scan in scans:
+        if scan.refs:
+            for canonical, norm in scan.refs:
+                if norm not in last_seen or scan.page_num > last_seen[norm]["page"]:
+                    last_seen[norm] = {"canonical": canonical, "page": scan.page_num}
+        elif scan.image_xrefs:
+            unlabelled_pages.add(scan.page_num)
+    return last_seen, unlabelled_pages
+
+
+#--- describers
+class BlipCaptioner:
+    def __init__(self, model_name: str = BLIP_MODEL, batch_size: int = 8):
+        from transformers import BlipProcessor, BlipForConditionalGeneration
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.processor = BlipProcessor.from_pretrained(model_name)
+        self.model = BlipForConditionalGeneration.from_pretrained(model_name)
+        self.model.eval()
+
+    @property
+    def kind(self) -> str:
+        return f"blip:{self.model_name}"
+
+    def caption_many(self, image_paths: Sequence[str]) -> List[str]:
+        import torch
+        from PIL import Image
+        captions: List[str] = []
+        for i in range(0, len(image_paths), self.batch_size):
+            images = [Image.open(p).convert("RGB") for p in image_paths[i:i + self.batch_size]]
+            inputs = self.processor(images=images, return_tensors="pt")
+            with torch.no_grad():
+                output = self.model.generate(**inputs)
+            captions.extend(self.processor.batch_decode(output, skip_special_tokens=True))
+        return captions
+
+
+class OpenAIVisionDescriber:
+    def __init__(self, client=None, model: str = VISION_MODEL, max_tokens: int = 750):
+        if client is None:
+            from openai import OpenAI
+            from .LLM import API_KEY
+            client = OpenAI(api_key=API_KEY)
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens
+
+    @property
+    def kind(self) -> str:
+        return f"vision:{self.model}"
+
+    def describe(self, image_path: str) -> str:
+        with open(image_path, "rb") as image_file:
+            image_base64 = base64.b64encode(image_file.read()).decode("utf-8")
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": [
+                {"type": "text", "text": VISION_PROMPT},
+                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"}},
+            ]}],
+            max_tokens=self.max_tokens,
+        )
+        return response.choices[0].message.content
+
+
+#deterministic stand-in for the vision API: no network, optional fake latency
+class StubVisionDescriber:
+    kind = "vision:stub"
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def describe(self, image_path: str) -> str:
+        with self._lock:
+            self.calls += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        with open(image_path, "rb") as f:
+            digest = bytes_hash(f.read())[:12]
+        return f"Engineering diagram (stub description {digest})."
+
+
+class StubCaptioner:
+    kind = "blip:stub"
+
+    def caption_many(self, image_paths: Sequence[str]) -> List[str]:
+        return ["an engineering drawing" for _ in image_paths]
+
+
+#(blip caption, vision description) per image, only computing what the cache does not have yet
+def describe_images(images: Sequence[Tuple[str, str]], captioner, describer, cache: Optional[FigureCache] = None,
+                    concurrency: int = 4) -> Dict[str, Tuple[str, str]]:
+    by_hash = dict((h, p) for p, h in images)  # identical images are described once
+    blip = cache.get_many(captioner.kind, by_hash) if cache else {}
+    vision = cache.get_many(describer.kind, by_hash) if cache else {}
+
+    todo = [h for h in by_hash if h not in blip]
+    if todo:
+        for h, caption in zip(todo, captioner.caption_many([by_hash[h] for h in todo])):
+            blip[h] = caption
+            if cache:
+                cache.put(captioner.kind, h, caption)
+
+    def _describe(h):
+        text = describer.describe(by_hash[h])
+        if cache:
+            cache.put(describer.kind, h, text)
+        return h, text
+
+    todo = [h for h in by_hash if h not in vision]
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="vision") as pool:
+            vision.update(pool.map(_describe, todo))
+    return {p: (blip[h], vision[h]) for p, h in images}
+
+
+def _figure_doc(pdf_path: str, label: str, norm: str, page_num: int, img_path: str, blip: str, vision: str):
+    caption_combined = f"{label}\n[BLIP] {blip}\n[GPT-4V] {vision}"
+    return Document(
+        page_content=f"[DIAGRAM CAPTION]\n{caption_combined}",
+        metadata={
+            "source": os.path.basename(pdf_path),
+            "is_diagram": True,
+            "figure_label": label,
+            "figure_label_norm": norm,
+            "page_number": page_num,
+            "image_path": img_path,
+        },
+    )
+
+
+#`scans` (page_scanner.scan_pdf output) can be passed in so ingestion scans each pdf only once
+def build_figure_docs(pdf_path: str, captioner, describer, cache: Optional[FigureCache] = None,
+                      output_dir: str = OUTPUT_IMAGE_DIR, workers: Optional[int] = None,
+                      vision_concurrency: int = 4,
+                      scans: Optional[Sequence[PageScan]] = None) -> Tuple[List[Document], Dict[str, str]]:
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or settings.env_int("INGEST_WORKERS", max(1, (os.cpu_count() or 2) - 1))
+    if scans is None:
+        scans = list(scan_pdf(pdf_path, workers=workers))
+    xrefs = {s.page_num: s.image_xrefs for s in scans}
+    last_seen, unlabelled_pages = detect_last_occurrences(scans)
+    # (label, norm, page) for labelled diagrams, then unlabelled image pages
+    targets = [(info["canonical"], norm, info["page"]) for norm, info in last_seen.items()]
+    targets += [(f"UNLABELLED_DIAGRAM_p{p}", f"unlabelled_diagram_p{p}", p) for p in sorted(unlabelled_pages)]
+    pages = [p for p in sorted({page for _, _, page in targets}) if xrefs.get(p)]
+    page_images = {p: [] for _, _, p in targets}
+    if pages:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pages)), initializer=_open_worker_doc,
+                                 initargs=(pdf_path,)) as pool:
+            page_images.update(zip(pages, pool.map(_extract_page_images, pages, [xrefs[p] for p in pages],
+                                                   [output_dir] * len(pages))))
+
+    images = list(dict.fromkeys(img for p in pages for img in page_images[p]))
+    described = describe_images(images, captioner, describer, cache, concurrency=vision_concurrency)
+
+    label_map = {norm: label for label, norm, _ in targets if not norm.startswith("unlabelled_diagram_p")}
+    figure_docs = [
+        _figure_doc(pdf_path, label, norm, page, img_path, *described[img_path])
+        for label, norm, page in targets
+        for img_path, _ in page_images[page]
+    ]
+    return figure_docs, label_map
+
+
+def get_figure_cache() -> FigureCache:
+    return FigureCache(settings.cache_path("figures.sqlite3"))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m helper_functions.figures", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pdf", nargs="+", default=sorted(glob.glob("./data/*.pdf")))
+    ap.add_argument("--output-dir", default=OUTPUT_IMAGE_DIR)
+    ap.add_argument("--figures-out", default="figure_docs.pkl")
+    ap.add_argument("--label-map-out", default="label_map.json")
+    ap.add_argument("--workers", type=int, default=None, help="processes for scanning/OCR/image extraction")
+    ap.add_argument("--vision-concurrency", type=int, default=4, help="vision calls in flight")
+    ap.add_argument("--stub-vision", action="store_true", help="use the local stub instead of the vision API")
+    ap.add_argument("--stub-blip", action="store_true", help="skip BLIP (no torch/transformers needed)")
+    args = ap.parse_args(argv)
+
+    captioner = StubCaptioner() if args.stub_blip else BlipCaptioner()
+    describer = StubVisionDescriber() if args.stub_vision else OpenAIVisionDescriber()
+    cache = get_figure_cache()
+    all_figure_docs, global_label_map = [], {}
+    t0 = time.perf_counter()
+    for pdf_path in args.pdf:
+        figs, label_map = build_figure_docs(pdf_path, captioner, describer, cache, output_dir=args.output_dir,
+                                            workers=args.workers, vision_concurrency=args.vision_concurrency)
+        all_figure_docs.extend(figs)
+        global_label_map.update(label_map)
+    with open(args.figures_out, "wb") as f:
+        pickle.dump(all_figure_docs, f)
+    with open(args.label_map_out, "w") as f:
+        json.dump(global_label_map, f, indent=2)
+    print(json.dumps({"figure_docs": len(all_figure_docs), "labels": len(global_label_map),
+                      "cache": cache.stats(), "seconds": round(time.perf_counter() - t0, 1)}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,21 +5,31 @@ try:
     sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
 except Exception:
     pass
-import os, io, shutil, tempfile
-from typing import List, Dict, Tuple
+import os, io, tempfile, uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
 
 import streamlit as st
 from . import LLM as llm 
-from pypdf import PdfReader
-import docx2txt
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer 
+from langchain.schema import Document
+from . import settings, tracing
+from .chunker import StructureChunker, chunk_metadata, locator
+from .embedding_service import EmbeddingService
+from .embedding_cache import EmbeddingCache, bytes_hash, embed_with_cache
+from .upload_index import SessionIndex, UploadIndexRegistry, UploadQuotaExceeded, estimate_bytes
+from .vector_index import mmr_select
+
+#pypdf, docx2txt, chromadb and sentence_transformers (torch) are imported where they are used,
+#so the login page never pays for them; they are only loaded once a user works with uploads
 
 #create temparory vectordb from uploaded document
 #read uploaded pdf
 #Return (text, metadata) for the whole file 
 def read_pdf_pages_from_bytes(data: bytes, name: str) -> List[Tuple[str, Dict]]:
+    from pypdf import PdfReader
     reader = PdfReader(io.BytesIO(data))
     docs: List[Tuple[str, Dict]] = [] #to upload page by page with metadata
     for i, page in enumerate(reader.pages):
@@ -30,9 +40,76 @@ def read_pdf_pages_from_bytes(data: bytes, name: str) -> List[Tuple[str, Dict]]:
         if text.strip():
             docs.append((text, {"source": name, "page": i + 1, "type": "pdf"}))
     return docs
+#worker for the ingestion process pool: extract pages [start, end) of a pdf on disk
+#(top level so it can be pickled; the file path is sent instead of the bytes to keep IPC small)
+def _extract_pdf_page_range(path: str, name: str, start: int, end: int) -> List[Tuple[str, Dict]]:
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    docs: List[Tuple[str, Dict]] = []
+    for i in range(start, end):
+        try:
+            text = reader.pages[i].extract_text() or ""
+        except Exception:
+            text = ""
+        if text.strip():
+            docs.append((text, {"source": name, "page": i + 1, "type": "pdf"}))
+    return docs
+
+#shared process pool for page extraction (pypdf is pure python and holds the GIL), and its worker count
+@st.cache_resource
+def get_ingest_pool() -> Tuple[ProcessPoolExecutor, int]:
+    workers = max(1, settings.env_int("INGEST_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+    return ProcessPoolExecutor(max_workers=workers), workers
+
+#Yield (text, metadata) page by page, in page order.
+#Large pdfs fan out over the process pool in ranges of `pages_per_task`; at most 2 tasks per worker are
+#in flight so memory stays bounded however long the document is.
+def iter_pdf_pages_from_bytes(data: bytes, name: str, pages_per_task: int = 8,
+                              on_page: Optional[Callable[[int, int], None]] = None) -> Iterator[Tuple[str, Dict]]:
+    from pypdf import PdfReader
+    reader = PdfReader(io.BytesIO(data))
+    n_pages = len(reader.pages)
+    if n_pages <= settings.env_int("INGEST_INLINE_MAX_PAGES", 16):
+        # small files: the pool round trip costs more than parsing inline
+        for i, page in enumerate(reader.pages):
+            try:
+                text = page.extract_text() or ""
+            except Exception:
+                text = ""
+            if text.strip():
+                yield (text, {"source": name, "page": i + 1, "type": "pdf"})
+            if on_page:
+                on_page(i + 1, n_pages)
+        return
+    del reader
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tf:
+        tf.write(data)
+        temp_path = tf.name
+    try:
+        pool, workers = get_ingest_pool()
+        ranges = deque((s, min(s + pages_per_task, n_pages)) for s in range(0, n_pages, pages_per_task))
+        window = 2 * workers
+        in_flight = deque()
+        while ranges or in_flight:
+            while ranges and len(in_flight) < window:
+                start, end = ranges.popleft()
+                in_flight.append((end, pool.submit(_extract_pdf_page_range, temp_path, name, start, end)))
+            end, fut = in_flight.popleft()
+            for pair in fut.result():
+                yield pair
+            if on_page:
+                on_page(end, n_pages)
+    finally:
+        try:
+            os.remove(temp_path)
+        except Exception:
+            pass
+
 #read uploaded docx
 #Return (text, metadata) for the whole file 
 def read_docx_whole_from_bytes(data: bytes, name: str) -> List[Tuple[str, Dict]]:
+    import docx2txt
     # docx2txt requires a file path; use a secure temp file
     with tempfile.NamedTemporaryFile(delete=False, suffix=f"__{name}") as tf:
         tf.write(data)
@@ -54,32 +131,43 @@ def read_txt_whole_from_bytes(data: bytes, name: str) -> List[Tuple[str, Dict]]:
         text = data.decode("latin-1", errors="ignore")
     return [(text, {"source": name, "type": "text"})] if text.strip() else []
 
-#function to chunk text
-def chunk_text(text: str, chunk_size_words: int = 220, overlap_words: int = 40) -> List[str]:
-    words = text.split()
-    if not words:
-        return []
-    chunks, step = [], max(1, chunk_size_words - overlap_words)
-    for start in range(0, len(words), step):
-        end = start + chunk_size_words
-        chunk = " ".join(words[start:end]).strip()
-        if chunk:
-            chunks.append(chunk)
-        if end >= len(words):
-            break
-    return chunks
+#use minilm instead of GPT for temp documents to save cost
+UPLOAD_EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+#same structure-aware chunker as the persistent corpus (chunker.py), sized for MiniLM: it truncates
+#inputs at 256 word pieces, which 220-word windows regularly went over. Chunks are counted in MiniLM's own
+#word pieces (tokens.count_tokens), not in the OpenAI tokenizer's
+UPLOAD_CHUNKER = StructureChunker(max_tokens=settings.env_int("UPLOAD_CHUNK_TOKENS", 200),
+                                  overlap_tokens=settings.env_int("UPLOAD_CHUNK_OVERLAP_TOKENS", 30),
+                                  model=UPLOAD_EMBED_MODEL)
+
+#chunk one page (or whole docx/txt) into segments with unique IDs.
+#pdf chunks keep their page; docx/txt have no pages, so their chunks only carry the clause (`section`).
+#`open_heading` is the clause still open at the end of the previous page
+def _segments_from_pair(name: str, page_text: str, meta: Dict, open_heading: Optional[str] = None) -> List[Dict]:
+    is_pdf = meta.get("type") == "pdf"
+    segments = []
+    for ci, c in enumerate(UPLOAD_CHUNKER.chunk(page_text, open_heading)):
+        md = {"source": name, **chunk_metadata(c)}
+        if is_pdf:
+            md["page"] = meta.get("page", 1)
+            seg_id = f"{name}::p{md['page']}::c{ci}"
+        else:
+            seg_id = f"{name}::c{ci}"
+        segments.append({"id": seg_id, "text": c.text, "metadata": md})
+    return segments
 
 # bringing the above functions together
-# Turn uploaded files into segments: [{"id": str, "text": str, "metadata": {"source":..., "page":...}}, ...]
-def build_segments_from_uploads(files) -> List[Dict]:
-    #if multiple files are uploaded
-    segments: List[Dict] = []
+# Stream segments out of the uploaded files page by page: {"id": str, "text": str, "metadata": {"source":..., "page"?:..., "section"?:...}}
+# on_progress(name, pages_done, pages_total) is called as each file advances
+def iter_segments_from_uploads(files, on_progress: Optional[Callable[[str, int, int], None]] = None) -> Iterator[Dict]:
     for f in files:
         name = getattr(f, "name", "uploaded")
         data = f.getvalue()  # read bytes once
         ext = name.lower().rsplit(".", 1)[-1] if "." in name else ""
         if ext == "pdf":
-            pairs = read_pdf_pages_from_bytes(data, name)
+            on_page = (lambda done, total, _n=name: on_progress(_n, done, total)) if on_progress else None
+            pairs = iter_pdf_pages_from_bytes(data, name, on_page=on_page)
         elif ext in ("docx",):
             pairs = read_docx_whole_from_bytes(data, name)
         elif ext in ("txt", "md"):
@@ -87,68 +175,200 @@ def build_segments_from_uploads(files) -> List[Dict]:
         else:
             pairs = read_txt_whole_from_bytes(data, name)
 
-        # chunk + make unique IDs
-        for (page_text, meta) in pairs:
-            is_pdf = meta.get("type") == "pdf"
-            base_page = meta.get("page", 1)
-            chunks = chunk_text(page_text, 220, 40)
-            for ci, c in enumerate(chunks):
-                page = base_page if is_pdf else (ci + 1)
-                seg_id = f"{name}::p{page}::c{ci}"
-                segments.append({"id": seg_id, "text": c, "metadata": {"source": name, "page": page}})
-    return segments
+        heading = None
+        for (page_text, meta) in tracing.timed_iter("parse", pairs):
+            with tracing.span("chunk") as sp:
+                segments = _segments_from_pair(name, page_text, meta, open_heading=heading)
+                heading = UPLOAD_CHUNKER.last_heading(page_text, heading)
+                sp.set(chunks=len(segments))
+            yield from segments
+        if on_progress and ext != "pdf":
+            on_progress(name, 1, 1)
+
+# Turn uploaded files into segments: [{"id": str, "text": str, "metadata": {"source":..., "page"?:..., "section"?:...}}, ...]
+def build_segments_from_uploads(files) -> List[Dict]:
+    return list(iter_segments_from_uploads(files))
+
+#all sessions' uploads live in one in-memory index, one namespace per session: a numpy matrix for small
+#uploads, a collection of a shared Chroma EphemeralClient above UPLOAD_NUMPY_MAX_CHUNKS (see upload_index.py).
+#UPLOAD_NUMPY_MAX_CHUNKS must stay below the per-session quota, or no session ever gets to move to Chroma
+@st.cache_resource
+def get_upload_index() -> UploadIndexRegistry:
+    def client_factory():
+        import chromadb
+        from chromadb.config import Settings
+        return chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False, allow_reset=True))
+    registry = UploadIndexRegistry(
+        client_factory,
+        ttl_s=settings.env_float("UPLOAD_SESSION_TTL_S", 3600.0),
+        max_chunks=settings.env_int("UPLOAD_MAX_CHUNKS_PER_SESSION", 20_000),
+        max_bytes=int(settings.env_float("UPLOAD_MAX_MB_PER_SESSION", 64.0) * 2**20),
+        sweep_interval_s=settings.env_float("UPLOAD_SWEEP_INTERVAL_S", 60.0),
+        backend=os.getenv("UPLOAD_INDEX_BACKEND", "auto"),
+        numpy_max_chunks=settings.env_int("UPLOAD_NUMPY_MAX_CHUNKS", 10_000),
+        numpy_dtype=os.getenv("UPLOAD_NUMPY_DTYPE", "float32"),
+    )
+    registry.start_sweeper()
+    return registry
+
+#namespace of the current browser session in the shared upload index
+def current_session_id() -> str:
+    if "upload_session_id" not in st.session_state:
+        st.session_state.upload_session_id = uuid.uuid4().hex
+    return st.session_state.upload_session_id
+
+#the current session's slot in the shared upload index (created on first use)
+def get_temp_chroma() -> SessionIndex:
+    return get_upload_index().get(current_session_id())
 
-def get_temp_chroma():
-    if "tmp_chroma_dir" not in st.session_state:
-        st.session_state.tmp_chroma_dir = tempfile.mkdtemp(prefix="chroma_session_")
-        st.session_state.tmp_chroma_client = chromadb.PersistentClient(
-            path=st.session_state.tmp_chroma_dir,
-            settings=Settings(allow_reset=True)
-        )
-        st.session_state.tmp_chroma_coll = st.session_state.tmp_chroma_client.get_or_create_collection(
-            "session_docs"
-        )
-    return (st.session_state.tmp_chroma_client,
-            st.session_state.tmp_chroma_coll,
-            st.session_state.tmp_chroma_dir)
-#Deletes the session’s temp chroma directory
+#drops the current session's uploads from the shared index
 def clear_temp_chroma():
-    tmp = st.session_state.pop("tmp_chroma_dir", None)
-    st.session_state.pop("tmp_chroma_client", None)
-    st.session_state.pop("tmp_chroma_coll", None)
-    if tmp and os.path.isdir(tmp):
-        shutil.rmtree(tmp, ignore_errors=True)
+    sid = st.session_state.get("upload_session_id")
+    if sid:
+        get_upload_index().drop(sid)
 
+#loaded on first use and shared by every session of the server process
+@st.cache_resource
 def get_embedder():
-    model = st.session_state.get("_embedder")
-    if model is None:
-        #use minilm instead of GPT for temp documents to save cost
-        model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-        st.session_state._embedder = model
-    return model
-
-#embed the text 
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(UPLOAD_EMBED_MODEL)
+
+#one micro-batching queue in front of the shared model: concurrent calls from different sessions
+#are coalesced into a single encode batch
+@st.cache_resource
+def get_embedding_service() -> EmbeddingService:
+    return EmbeddingService(
+        get_embedder,
+        max_batch_size=settings.env_int("EMBED_MAX_BATCH_SIZE", 64),
+        max_wait_ms=settings.env_float("EMBED_MAX_WAIT_MS", 5.0),
+    )
+
+#on-disk cache of chunk embeddings keyed by chunk hash + model, shared by all sessions and restarts
+@st.cache_resource
+def get_upload_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache(settings.cache_path("upload_embeddings.sqlite3"),
+                          max_entries=settings.env_int("UPLOAD_EMBED_CACHE_MAX_ENTRIES", 200_000))
+
+#parsed segments of recently uploaded files keyed by file hash, so another session uploading the
+#same bytes skips parsing too. opt-in (UPLOAD_SHARED_SEGMENT_CACHE=1) as it keeps whole files in memory
+@st.cache_resource
+def get_shared_segment_cache() -> Dict[str, List[Dict]]:
+    return {}
+
+#embed the text; only chunks never seen before go through the model
 def embed_chunks(texts: List[str]) -> List[List[float]]:
-    model = get_embedder()
-    return model.encode(texts, normalize_embeddings=True).tolist()
+    with tracing.span("embed", texts=len(texts)) as sp:
+        stats = {}
+        embs = embed_with_cache(get_upload_embedding_cache(), UPLOAD_EMBED_MODEL, texts,
+                                get_embedding_service().encode, stats=stats)
+        sp.set(**stats)
+    return [e.tolist() for e in embs]
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-def chroma_add_segments(segments: List[Dict]):
+def chroma_add_segments(segments: Iterable[Dict], batch_size: int = 128) -> int:
     """
-    segments: list of dicts like {"id": str, "text": str, "metadata": {...}}
+    segments: list (or stream) of dicts like {"id": str, "text": str, "metadata": {...}}
+    Embeds and inserts in batches of `batch_size` as segments arrive; returns how many were added.
+    Raises UploadQuotaExceeded once the session's chunk or memory quota would be exceeded.
     """
-    _, coll, _ = get_temp_chroma()
-    texts = [s["text"] for s in segments]
-    ids = [s["id"] for s in segments]
-    metas = [s.get("metadata", {}) for s in segments]
-    embs = embed_chunks(texts)
-    coll.add(documents=texts, embeddings=embs, metadatas=metas, ids=ids)
-
-def chroma_query(query: str, top_k: int = 8) -> List[Dict]:
-    _, coll, _ = get_temp_chroma()
+    registry = get_upload_index()
+    added = 0
+    with registry.use(current_session_id()) as sess:
+        for batch in _batched(segments, batch_size):
+            texts = [s["text"] for s in batch]
+            ids = [s["id"] for s in batch]
+            metas = [s.get("metadata", {}) for s in batch]
+            embs = embed_chunks(texts)
+            per_source: Dict[str, List[int]] = {}
+            for t, e, m in zip(texts, embs, metas):
+                usage = per_source.setdefault(m.get("source", "uploaded"), [0, 0])
+                usage[0] += 1
+                usage[1] += estimate_bytes(t, e, m)
+            for source, (n, nbytes) in per_source.items():
+                registry.reserve(sess, source, n, nbytes)
+            with sess.lock, tracing.span("insert", chunks=len(batch), backend=sess.backend):
+                registry.prepare_insert(sess, len(batch))
+                sess.collection.upsert(documents=texts, embeddings=embs, metadatas=metas, ids=ids)
+            added += len(batch)
+    return added
+
+#segments of one file, served from the shared cache when the same bytes were parsed before
+def _segments_for_file(f, digest: str, on_progress) -> Iterator[Dict]:
+    if not settings.env_bool("UPLOAD_SHARED_SEGMENT_CACHE", False):
+        yield from iter_segments_from_uploads([f], on_progress=on_progress)
+        return
+    shared = get_shared_segment_cache()
+    name = getattr(f, "name", "uploaded")
+    cached = shared.get(digest)
+    if cached is not None and all(seg["metadata"].get("source") == name for seg in cached[:1]):
+        if on_progress:
+            on_progress(name, 1, 1)
+        yield from cached
+        return
+    collected = []
+    for seg in iter_segments_from_uploads([f], on_progress=on_progress):
+        collected.append(seg)
+        yield seg
+    shared[digest] = collected
+    while len(shared) > settings.env_int("UPLOAD_SHARED_SEGMENT_CACHE_FILES", 16):
+        shared.pop(next(iter(shared)))
+
+#parse → chunk → embed → insert as one pipeline; pages are indexed while later pages are still being parsed.
+#Files are content-addressed per session: a file whose bytes are already indexed is skipped entirely,
+#a file replaced under the same name is re-indexed, and files no longer uploaded are dropped.
+#Returns the number of segments in the session's index.
+def index_uploads(files, on_progress: Optional[Callable[[str, int, int], None]] = None) -> int:
+    with tracing.trace("upload", files=len(files)):
+        return _index_uploads(files, on_progress)
+
+def _index_uploads(files, on_progress) -> int:
+    registry = get_upload_index()
+    with registry.use(current_session_id()) as sess:
+        current = {}
+        for f in files:
+            current[getattr(f, "name", "uploaded")] = (f, bytes_hash(f.getvalue()))
+
+        for name in [n for n in sess.indexed_files() if n not in current or sess.file_digest(n) != current[n][1]]:
+            with tracing.span("delete"):
+                registry.remove_file(sess, name)
+
+        for name, (f, digest) in current.items():
+            if sess.file_digest(name) == digest:
+                tracing.count("upload", files_skipped=1)
+                if on_progress:
+                    on_progress(name, 1, 1)
+                continue
+            try:
+                chroma_add_segments(_segments_for_file(f, digest, on_progress))
+            except BaseException:
+                # a half-indexed file would look complete to the next rerun; drop what made it in
+                registry.remove_file(sess, name)
+                raise
+            sess.set_digest(name, digest)
+        return sess.count()
+
+#top_k excerpts of the session's uploads; mmr=True diversifies them (UPLOAD_QUERY_MMR turns it on by default)
+def chroma_query(query: str, top_k: int = 8, mmr: Optional[bool] = None, lambda_mult: float = 0.5) -> List[Dict]:
+    mmr = settings.env_bool("UPLOAD_QUERY_MMR", False) if mmr is None else mmr
     # Supply query_embeddings (not query_texts) since we didn't attach an embedding fn to the collection
-    
-    q_emb = get_embedder().encode([query], normalize_embeddings=True).tolist()
-    results = coll.query(query_embeddings=q_emb, n_results=top_k)
+    q_emb = embed_chunks([query])
+    with get_upload_index().use(current_session_id()) as sess, tracing.span("upload_query", backend=sess.backend) as sp:
+        if not mmr:
+            results = sess.collection.query(query_embeddings=q_emb, n_results=top_k)
+        elif sess.backend == "numpy":
+            results = sess.collection.query(query_embeddings=q_emb, n_results=top_k, mmr=True, lambda_mult=lambda_mult)
+        else:
+            results = _chroma_mmr(sess.collection, q_emb[0], top_k, lambda_mult)
+        sp.set(docs=len(results["ids"][0]) if results and results.get("ids") else 0)
     outs: List[Dict] = []
     if results and results.get("documents"):
         for i, doc in enumerate(results["documents"][0]):
@@ -159,30 +379,52 @@ def chroma_query(query: str, top_k: int = 8) -> List[Dict]:
             })
     return outs
 
-#function for llm to answer questions from uploaded document
-#wraps around ask function from llm.py with temp_context=True where persistent vector store will not be
-#used
-def ask_with_temp_context(question: str, excerpts: List[Dict], strict: bool = True) -> str:
+#MMR on a Chroma collection: fetch 4*k candidates with their vectors, re-select with the numpy MMR
+def _chroma_mmr(coll, q_emb: List[float], top_k: int, lambda_mult: float) -> Dict:
+    res = coll.query(query_embeddings=[q_emb], n_results=4 * top_k,
+                     include=["documents", "metadatas", "distances", "embeddings"])
+    if not res["ids"][0]:
+        return res
+    keep = mmr_select(np.asarray(q_emb, dtype=np.float32), np.asarray(res["embeddings"][0], dtype=np.float32),
+                      top_k, lambda_mult)
+    return {key: [[res[key][0][i] for i in keep]] for key in ("ids", "documents", "metadatas", "distances")}
+
+#build the prompt for the temp-context path from the retrieved excerpts
+def _build_temp_context_prompt(question: str, excerpts: List[Dict], strict: bool = True) -> str:
     context_lines = []
     for e in excerpts:
-        src = e.get("metadata", {}).get("source", "uploaded")
-        page = e.get("metadata", {}).get("page", "?")
-        context_lines.append(f"[{src} p.{page}]\n{e['text']}\n")
+        md = e.get("metadata", {})
+        src, loc = md.get("source", "uploaded"), locator(md)
+        context_lines.append(f"[{src} {loc}]\n{e['text']}\n" if loc else f"[{src}]\n{e['text']}\n")
     context = "\n".join(context_lines)
 #optinality to only answer from document or not to
     guard = ("If the answer is not present in the context, reply exactly: "
              "'Not found in the uploaded documents.'") if strict else \
             "Prefer answers grounded in the context. If something isn't covered, you may add concise general knowledge (flag clearly)."
 
-    prompt = (
+    return (
         f'''
         Use the context below to answer the question.
         {guard}
         Context excerpts:
         {context}
         User question: {question}
-        Answer concisely with brief citations like [source p.page] where applicable.
+        Answer concisely with brief citations like [source p.page] or [source §clause] where applicable.
         '''
     )
+
+#function for llm to answer questions from uploaded document
+#wraps around ask function from llm.py with temp_context=True where persistent vector store will not be
+#used. with stream=True a token generator is returned instead (citations of the excerpts appended at the end);
+#use_async=True streams through llm.ask_stream_async on the shared event loop
+def ask_with_temp_context(question: str, excerpts: List[Dict], strict: bool = True,
+                          stream: bool = False, metrics: Optional[Dict] = None, use_async: bool = False):
+    prompt = _build_temp_context_prompt(question, excerpts, strict=strict)
+    if stream:
+        source_docs = [Document(page_content=e["text"], metadata=e.get("metadata", {})) for e in excerpts]
+        if use_async:
+            return llm.iterate_async(llm.ask_stream_async(prompt, temp_context=True, source_docs=source_docs,
+                                                          metrics=metrics))
+        return llm.ask_stream(prompt, temp_context=True, source_docs=source_docs, metrics=metrics)
     # Call into LLM.ask, indicating temp_context=True
-    return llm.ask(prompt, temp_context=True) 
\ No newline at end of file
+    return llm.ask(prompt, temp_context=True) 
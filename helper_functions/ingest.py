@@ -0,0 +1,398 @@
+"""Incremental, resumable ingestion of the Codes of Practice into chroma_parent_child.
+
+Replaces the all-at-once `Chroma.from_documents` step of create_vector_db.ipynb:
+  - pages are read once by page_scanner (text layer, OCR of scanned drawings, reference hits)
+  - every PDF and every page is fingerprinted (sha256) and diffed against a manifest stored in the
+    store directory (ingest_manifest.json)
+  - only new or changed pages are chunked (chunker.StructureChunker: clause, heading and table aware,
+    token sized) and embedded, in bounded concurrent batches; changing the chunker or its sizes
+    re-chunks every page
+  - ids of removed/changed chunks are deleted from the collection
+  - a store without a manifest (e.g. one built by the old notebook, with random ids) is emptied first, so
+    its documents are not kept next to the new ones; --rebuild does the same for any store
+  - the manifest is saved after every committed batch, so a crashed run resumes where it stopped
+  - the parent docstore, BM25 index, reference index and memory-mapped vector export (with its int8 or PCA
+    copy when --compression / VECTOR_COMPRESSION asks for one) are kept in step with the collection
+
+Usage (from the repo root):
+    python -m helper_functions.ingest --dry-run
+    python -m helper_functions.ingest --pdf data/*.pdf --figures figure_docs.pkl
+    python -m helper_functions.ingest --rebuild   # re-embed everything into an emptied collection
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain.schema import Document
+
+from . import settings
+from .chunker import StructureChunker, chunk_metadata
+from .mmap_index import (MMAP_INDEX_DIRNAME, ROWS_FILENAME, VECTORS_FILENAME, compressed_filenames,
+                         export_from_chroma)
+from .page_scanner import PageScan, scan_pdf
+from .parent_store import PARENT_STORE_FILENAME, ParentStore, parent_id
+from .ref_index import REF_INDEX_FILENAME, build_ref_index_from_chroma, save_ref_index, stable_doc_ids
+from .refs import extract_annex_refs
+from .tokens import count_tokens
+
+MANIFEST_FILENAME = "ingest_manifest.json"
+FIGURES_KEY = "__figures__"
+#chunk size in tokens of the embedding model; overlap only applies inside a clause too long for one chunk
+CHUNK_TOKENS = settings.env_int("CHUNK_TOKENS", 320)
+CHUNK_OVERLAP_TOKENS = settings.env_int("CHUNK_OVERLAP_TOKENS", 32)
+
+#(id, text, metadata)
+Chunk = Tuple[str, str, Dict]
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _stringify_primitive(v):
+    # allow primitives only
+    return v if isinstance(v, (str, int, float, bool)) or v is None else str(v)
+
+
+#Chroma only takes scalar metadata (moved here from the notebook)
+def filter_complex_metadata(metadata: Dict) -> Dict:
+    keep_keys = {
+        "source", "page", "parent_id", "section", "heading",
+        "annex_refs", "is_diagram", "figure_label", "figure_label_norm",
+        "page_number", "image_path"
+    }
+    md_simple = {k: metadata[k] for k in keep_keys if k in metadata}
+    # normalize 'page' (figures may use 'page_number')
+    if "page" not in md_simple and "page_number" in md_simple:
+        try:
+            md_simple["page"] = int(md_simple["page_number"])
+        except Exception:
+            pass
+    # annex_refs (list) -> "; "-joined annex_refs_csv; dropped if empty
+    refs = md_simple.pop("annex_refs", None)
+    if isinstance(refs, (list, tuple, set)):
+        refs = [str(x) for x in refs if str(x).strip()]
+        if refs:
+            md_simple["annex_refs_csv"] = "; ".join(sorted(refs))
+    return {k: _stringify_primitive(v) for k, v in md_simple.items()}
+
+
+#one PageScan per PDF page (text layer, OCR of scanned drawings, reference hits), read in a single pass
+def load_pdf_pages(path: str) -> List[PageScan]:
+    return list(scan_pdf(path))
+
+
+def get_splitter() -> StructureChunker:
+    return StructureChunker(max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS,
+                            model="text-embedding-ada-002")
+
+
+#child chunks of one page with stable ids "<source>::p<page>::c<n>", tagged with the clause they belong to.
+#`open_heading` is the clause still open at the end of the previous page (splitter.last_heading).
+#`page_refs` are the scanner's reference hits for the page; a chunk carries the ones whose text it
+#contains, so ref_regex is not run again over every chunk. The hits keep the PDF's spelling ("Annex  J",
+#"Figure\n3") while the chunker collapses whitespace, so they are compared whitespace-normalized
+def chunk_page(source: str, page: int, text: str, splitter: StructureChunker,
+               page_refs: Optional[List[Tuple[str, str]]] = None, open_heading: Optional[str] = None) -> List[Chunk]:
+    pid = parent_id(source, page)
+    chunks = []
+    for n, c in enumerate(splitter.chunk(text, open_heading)):
+        refs = (list(dict.fromkeys(norm for match, norm in page_refs if " ".join(match.split()) in c.text))
+                if page_refs is not None else extract_annex_refs(c.text))
+        md = filter_complex_metadata({"source": source, "page": int(page), "parent_id": pid,
+                                      "annex_refs": refs, **chunk_metadata(c)})
+        chunks.append((f"{source}::p{page}::c{n}", c.text, md))
+    return chunks
+
+
+def manifest_exists(db_dir: str) -> bool:
+    return os.path.exists(os.path.join(db_dir, MANIFEST_FILENAME))
+
+
+def load_manifest(db_dir: str) -> Dict:
+    path = os.path.join(db_dir, MANIFEST_FILENAME)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"version": 1, "files": {}}
+
+
+def save_manifest(db_dir: str, manifest: Dict):
+    os.makedirs(db_dir, exist_ok=True)
+    path = os.path.join(db_dir, MANIFEST_FILENAME)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+#work item = one page (or one figure doc) whose chunks must be (re)embedded
+def _work_item(file: str, key: str, content_hash: str, chunks: List[Chunk], stale_ids: List[str],
+               parent: Optional[Tuple] = None) -> Dict:
+    return {"file": file, "key": key, "hash": content_hash, "chunks": chunks, "stale_ids": stale_ids,
+            "parent": parent}
+
+
+#diff the inputs against the manifest; nothing is written.
+#`scans` maps a pdf path to its page scans when the caller already has them (e.g. from the figure step).
+#Without a manifest nothing in the collection is known to match the stable ids planned here, so the plan
+#resets the collection (plan["reset"]); `rebuild` does the same for a store that has one
+def plan_ingest(pdf_paths: Sequence[str], db_dir: str, figure_docs: Optional[Sequence[Document]] = None,
+                prune: bool = False, scans: Optional[Dict[str, Sequence[PageScan]]] = None,
+                rebuild: bool = False) -> Dict:
+    reset = rebuild or not manifest_exists(db_dir)
+    manifest = {"version": 1, "files": {}} if reset else load_manifest(db_dir)
+    files = manifest.get("files", {})
+    splitter = get_splitter()
+    plan = {"work": [], "deletions": [], "file_hashes": {}, "unchanged_files": [], "removed_files": [],
+            "chunker": splitter.signature, "reset": reset}
+
+    for path in pdf_paths:
+        source = os.path.basename(path)
+        sha = file_sha256(path)
+        plan["file_hashes"][source] = sha
+        entry = files.get(source, {})
+        if entry.get("sha256") == sha and entry.get("chunker") == splitter.signature:
+            plan["unchanged_files"].append(source)
+            continue
+        old_pages = entry.get("pages", {})
+        seen_pages = set()
+        heading = None
+        for scan in (scans or {}).get(path) or load_pdf_pages(path):
+            page, text = scan.page_index, scan.merged_text
+            key = str(page)
+            seen_pages.add(key)
+            # a page's chunks also depend on the chunker and on the clause left open by the previous page
+            h = _sha256(f"{splitter.signature}\n{heading}\n{text}".encode("utf-8"))
+            open_heading, heading = heading, splitter.last_heading(text, heading)
+            old = old_pages.get(key, {})
+            if old.get("hash") == h:
+                continue  # page already ingested (unchanged, or committed before a crash)
+            chunks = chunk_page(source, page, text, splitter, page_refs=scan.refs, open_heading=open_heading)
+            new_ids = {c[0] for c in chunks}
+            stale = [i for i in old.get("ids", []) if i not in new_ids]
+            plan["work"].append(_work_item(source, key, h, chunks, stale,
+                                           parent=(parent_id(source, page), source, int(page), text)))
+        for key, old in old_pages.items():
+            if key not in seen_pages:
+                plan["deletions"].extend(old.get("ids", []))
+
+    if figure_docs is not None:
+        plan["file_hashes"][FIGURES_KEY] = None
+        old_figs = files.get(FIGURES_KEY, {}).get("pages", {})
+        metas = [filter_complex_metadata(d.metadata or {}) for d in figure_docs]
+        ids = stable_doc_ids(metas)
+        current = set(ids)
+        for fig_id, d, md in zip(ids, figure_docs, metas):
+            h = _sha256((d.page_content + json.dumps(md, sort_keys=True)).encode("utf-8"))
+            if old_figs.get(fig_id, {}).get("hash") != h:
+                plan["work"].append(_work_item(FIGURES_KEY, fig_id, h, [(fig_id, d.page_content, md)], []))
+        plan["deletions"].extend(i for k, v in old_figs.items() if k not in current for i in v.get("ids", []))
+
+    if prune:
+        wanted = set(plan["file_hashes"])
+        for source, entry in files.items():
+            if source not in wanted:
+                plan["removed_files"].append(source)
+                plan["deletions"].extend(i for p in entry.get("pages", {}).values() for i in p.get("ids", []))
+    return plan
+
+
+#group work items into batches of at most `batch_size` chunks (a bigger page forms its own batch)
+def _batches(work: List[Dict], batch_size: int) -> List[List[Dict]]:
+    batches, current, size = [], [], 0
+    for item in work:
+        n = len(item["chunks"])
+        if current and size + n > batch_size:
+            batches.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+def summarize_plan(plan: Dict, batch_size: int) -> Dict:
+    texts = [c[1] for item in plan["work"] for c in item["chunks"]]
+    return {
+        "reset_collection": plan["reset"],
+        "files_unchanged": len(plan["unchanged_files"]),
+        "files_changed": len({i["file"] for i in plan["work"]}),
+        "files_removed": len(plan["removed_files"]),
+        "pages_to_embed": sum(1 for i in plan["work"] if i["file"] != FIGURES_KEY),
+        "figures_to_embed": sum(1 for i in plan["work"] if i["file"] == FIGURES_KEY),
+        "chunks_to_embed": len(texts),
+        "ids_to_delete": len(plan["deletions"]) + sum(len(i["stale_ids"]) for i in plan["work"]),
+        "embedding_calls": sum(1 for b in _batches(plan["work"], batch_size) if any(i["chunks"] for i in b)),
+        "embedding_tokens_est": sum(count_tokens(t, "text-embedding-ada-002") for t in texts),
+    }
+
+
+def _default_embed_fn() -> Callable[[List[str]], List[List[float]]]:
+    from langchain_openai import OpenAIEmbeddings
+    from .LLM import API_KEY
+    return OpenAIEmbeddings(openai_api_key=API_KEY).embed_documents
+
+
+def _open_collection(db_dir: str):
+    import chromadb
+    # "langchain" is the default collection the app opens through langchain's Chroma wrapper
+    return chromadb.PersistentClient(path=db_dir).get_or_create_collection("langchain")
+
+
+#delete every document of the collection (keeping the collection and its settings); returns how many
+def _clear_collection(coll, batch: int = 5000) -> int:
+    removed = 0
+    while True:
+        ids = coll.get(limit=batch, include=[])["ids"]
+        if not ids:
+            return removed
+        coll.delete(ids=ids)
+        removed += len(ids)
+
+
+def run_ingest(pdf_paths: Sequence[str], db_dir: str = settings.VECTOR_DB_DIR,
+               figure_docs: Optional[Sequence[Document]] = None,
+               embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None,
+               batch_size: int = 64, concurrency: int = 4, dry_run: bool = False, prune: bool = False,
+               ref_index_path: Optional[str] = None, scans: Optional[Dict[str, Sequence[PageScan]]] = None,
+               vector_compression: str = settings.VECTOR_COMPRESSION, rebuild: bool = False, log=print) -> Dict:
+    t0 = time.perf_counter()
+    plan = plan_ingest(pdf_paths, db_dir, figure_docs=figure_docs, prune=prune, scans=scans, rebuild=rebuild)
+    summary = summarize_plan(plan, batch_size)
+    log(f"plan: {summary}")
+    if dry_run:
+        return summary
+
+    embed_fn = embed_fn or _default_embed_fn()
+    coll = _open_collection(db_dir)
+    parents = ParentStore(os.path.join(db_dir, PARENT_STORE_FILENAME))
+    if plan["reset"]:
+        # the manifest goes first: a crash after it leaves a store that is reset again on the next run
+        if manifest_exists(db_dir):
+            os.remove(os.path.join(db_dir, MANIFEST_FILENAME))
+        summary["ids_reset"] = _clear_collection(coll)
+        parents.clear()
+        log(f"  reset: {summary['ids_reset']} documents removed from the collection")
+        if figure_docs is None:
+            log("  reset without figure docs: the figures are not in the store until they are ingested again")
+    manifest = load_manifest(db_dir)
+    files = manifest.setdefault("files", {})
+
+    if plan["deletions"]:
+        coll.delete(ids=list(plan["deletions"]))
+        parents.delete_many({i.rsplit("::c", 1)[0] for i in plan["deletions"] if "::fig::" not in i})
+    for source in plan["removed_files"]:
+        files.pop(source, None)
+    # pages that disappeared from a changed file are gone from the manifest too
+    deleted = set(plan["deletions"])
+    for entry in files.values():
+        entry["pages"] = {k: v for k, v in entry.get("pages", {}).items()
+                          if not deleted.intersection(v.get("ids", []))}
+    save_manifest(db_dir, manifest)
+
+    #pages without any text (image-only, no OCR) have no chunks; they are only recorded in the manifest
+    def embed_batch(batch):
+        texts = [c[1] for item in batch for c in item["chunks"]]
+        return batch, embed_fn(texts) if texts else []
+
+    #embedding calls run concurrently (at most `concurrency` in flight); writes stay on this thread
+    batches = deque(_batches(plan["work"], batch_size))
+    done_chunks = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        in_flight = deque()
+        while batches or in_flight:
+            while batches and len(in_flight) < concurrency:
+                in_flight.append(pool.submit(embed_batch, batches.popleft()))
+            batch, embs = in_flight.popleft().result()
+            chunks = [c for item in batch for c in item["chunks"]]
+            if chunks:
+                coll.upsert(ids=[c[0] for c in chunks], documents=[c[1] for c in chunks],
+                            metadatas=[c[2] for c in chunks], embeddings=[list(map(float, e)) for e in embs])
+            stale = [i for item in batch for i in item["stale_ids"]]
+            if stale:
+                coll.delete(ids=stale)
+            parents.put_many([item["parent"] for item in batch if item["parent"]])
+            for item in batch:
+                entry = files.setdefault(item["file"], {"pages": {}})
+                entry.setdefault("pages", {})[item["key"]] = {"hash": item["hash"],
+                                                              "ids": [c[0] for c in item["chunks"]]}
+            save_manifest(db_dir, manifest)
+            done_chunks += len(chunks)
+            log(f"  committed {done_chunks}/{summary['chunks_to_embed']} chunks")
+
+    # a file is only marked complete once all of its pages are in
+    for source, sha in plan["file_hashes"].items():
+        entry = files.setdefault(source, {"pages": {}})
+        entry["sha256"] = sha
+        if source != FIGURES_KEY:
+            entry["chunker"] = plan["chunker"]
+    manifest["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    save_manifest(db_dir, manifest)
+
+    # derived indexes follow the collection
+    export_dir = os.path.join(db_dir, MMAP_INDEX_DIRNAME)
+    if plan["work"] or plan["deletions"] or plan["reset"]:
+        from .lexical_index import BM25_FILENAME, BM25Index
+        BM25Index.from_chroma_collection(coll).save(os.path.join(db_dir, BM25_FILENAME))
+        summary["vector_export"] = export_from_chroma(coll, export_dir, compression=vector_compression)
+        save_ref_index(build_ref_index_from_chroma(coll),
+                       ref_index_path or os.path.join(os.path.dirname(settings.LABEL_MAP_PATH), REF_INDEX_FILENAME))
+    elif any(not os.path.exists(os.path.join(export_dir, name))
+             for name in [VECTORS_FILENAME, ROWS_FILENAME] + compressed_filenames(vector_compression)):
+        # nothing changed, but the export or the requested compressed copy is not there yet
+        summary["vector_export"] = export_from_chroma(coll, export_dir, compression=vector_compression)
+    summary["seconds"] = round(time.perf_counter() - t0, 1)
+    log(f"done: {summary}")
+    return summary
+
+
+def load_figure_docs(path: Optional[str]) -> Optional[List[Document]]:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m helper_functions.ingest", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pdf", nargs="+", default=sorted(glob.glob("./data/*.pdf")), help="PDFs to ingest")
+    ap.add_argument("--db-dir", default=settings.VECTOR_DB_DIR)
+    ap.add_argument("--figures", default="figure_docs.pkl", help="pickled figure docs (skipped if missing)")
+    ap.add_argument("--batch-size", type=int, default=64, help="chunks per embedding call")
+    ap.add_argument("--concurrency", type=int, default=4, help="embedding calls in flight")
+    ap.add_argument("--prune", action="store_true", help="delete files in the manifest that are not in --pdf")
+    ap.add_argument("--dry-run", action="store_true", help="report the diff and estimated embedding calls only")
+    ap.add_argument("--rebuild", action="store_true",
+                    help="ignore the manifest, empty the collection and embed everything again")
+    ap.add_argument("--compression", default=settings.VECTOR_COMPRESSION,
+                    help="compressed copy of the vector export: none, int8 or pca<dims> (e.g. pca256)")
+    args = ap.parse_args(argv)
+
+    summary = run_ingest(args.pdf, db_dir=args.db_dir, figure_docs=load_figure_docs(args.figures),
+                         batch_size=args.batch_size, concurrency=args.concurrency, dry_run=args.dry_run,
+                         prune=args.prune, vector_compression=args.compression, rebuild=args.rebuild)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
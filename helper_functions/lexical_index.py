@@ -0,0 +1,126 @@
+#Sparse lexical (BM25) index over the Code of Practice chunks.
+#Dense OpenAI-embedding MMR is weak on exact tokens ("N + 1", "≥900 mm", "Annex K", "DLP", clause
+#numbers), so the tokenizer keeps those intact as single terms. The index lives next to the Chroma
+#store (chroma_parent_child/bm25_index.json.gz), holds the chunk text and metadata itself and answers
+#without any embedding API call or Chroma round trip.
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain.schema import Document
+
+from .refs import normalize_label, ref_regex
+
+BM25_FILENAME = "bm25_index.json.gz"
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how if in is it its of on or shall should "
+    "that the their there these this to was what when where which who will with within".split()
+)
+_COMPARATORS = {"≥": "ge", ">=": "ge", "≤": "le", "<=": "le", ">": "gt", "<": "lt"}
+_UNITS = r"mm|cm|km|m3/s|m/s|l/s|mg/l|m2|m3|m|ha|kg|kpa|%"
+
+#"N + 1", "N+2"
+_redundancy_re = re.compile(r"\bn\s*\+\s*(\d+)\b")
+#"≥ 900 mm", "<900mm", ">5 m"
+_comparison_re = re.compile(rf"(≥|≤|>=|<=|>|<)\s*(\d+(?:\.\d+)?)\s*({_UNITS})?")
+#"900 mm", "1.5m/s", "40m"
+_quantity_re = re.compile(rf"\b(\d+(?:\.\d+)?)\s*({_UNITS})(?![a-z])")
+#clause/section numbers "2.2.5", "4.2.1(d)"
+_clause_re = re.compile(r"\b\d+(?:\.\d+){1,4}\b")
+_word_re = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    t = text.lower().replace("\n", " ")
+    tokens: List[str] = []
+    # references become one term each: "annex k" -> "annex_k", "drawing no. 5" -> "drawing_no_5"
+    for m in ref_regex.findall(t):
+        tokens.append(normalize_label(m).replace(" ", "_").replace(".", ""))
+    for m in _redundancy_re.finditer(t):
+        tokens.append(f"n+{m.group(1)}")
+    for op, num, unit in _comparison_re.findall(t):
+        tokens.append(f"{_COMPARATORS[op]}{num}{unit or ''}")
+    for num, unit in _quantity_re.findall(t):
+        tokens.append(f"{num}{unit}")
+    tokens.extend(_clause_re.findall(t))
+    tokens.extend(w for w in _word_re.findall(t) if w not in _STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, ids: List[str], texts: List[str], metadatas: List[Dict],
+                 postings: Dict[str, List[Tuple[int, int]]], doc_lens: List[int], k1: float = 1.5, b: float = 0.75):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.postings = postings
+        self.doc_lens = doc_lens
+        self.k1 = k1
+        self.b = b
+        self.avgdl = (sum(doc_lens) / len(doc_lens)) if doc_lens else 0.0
+        n = len(doc_lens)
+        self.idf = {term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for term, p in postings.items()}
+
+    @classmethod
+    def build(cls, texts: Sequence[str], metadatas: Sequence[Dict], ids: Optional[Sequence[str]] = None,
+              **kwargs) -> "BM25Index":
+        ids = list(ids) if ids is not None else [str(i) for i in range(len(texts))]
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lens = []
+        for i, text in enumerate(texts):
+            tf = Counter(tokenize(text))
+            doc_lens.append(sum(tf.values()))
+            for term, count in tf.items():
+                postings.setdefault(term, []).append((i, count))
+        return cls(ids, list(texts), [dict(m or {}) for m in metadatas], postings, doc_lens, **kwargs)
+
+    @classmethod
+    def from_documents(cls, docs: Iterable[Document], ids: Optional[Sequence[str]] = None, **kwargs) -> "BM25Index":
+        docs = list(docs)
+        return cls.build([d.page_content for d in docs], [d.metadata for d in docs], ids, **kwargs)
+
+    #build from an existing Chroma collection (used when the store predates the lexical index)
+    @classmethod
+    def from_chroma_collection(cls, collection, **kwargs) -> "BM25Index":
+        res = collection.get(include=["documents", "metadatas"])
+        return cls.build(res["documents"], res["metadatas"], res["ids"], **kwargs)
+
+    def save(self, path: str):
+        payload = {"k1": self.k1, "b": self.b, "ids": self.ids, "texts": self.texts, "metadatas": self.metadatas,
+                   "doc_lens": self.doc_lens, "postings": self.postings}
+        tmp = f"{path}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            p = json.load(f)
+        postings = {t: [tuple(x) for x in v] for t, v in p["postings"].items()}
+        return cls(p["ids"], p["texts"], p["metadatas"], postings, p["doc_lens"], k1=p["k1"], b=p["b"])
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for i, tf in plist:
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lens[i] / self.avgdl)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+
+    def get_relevant_documents(self, query: str, k: int = 5) -> List[Document]:
+        return [Document(page_content=self.texts[i], metadata=dict(self.metadatas[i], bm25_score=round(score, 4)))
+                for i, score in self.search(query, k)]
+
+    def __len__(self) -> int:
+        return len(self.ids)
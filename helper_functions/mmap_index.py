@@ -0,0 +1,313 @@
+#Read-only, memory-mapped copy of the chroma_parent_child embeddings for the dense MMR search
+#(VECTOR_BACKEND=mmap).
+#The corpus is small and only changes at ingestion, so the vectors are exported once into a float32 .npy matrix
+#(rows normalized to unit length) next to a gzipped JSON sidecar with the ids, documents and metadata of every row.
+#The matrix is opened with np.load(mmap_mode="r"): every Streamlit process maps the same file and the OS keeps one
+#copy of its pages, instead of each process pulling candidates and their embeddings through a Chroma client.
+#A request scores all of its sub-queries with a single matrix multiply, takes the top fetch_k rows per sub-query
+#with argpartition and runs MMR for all of them at once, with the same selection rule as langchain's
+#maximal_marginal_relevance (what Chroma's search_type="mmr" uses). Search is exact, where Chroma's HNSW
+#index is approximate, so results can differ on near-ties.
+#Optionally (VECTOR_COMPRESSION) a compressed copy of the matrix is built next to it and scanned instead:
+#  int8    - one int8 code per value plus a float32 scale per row, 4x smaller
+#  pca<d>  - rows projected on the top d principal components (pca256: 6x smaller at 1536 dimensions), plus each
+#            row's dot product with the mean, so the centered projections still rank like cosine similarity
+#The best `rescore` rows of the compressed scan are re-scored against their float32 rows, and MMR runs on
+#float32 as before. Only those rows' pages of the float32 file are read, so what has to stay in memory is the
+#compressed matrix. benchmarks/bench_compression.py reports recall, size and latency per setting.
+#ingest.py re-exports after every change to the collection; LLM.get_mmap_index exports on first use when the
+#export (or the configured compressed copy) is missing or its row count no longer matches the collection.
+import gzip
+import json
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.schema import Document
+from langchain.schema.retriever import BaseRetriever
+
+MMAP_INDEX_DIRNAME = "mmap_index"
+VECTORS_FILENAME = "vectors.f32.npy"
+ROWS_FILENAME = "rows.json.gz"
+
+#rows read from the collection per get(), and rows compressed / scanned per block
+_EXPORT_BATCH = 2000
+_SCAN_BLOCK = 8192
+
+
+def _unit_rows(vecs: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vecs / norms
+
+
+#"none", "int8" or "pca<d>" -> (kind, d)
+def parse_compression(spec: Optional[str]) -> Tuple[str, int]:
+    spec = (spec or "none").strip().lower()
+    if spec in ("none", "int8"):
+        return spec, 0
+    m = re.fullmatch(r"pca(\d+)", spec)
+    if m and int(m.group(1)) > 0:
+        return "pca", int(m.group(1))
+    raise ValueError(f"unknown vector compression {spec!r} (none, int8 or pca<dims>, e.g. pca256)")
+
+
+def compressed_filenames(spec: Optional[str]) -> List[str]:
+    kind, d = parse_compression(spec)
+    if kind == "int8":
+        return ["vectors.int8.npy", "int8_scales.npy"]
+    if kind == "pca":
+        return [f"vectors.pca{d}.npy", f"pca{d}.npz"]
+    return []
+
+
+#build the compressed copy `spec` of the float32 matrix in the export at `path`
+def compress_export(path: str, spec: Optional[str], block: int = _EXPORT_BATCH) -> Dict:
+    kind, d = parse_compression(spec)
+    if kind == "none":
+        return {"compression": "none"}
+    vecs = np.load(os.path.join(path, VECTORS_FILENAME), mmap_mode="r")
+    n, dim = vecs.shape
+    names = compressed_filenames(spec)
+    tmp = [f"{os.path.join(path, name)}.{os.getpid()}.tmp" for name in names]
+    if kind == "int8":
+        codes = np.lib.format.open_memmap(tmp[0], mode="w+", dtype=np.int8, shape=(n, dim))
+        scales = np.zeros(n, dtype=np.float32)
+        for s in range(0, n, block):
+            x = np.asarray(vecs[s:s + block])
+            sc = np.abs(x).max(axis=1) / 127.0
+            sc[sc == 0] = 1.0
+            codes[s:s + block] = np.round(x / sc[:, None]).astype(np.int8)
+            scales[s:s + block] = sc
+        extra = {"scales": scales}
+    else:
+        d = min(d, dim, max(1, n))
+        mean = np.asarray(vecs.mean(axis=0), dtype=np.float64) if n else np.zeros(dim)
+        cov = np.zeros((dim, dim))
+        for s in range(0, n, block):
+            x = np.asarray(vecs[s:s + block], dtype=np.float64) - mean
+            cov += x.T @ x
+        _, eigvecs = np.linalg.eigh(cov)
+        components = eigvecs[:, ::-1][:, :d].T.astype(np.float32)  # (d, dim), largest variance first
+        codes = np.lib.format.open_memmap(tmp[0], mode="w+", dtype=np.float32, shape=(n, d))
+        for s in range(0, n, block):
+            codes[s:s + block] = (np.asarray(vecs[s:s + block]) - mean.astype(np.float32)) @ components.T
+        extra = {"mean": mean.astype(np.float32), "components": components,
+                 "offsets": (np.asarray(vecs) @ mean.astype(np.float32)).astype(np.float32)}
+    codes.flush()
+    del codes
+    with open(tmp[1], "wb") as f:
+        if kind == "int8":
+            np.save(f, extra["scales"])
+        else:
+            np.savez(f, **extra)
+    for t, name in zip(tmp, names):
+        os.replace(t, os.path.join(path, name))
+    return {"compression": spec, "dims": d if kind == "pca" else dim,
+            "mb": round(sum(os.path.getsize(os.path.join(path, name)) for name in names) / 2**20, 2)}
+
+
+#write the collection's embeddings, documents and metadata to `out_dir` (plus the compressed copy
+#`compression`); returns rows and dimension.
+#files are written under temporary names and moved into place, so readers never see a half-written export
+def export_from_chroma(collection, out_dir: str, batch_size: int = _EXPORT_BATCH,
+                       compression: Optional[str] = None) -> Dict:
+    parse_compression(compression)
+    os.makedirs(out_dir, exist_ok=True)
+    n = collection.count()
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[Dict] = []
+    vec_path = os.path.join(out_dir, VECTORS_FILENAME)
+    tmp_vec = f"{vec_path}.{os.getpid()}.tmp"
+    mat = None
+    for offset in range(0, n, batch_size):
+        res = collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        embs = np.asarray(res["embeddings"], dtype=np.float32)
+        if mat is None:
+            mat = np.lib.format.open_memmap(tmp_vec, mode="w+", dtype=np.float32, shape=(n, embs.shape[1]))
+        mat[offset:offset + len(embs)] = _unit_rows(embs)
+        ids.extend(res["ids"])
+        documents.extend(res["documents"])
+        metadatas.extend(m or {} for m in res["metadatas"])
+    if mat is None:
+        mat = np.lib.format.open_memmap(tmp_vec, mode="w+", dtype=np.float32, shape=(0, 0))
+    dim = mat.shape[1]
+    mat.flush()
+    del mat
+    rows_path = os.path.join(out_dir, ROWS_FILENAME)
+    tmp_rows = f"{rows_path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_rows, "wt", encoding="utf-8") as f:
+        json.dump({"count": len(ids), "dim": dim, "ids": ids, "documents": documents, "metadatas": metadatas},
+                  f, ensure_ascii=False)
+    os.replace(tmp_vec, vec_path)
+    os.replace(tmp_rows, rows_path)
+    out = {"rows": len(ids), "dim": dim}
+    if parse_compression(compression)[0] != "none":
+        out.update(compress_export(out_dir, compression))
+    return out
+
+
+#MMR for several queries at once. rel: (S, F) similarity of each query to its F candidates, pair: (S, F, F)
+#similarities between the candidates. Returns (S, k) candidate indices in selection order
+def mmr_select_many(rel: np.ndarray, pair: np.ndarray, k: int, lambda_mult: float = 0.5) -> np.ndarray:
+    s, f = rel.shape
+    k = min(k, f)
+    chosen = np.zeros((s, k), dtype=np.int64)
+    if k <= 0:
+        return chosen
+    rows = np.arange(s)
+    taken = np.zeros((s, f), dtype=bool)
+    nxt = rel.argmax(axis=1)
+    max_sim = np.full((s, f), -np.inf, dtype=np.float32)
+    for j in range(k):
+        if j:
+            score = lambda_mult * rel - (1 - lambda_mult) * max_sim
+            score[taken] = -np.inf
+            nxt = score.argmax(axis=1)
+        chosen[:, j] = nxt
+        taken[rows, nxt] = True
+        max_sim = np.maximum(max_sim, pair[rows, nxt])
+    return chosen
+
+
+#column indices of the `depth` best scores per row, best first (like the candidates Chroma returns)
+def _best(scores: np.ndarray, depth: int) -> np.ndarray:
+    m = scores.shape[1]
+    if depth < m:
+        top = np.argpartition(-scores, depth - 1, axis=1)[:, :depth]
+    else:
+        top = np.tile(np.arange(m), (len(scores), 1))
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+class MmapVectorIndex:
+    def __init__(self, vectors: np.ndarray, ids: Sequence[str], documents: Sequence[str],
+                 metadatas: Sequence[Dict], compression: Optional[str] = None, codes: Optional[np.ndarray] = None,
+                 aux: Optional[Dict[str, np.ndarray]] = None, rescore: int = 80):
+        if len(vectors) != len(ids):
+            raise ValueError(f"{len(vectors)} vectors but {len(ids)} ids; re-export the index")
+        self.kind, _ = parse_compression(compression)
+        if self.kind != "none" and (codes is None or len(codes) != len(ids)):
+            raise ValueError(f"the {compression} copy does not match the export; rebuild it")
+        self.compression = (compression or "none").lower()
+        self.vectors = vectors
+        self.codes = codes
+        self.aux = aux or {}
+        self.rescore = rescore
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = list(metadatas)
+
+    @classmethod
+    def load(cls, path: str, compression: Optional[str] = None, rescore: int = 80) -> "MmapVectorIndex":
+        vectors = np.load(os.path.join(path, VECTORS_FILENAME), mmap_mode="r")
+        with gzip.open(os.path.join(path, ROWS_FILENAME), "rt", encoding="utf-8") as f:
+            rows = json.load(f)
+        codes, aux = None, {}
+        names = compressed_filenames(compression)
+        if names:
+            codes = np.load(os.path.join(path, names[0]), mmap_mode="r")
+            with open(os.path.join(path, names[1]), "rb") as f:
+                loaded = np.load(f)
+                aux = {"scales": loaded} if isinstance(loaded, np.ndarray) else {k: loaded[k] for k in loaded.files}
+        return cls(vectors, rows["ids"], rows["documents"], rows["metadatas"], compression=compression,
+                   codes=codes, aux=aux, rescore=rescore)
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+
+    def nbytes(self) -> int:
+        return int(self.vectors.nbytes)
+
+    #bytes read by every scan: the compressed copy (with its per-row scales/offsets) or the float32 matrix
+    def scan_nbytes(self) -> int:
+        if self.codes is None:
+            return self.nbytes()
+        per_row = {k: v for k, v in self.aux.items() if v.ndim == 1 and len(v) == self.count()}
+        return int(self.codes.nbytes + sum(v.nbytes for v in per_row.values()))
+
+    #(S, N) similarities of unit queries to every row, approximate on a compressed copy
+    def _scan(self, q: np.ndarray) -> np.ndarray:
+        if self.kind == "none":
+            return q @ self.vectors.T
+        if self.kind == "pca":
+            z = (q - self.aux["mean"]) @ self.aux["components"].T
+            return z @ self.codes.T + self.aux["offsets"]
+        out = np.empty((len(q), self.count()), dtype=np.float32)
+        scales = self.aux["scales"]
+        for s in range(0, self.count(), _SCAN_BLOCK):
+            e = min(self.count(), s + _SCAN_BLOCK)
+            out[:, s:e] = (q @ self.codes[s:e].astype(np.float32).T) * scales[s:e]
+        return out
+
+    #row indices for every query: the top k by cosine similarity, or with mmr=True the MMR re-selection of
+    #the top fetch_k. One scan of the (compressed) matrix for all S queries; on a compressed copy the best
+    #`rescore` rows per query are re-scored in float32 first (rescore=0 keeps the approximate ranking)
+    def search(self, queries, k: int = 5, fetch_k: int = 20, lambda_mult: float = 0.5,
+               mmr: bool = True, rescore: Optional[int] = None) -> List[List[int]]:
+        q = _unit_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        n = self.count()
+        if n == 0 or k <= 0:
+            return [[] for _ in q]
+        scores = self._scan(q)
+        depth = min(n, max(k, fetch_k) if mmr else k)
+        rescore = self.rescore if rescore is None else rescore
+        if self.kind != "none" and rescore > 0:
+            pool = _best(scores, min(n, max(depth, rescore)))
+            exact = np.einsum("sd,scd->sc", q, self.vectors[pool.ravel()].reshape(len(q), pool.shape[1], -1))
+            pos = _best(exact, depth)
+            top, rel = np.take_along_axis(pool, pos, axis=1), np.take_along_axis(exact, pos, axis=1)
+        else:
+            top = _best(scores, depth)
+            rel = np.take_along_axis(scores, top, axis=1)
+        if not mmr:
+            return top.tolist()
+        cand = self.vectors[top.ravel()].reshape(len(q), depth, -1)
+        if self.kind != "none" and rescore <= 0:
+            rel = np.einsum("sd,scd->sc", q, cand)
+        pair = cand @ cand.transpose(0, 2, 1)
+        picked = mmr_select_many(rel, pair, k, lambda_mult)
+        return np.take_along_axis(top, picked, axis=1).tolist()
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.documents[row], metadata=dict(self.metadatas[row]), id=self.ids[row])
+
+
+#drop-in for vectordb.as_retriever(search_type="mmr", ...); search_many serves all sub-queries of a request
+#(ParallelMultiQueryRetriever) with one batched embedding call and one search
+class MmapMMRRetriever(BaseRetriever):
+    def __init__(self, index: MmapVectorIndex, embedding, k: int = 5, fetch_k: int = 20, lambda_mult: float = 0.5):
+        super().__init__()
+        self._index = index
+        self._embedding = embedding
+        self._k = k
+        self._fetch_k = fetch_k
+        self._lambda_mult = lambda_mult
+
+    def _embed(self, queries: Sequence[str]):
+        if hasattr(self._embedding, "embed_queries"):
+            return self._embedding.embed_queries(queries)
+        return [self._embedding.embed_query(q) for q in queries]
+
+    def search_many(self, queries: Sequence[str]) -> List[List[Document]]:
+        if not queries:
+            return []
+        rows = self._index.search(self._embed(queries), k=self._k, fetch_k=self._fetch_k,
+                                  lambda_mult=self._lambda_mult)
+        return [[self._index.document(r) for r in hits] for hits in rows]
+
+    def get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: Optional[CallbackManagerForRetrieverRun] = None
+    ) -> List[Document]:
+        return self.search_many([query])[0]
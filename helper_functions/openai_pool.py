@@ -0,0 +1,257 @@
+#Shared OpenAI clients and the background event loop behind LLM.ask_async.
+#One sync client and one AsyncOpenAI client (each with its own pooled httpx connections) are shared by every
+#Streamlit session of the server process, instead of building a client and a new TLS connection per
+#question. Async calls run on a single event loop in a daemon thread (AsyncRunner); the script thread of a
+#session only waits for its own result, so a slow GPT-4 answer does not hold up anybody else's request.
+#AsyncOpenAIPool bounds how many calls are in flight at once (OPENAI_MAX_CONCURRENCY), gives every call a
+#deadline (OPENAI_TIMEOUT_S) and retries rate limits / transient errors with exponential backoff and
+#jitter, honouring the server's retry-after header. Keep OPENAI_MAX_CONCURRENCY at or below what the
+#account's rate limit allows; requests above it only wait for a slot instead of collecting 429s.
+#The openai SDK is imported lazily so importing this module stays cheap. OPENAI_BASE_URL (read by the SDK)
+#points everything at a local stand-in such as benchmarks/mock_openai_server.py.
+import asyncio
+import contextvars
+import itertools
+import queue
+import random
+import threading
+from concurrent.futures import Future
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from . import settings, tracing
+
+OPENAI_TIMEOUT_S = settings.env_float("OPENAI_TIMEOUT_S", 60.0)
+OPENAI_MAX_CONCURRENCY = settings.env_int("OPENAI_MAX_CONCURRENCY", 16)
+OPENAI_MAX_RETRIES = settings.env_int("OPENAI_MAX_RETRIES", 6)
+OPENAI_BACKOFF_BASE_S = settings.env_float("OPENAI_BACKOFF_BASE_S", 0.5)
+OPENAI_BACKOFF_MAX_S = settings.env_float("OPENAI_BACKOFF_MAX_S", 20.0)
+#keep-alive connections kept open per client
+OPENAI_POOL_SIZE = settings.env_int("OPENAI_POOL_SIZE", 32)
+
+_sync_client = None
+_sync_lock = threading.Lock()
+
+
+#shared sync client for the blocking paths (ask, ask_stream); the SDK's own retries handle 429s there
+def get_sync_client(api_key: Optional[str] = None):
+    global _sync_client
+    with _sync_lock:
+        if _sync_client is None:
+            import httpx
+            from openai import OpenAI
+            _sync_client = OpenAI(
+                api_key=api_key,
+                timeout=OPENAI_TIMEOUT_S,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=httpx.Client(limits=httpx.Limits(max_connections=OPENAI_POOL_SIZE,
+                                                             max_keepalive_connections=OPENAI_POOL_SIZE)),
+            )
+    return _sync_client
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    import openai
+    if isinstance(exc, (asyncio.TimeoutError, openai.APIConnectionError)):  # includes APITimeoutError
+        return True
+    return isinstance(exc, openai.APIStatusError) and (exc.status_code in (408, 409, 429) or exc.status_code >= 500)
+
+
+#seconds to wait before retry number `attempt` (0-based): exponential backoff with full jitter, never less
+#than the server's retry-after. The jitter keeps requests that were rate limited together from all
+#coming back at the same moment.
+def retry_delay(exc: BaseException, attempt: int, base: float = OPENAI_BACKOFF_BASE_S,
+                cap: float = OPENAI_BACKOFF_MAX_S) -> float:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    floor = 0.0
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            if headers.get(name) is not None:
+                floor = max(0.0, float(headers[name]) * scale)
+                break
+        except (TypeError, ValueError):
+            pass
+    return min(cap, floor + random.uniform(0, base * (2 ** attempt)))
+
+
+class AsyncOpenAIPool:
+    """AsyncOpenAI client with bounded concurrency, per-call deadlines and retry/backoff.
+
+    Must be used from a single event loop (the AsyncRunner's); the client and the semaphore are created
+    on first use inside that loop.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+                 timeout_s: float = OPENAI_TIMEOUT_S, max_retries: int = OPENAI_MAX_RETRIES):
+        self.api_key = api_key
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout_s = timeout_s
+        self.max_retries = max(0, int(max_retries))
+        self._client = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.stats: Dict[str, int] = {"calls": 0, "retries": 0, "timeouts": 0, "in_flight": 0, "max_in_flight": 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            from openai import AsyncOpenAI
+            # retries are done here (outside the semaphore), not by the SDK
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                timeout=self.timeout_s,
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=self.max_concurrency,
+                                                                  max_keepalive_connections=self.max_concurrency)),
+            )
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        return self._sem
+
+    async def _acquire(self, deadline: float):
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        self.stats["calls"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+    def _release(self):
+        self.stats["in_flight"] -= 1
+        self.semaphore.release()
+
+    #sleep before the next attempt, or re-raise `exc` when it is not worth retrying
+    async def _backoff(self, exc: Exception, attempt: int, deadline: float):
+        loop = asyncio.get_running_loop()
+        if attempt >= self.max_retries or not _is_retryable(exc) or loop.time() >= deadline:
+            if isinstance(exc, asyncio.TimeoutError):
+                self.stats["timeouts"] += 1
+            raise exc
+        self.stats["retries"] += 1
+        tracing.count("openai", retries=1)
+        # the slot is already released, so other requests keep going while this one waits
+        await asyncio.sleep(min(retry_delay(exc, attempt), max(0.0, deadline - loop.time())))
+
+    #one chat completion; returns the response object
+    async def chat(self, messages: List[Dict], model: str, timeout_s: Optional[float] = None, **kwargs):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout_s or self.timeout_s)
+        for attempt in itertools.count():
+            await self._acquire(deadline)
+            try:
+                return await asyncio.wait_for(
+                    self.client.chat.completions.create(model=model, messages=messages, **kwargs),
+                    max(0.0, deadline - loop.time()))
+            except Exception as exc:
+                failure = exc
+            finally:
+                self._release()
+            await self._backoff(failure, attempt, deadline)
+
+    #streamed chat completion: yields content deltas. Rate limits and errors are retried until the response
+    #starts; a stream that breaks half way is not replayed. The stream holds its concurrency slot until it
+    #is done and is abandoned once the deadline passes (a stalled connection hits the client's read timeout).
+    async def chat_stream(self, messages: List[Dict], model: str, timeout_s: Optional[float] = None,
+                          **kwargs) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        timeout_s = timeout_s or self.timeout_s
+        deadline = loop.time() + timeout_s
+        for attempt in itertools.count():
+            await self._acquire(deadline)
+            try:
+                remaining = max(0.001, deadline - loop.time())
+                stream = await asyncio.wait_for(
+                    self.client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                        timeout=remaining, **kwargs), remaining)
+                break
+            except Exception as exc:
+                self._release()
+                failure = exc
+            except BaseException:
+                # cancelled (a Streamlit rerun or a closed stream) before the response started
+                self._release()
+                raise
+            await self._backoff(failure, attempt, deadline)
+        try:
+            async for event in stream:
+                if event.choices and event.choices[0].delta.content:
+                    yield event.choices[0].delta.content
+                if loop.time() > deadline:
+                    self.stats["timeouts"] += 1
+                    raise asyncio.TimeoutError(f"OpenAI stream did not finish within {timeout_s:.0f}s")
+        finally:
+            self._release()
+            await stream.close()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class AsyncRunner:
+    """A single asyncio event loop on a daemon thread, shared by every session of the server process.
+
+    Coroutines are submitted from (synchronous) Streamlit script threads; they run in a copy of the
+    caller's context, so tracing spans recorded inside still land in the caller's trace.
+    """
+
+    def __init__(self, name: str = "async-runner"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coro) -> Future:
+        ctx = contextvars.copy_context()
+
+        async def in_caller_context():
+            # tasks copy the context that is current when they are created
+            return await ctx.run(asyncio.ensure_future, coro)
+        return asyncio.run_coroutine_threadsafe(in_caller_context(), self.loop)
+
+    #block until `coro` is done and return its result
+    def run(self, coro, timeout: Optional[float] = None):
+        fut = self.submit(coro)
+        try:
+            return fut.result(timeout)
+        except BaseException:
+            fut.cancel()
+            raise
+
+    #drive an async generator from a sync caller, e.g. st.write_stream(runner.iterate(agen))
+    def iterate(self, agen: AsyncIterator) -> Iterator:
+        items: "queue.Queue" = queue.Queue()
+        end = object()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put((item, None))
+            except BaseException as exc:
+                items.put((end, exc))
+                raise
+            items.put((end, None))
+
+        fut = self.submit(pump())
+        try:
+            while True:
+                item, exc = items.get()
+                if item is end:
+                    if exc is not None:
+                        raise exc
+                    return
+                yield item
+        finally:
+            # the reader went away (closed stream, rerun): stop the producer too
+            if not fut.done():
+                fut.cancel()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
@@ -0,0 +1,145 @@
+"""Single-pass page scanner shared by the ingestion steps.
+
+Each PDF page is read once (PyMuPDF) and yields a PageScan with
+  - the text layer, and OCR text only for image-only pages (scanned drawings)
+  - the reference hits (annex k, drawing no. 5, figure 2.1, ...) found in that text
+  - the xrefs of the page's images
+Label-map construction (figures.detect_last_occurrences) and chunk annotation (ingest.chunk_page)
+both consume these scans instead of re-reading pages and re-running ref_regex.
+
+OCR has a DPI-adaptive fast path: pages are OCR'd at OCR_FAST_DPI first and only re-done at
+OCR_FULL_DPI when the fast pass finds neither a reference nor enough text; the DPI is also capped so
+large drawing sheets stay under OCR_MAX_PIXELS. OCR results are cached on disk keyed by a hash of the
+page's content stream and image bytes (.cache/figures.sqlite3, kind "ocr"), so re-running ingestion
+never OCRs an unchanged page twice.
+"""
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from . import settings
+from .refs import normalize_label, ref_regex
+
+OCR_FAST_DPI = settings.env_int("OCR_FAST_DPI", 150)
+OCR_FULL_DPI = settings.env_int("OCR_FULL_DPI", 300)
+OCR_MAX_PIXELS = settings.env_int("OCR_MAX_PIXELS", 40_000_000)
+#fast-pass OCR output shorter than this (and without a reference) is redone at full DPI
+OCR_MIN_CHARS = settings.env_int("OCR_MIN_CHARS", 200)
+OCR_CACHE_KIND = "ocr"
+
+
+class PageScan(NamedTuple):
+    page_index: int              # 0-based, like the `page` metadata in the store
+    text: str                    # text layer
+    ocr_text: str                # only for pages without a text layer that carry images
+    refs: List[Tuple[str, str]]  # (match as written, normalized label), in page order, deduplicated
+    image_xrefs: List[int]
+    page_hash: str
+
+    @property
+    def page_num(self) -> int:
+        return self.page_index + 1
+
+    @property
+    def merged_text(self) -> str:
+        return self.text if not self.ocr_text else f"{self.text}\n{self.ocr_text}"
+
+
+def find_refs(text: str) -> List[Tuple[str, str]]:
+    return list(dict.fromkeys((m.strip(), normalize_label(m)) for m in ref_regex.findall(text)))
+
+
+def _page_hash(doc, page, xrefs: List[int]) -> str:
+    h = hashlib.sha256(page.read_contents() or b"")
+    for xref in xrefs:
+        h.update(doc.xref_stream_raw(xref) or b"")
+    return h.hexdigest()
+
+
+def _ocr_at(page, dpi: int) -> str:
+    import pytesseract
+    from PIL import Image
+    pix = page.get_pixmap(dpi=dpi)
+    return pytesseract.image_to_string(Image.open(io.BytesIO(pix.tobytes("png"))))
+
+
+def ocr_page_adaptive(page) -> str:
+    # cap the DPI so an A0 drawing sheet is not rendered at hundreds of megapixels
+    area_in2 = max(1e-6, (page.rect.width / 72) * (page.rect.height / 72))
+    cap = max(72, int((OCR_MAX_PIXELS / area_in2) ** 0.5))
+    fast_dpi, full_dpi = min(OCR_FAST_DPI, cap), min(OCR_FULL_DPI, cap)
+    text = _ocr_at(page, fast_dpi)
+    if full_dpi > fast_dpi and not ref_regex.search(text) and len(text.strip()) < OCR_MIN_CHARS:
+        text = _ocr_at(page, full_dpi)
+    return text
+
+
+#--- worker state: one open document (and cache connection) per process
+_doc = None
+_ocr_cache = None
+
+
+def _open_scan_worker(pdf_path: str, ocr_cache_path: Optional[str]):
+    global _doc, _ocr_cache
+    import fitz  # PyMuPDF
+    _doc = fitz.open(pdf_path)
+    if ocr_cache_path:
+        from .figures import FigureCache
+        _ocr_cache = FigureCache(ocr_cache_path)
+    else:
+        _ocr_cache = None
+
+
+def _scan_one(page_index: int) -> PageScan:
+    page = _doc[page_index]
+    text = page.get_text("text") or ""
+    xrefs = [img[0] for img in page.get_images(full=True)]
+    ocr_text = ""
+    if not text.strip() and xrefs:
+        page_hash = _page_hash(_doc, page, xrefs)
+        cached = _ocr_cache.get_many(OCR_CACHE_KIND, [page_hash]) if _ocr_cache else {}
+        if page_hash in cached:
+            ocr_text = cached[page_hash]
+        else:
+            ocr_text = ocr_page_adaptive(page)
+            if _ocr_cache:
+                _ocr_cache.put(OCR_CACHE_KIND, page_hash, ocr_text)
+    else:
+        page_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    merged = text if not ocr_text else f"{text}\n{ocr_text}"
+    return PageScan(page_index, text, ocr_text, find_refs(merged), xrefs, page_hash)
+
+
+def _scan_range(start: int, end: int) -> List[PageScan]:
+    return [_scan_one(i) for i in range(start, end)]
+
+
+def default_ocr_cache_path() -> str:
+    return settings.cache_path("figures.sqlite3")
+
+
+#Yield one PageScan per page, in page order. OCR-bound documents fan out over `workers` processes
+#(ranges of `pages_per_task` pages, each worker holding one open document); workers=1 scans inline.
+def scan_pdf(pdf_path: str, workers: Optional[int] = None, pages_per_task: int = 8,
+             ocr_cache_path: Optional[str] = "default") -> Iterator[PageScan]:
+    import fitz
+    if ocr_cache_path == "default":
+        ocr_cache_path = default_ocr_cache_path()
+    with fitz.open(pdf_path) as doc:
+        n_pages = doc.page_count
+    workers = workers or settings.env_int("INGEST_WORKERS", max(1, (os.cpu_count() or 2) - 1))
+    if workers <= 1 or n_pages <= pages_per_task:
+        _open_scan_worker(pdf_path, ocr_cache_path)
+        try:
+            yield from _scan_range(0, n_pages)
+        finally:
+            _doc.close()
+        return
+    starts = list(range(0, n_pages, pages_per_task))
+    ends = [min(s + pages_per_task, n_pages) for s in starts]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_scan_worker,
+                             initargs=(pdf_path, ocr_cache_path)) as pool:
+        for scans in pool.map(_scan_range, starts, ends):
+            yield from scans
@@ -0,0 +1,131 @@
+#Parent docstore for parent-child retrieval.
+#Child chunks in Chroma only carry a `parent_id` ("<source>::p<page>"); the full parent page text lives
+#here, zlib-compressed in a small sqlite file next to the Chroma store. At query time the top child
+#hits are expanded to their (deduplicated) parent pages within a token budget.
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain.schema import Document
+
+from .tokens import count_tokens
+
+PARENT_STORE_FILENAME = "parents.sqlite3"
+
+
+def parent_id(source: str, page) -> str:
+    return f"{source}::p{int(page) if page is not None else 0}"
+
+
+class ParentStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS parents (
+                   id TEXT PRIMARY KEY,
+                   source TEXT,
+                   page INTEGER,
+                   text BLOB NOT NULL
+               )"""
+        )
+        self._conn.commit()
+
+    @classmethod
+    def open_existing(cls, path: str) -> Optional["ParentStore"]:
+        return cls(path) if os.path.exists(path) else None
+
+    def put_many(self, parents: Iterable[Tuple[str, str, int, str]]):
+        rows = [(pid, source, page, zlib.compress(text.encode("utf-8"))) for pid, source, page, text in parents]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO parents VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def delete_many(self, ids: Iterable[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM parents WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM parents")
+            self._conn.commit()
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        ids = list(dict.fromkeys(ids))
+        out: Dict[str, Dict] = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT id, source, page, text FROM parents WHERE id IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for pid, source, page, blob in rows:
+                    out[pid] = {"source": source, "page": page, "text": zlib.decompress(blob).decode("utf-8")}
+        return out
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM parents").fetchone()[0]
+
+
+def _parent_id_of(d: Document) -> Optional[str]:
+    md = d.metadata or {}
+    if md.get("is_diagram"):
+        return None
+    if md.get("parent_id"):
+        return md["parent_id"]
+    if md.get("source") and md.get("page") is not None:
+        return parent_id(md["source"], md["page"])
+    return None
+
+
+#clause(s) of the children a parent page stands for, so its citation still reads "p.10 §1.2.4"
+def _add_section(parent: Document, child: Document):
+    section = (child.metadata or {}).get("section")
+    if not section:
+        return
+    have = parent.metadata.get("section")
+    if not have:
+        parent.metadata["section"] = section
+        if child.metadata.get("heading"):
+            parent.metadata["heading"] = child.metadata["heading"]
+    elif section not in have.split(", "):
+        parent.metadata["section"] = f"{have}, {section}"
+
+
+#replace child hits by their parent pages, in rank order, deduplicated, until `token_budget` is used.
+#docs without a parent (figure captions) are kept as they are; a parent that would overflow the budget
+#falls back to the child chunk itself. A parent carries the section of every child hit it replaced, and the
+#text of the first one (child_text) so that context_budget can cut the page around it
+def expand_to_parents(docs: List[Document], store: ParentStore, token_budget: int = 6000,
+                      model: str = "gpt-4") -> List[Document]:
+    parents = store.get_many(pid for pid in map(_parent_id_of, docs) if pid)
+    out: List[Document] = []
+    used_parents: Dict[str, Document] = {}
+    used_tokens = 0
+    for d in docs:
+        pid = _parent_id_of(d)
+        if pid in used_parents:
+            _add_section(used_parents[pid], d)
+            continue
+        candidate = d
+        if pid in parents:
+            p = parents[pid]
+            candidate = Document(page_content=p["text"], metadata={
+                "source": p["source"], "page": p["page"], "parent_id": pid, "is_parent": True,
+                "child_text": d.page_content})
+            _add_section(candidate, d)
+        tokens = count_tokens(candidate.page_content, model)
+        if used_tokens + tokens > token_budget and candidate is not d:
+            candidate, tokens = d, count_tokens(d.page_content, model)
+        if used_tokens + tokens > token_budget:
+            continue
+        if candidate is not d:
+            used_parents[pid] = candidate
+        out.append(candidate)
+        used_tokens += tokens
+    return out
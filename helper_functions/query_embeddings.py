@@ -0,0 +1,125 @@
+#Query side of the embedding model behind the vector store (LLM.get_embedding).
+#Chroma calls embed_query once per sub-query, i.e. one embedding round trip per MMR search, and a question
+#that was asked yesterday is embedded again today. QueryEmbeddings sits in front of the model and
+#  - keys vectors by (model, normalized text) and embeds the normalized text itself, so a hit returns exactly
+#    what a miss would have. Normalizing only collapses whitespace: case is kept, since abbreviations such as
+#    TOP or DLP mean something else in lower case
+#  - answers from a small in-memory LRU first, then from a persistent EmbeddingCache (SQLite, least recently
+#    used entries evicted, shared by all sessions and restarts), and sends only the rest to the model
+#  - embeds many queries in one embed_documents call (embed_queries / prefetch): ParallelMultiQueryRetriever
+#    prefetches all sub-queries of a request at once, batch_ask.py a whole wave of questions
+#Documents are never cached here (ingestion and uploads have their own caches).
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.embeddings import Embeddings
+
+from . import tracing
+from .embedding_cache import EmbeddingCache, text_hash
+
+#OpenAI accepts up to 2048 inputs per embeddings request
+_MAX_BATCH = 512
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+class QueryEmbeddings(Embeddings):
+    def __init__(self, inner: Embeddings, model: Optional[str] = None, cache: Optional[EmbeddingCache] = None,
+                 max_entries: int = 4096, batch_size: int = _MAX_BATCH):
+        self.inner = inner
+        self.model = model or getattr(inner, "model", None) or type(inner).__name__
+        self.cache = cache
+        self.max_entries = max_entries
+        self.batch_size = max(1, min(batch_size, 2048))
+        self._vecs: "OrderedDict[str, List[float]]" = OrderedDict()
+        #prefetched and not asked for yet: the later embed_query is the same lookup, so it is not counted again
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.model_calls = 0
+
+    def _put(self, key: str, vec: List[float]):
+        self._vecs[key] = vec
+        self._vecs.move_to_end(key)
+        while len(self._vecs) > self.max_entries:
+            self._vecs.popitem(last=False)
+
+    #vectors for many queries: memory, then disk, then one model call per batch_size texts still missing.
+    #also returns how many of them went through the model
+    def _lookup(self, texts: Sequence[str], prefetch: bool = False):
+        keys = [normalize_text(t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        claimed = 0
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                vec = self._vecs.get(key)
+                if vec is not None:
+                    self._vecs.move_to_end(key)
+                    found[key] = vec
+                    if not prefetch and key in self._pending:
+                        self._pending.discard(key)
+                        claimed += 1
+        memory_hits = len(found) - claimed
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        disk_hits = 0
+        if missing and self.cache is not None:
+            stored = self.cache.get_many(self.model, [text_hash(k) for k in missing])
+            for key in missing:
+                vec = stored.get(text_hash(key))
+                if vec is not None:
+                    found[key] = vec.tolist()
+            disk_hits = len(found) - memory_hits - claimed
+            missing = [k for k in missing if k not in found]
+        calls = 0
+        if missing:
+            with tracing.span("query_embed", texts=len(missing)):
+                for i in range(0, len(missing), self.batch_size):
+                    part = missing[i:i + self.batch_size]
+                    found.update(zip(part, (list(v) for v in self.inner.embed_documents(part))))
+                    calls += 1
+            if self.cache is not None:
+                self.cache.put_many(self.model, {text_hash(k): found[k] for k in missing})
+        with self._lock:
+            for key in found:
+                self._put(key, found[key])
+            if prefetch:
+                self._pending.update(found)
+                self._pending.intersection_update(self._vecs)
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+            self.misses += len(missing)
+            self.model_calls += calls
+        tracing.count("query_embedding", memory_hits=memory_hits, disk_hits=disk_hits, misses=len(missing))
+        return [found[k] for k in keys], len(missing)
+
+    def embed_queries(self, texts: Sequence[str]) -> List[List[float]]:
+        return self._lookup(texts)[0]
+
+    #make sure the vectors of `texts` are at hand before they are asked for one by one; returns how many
+    #had to go through the model
+    def prefetch(self, texts: Sequence[str]) -> int:
+        return self._lookup(texts, prefetch=True)[1]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "lookups": lookups,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": ((self.memory_hits + self.disk_hits) / lookups) if lookups else 0.0,
+                "model_calls": self.model_calls,
+                "held": len(self._vecs),
+            }
@@ -0,0 +1,203 @@
+#Query expansion stage in front of MMR retrieval.
+#Replaces MultiQueryRetriever's GPT-4 round trip with pluggable, cheaper strategies:
+#   RuleBasedExpander - local, no API call: domain synonyms + label_map vocabulary
+#   LLMExpander       - a small/fast chat model writes the alternative phrasings
+#   CachedExpander    - wraps either one with an LRU keyed by the normalized query
+#Sub-query retrievals then run concurrently and are fused with reciprocal-rank fusion.
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
+from langchain.schema import Document
+from langchain.schema.retriever import BaseRetriever
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+
+from . import tracing
+from .answer_cache import normalize_query
+from .refs import extract_annex_refs
+
+latency_logger = logging.getLogger("pub_rag.latency")
+
+#abbreviations and phrasing used across the PUB Codes of Practice.
+#upper-case keys are abbreviations and only match in upper case ("TOP" but not "top of the drain"),
+#lower-case keys match case-insensitively
+DOMAIN_SYNONYMS: Dict[str, List[str]] = {
+    "DTSS": ["deep tunnel sewerage system"],
+    "DLP": ["defects liability period"],
+    "TOP": ["temporary occupation permit"],
+    "CSC": ["certificate of statutory completion"],
+    "ECM": ["earth control measures"],
+    "ECMs": ["earth control measures"],
+    "TSS": ["total suspended solids"],
+    "QP": ["qualified person"],
+    "RC": ["reinforced concrete"],
+    "IC": ["inspection chamber"],
+    "freeboard": ["vertical clearance between water level and top of drain"],
+    "grease trap": ["grease interceptor"],
+    "setback": ["minimum clearance distance from sewer", "buffer distance"],
+    "drainage reserve": ["drain reserve"],
+    "sewer corridor": ["public sewer corridor"],
+    "pumping main": ["rising main"],
+    "standby pump": ["standby pumping capacity"],
+}
+
+
+class RuleBasedExpander:
+    def __init__(self, label_map: Optional[Dict[str, str]] = None, synonyms: Optional[Dict[str, List[str]]] = None,
+                 max_queries: int = 4):
+        self.label_map = label_map or {}
+        self.synonyms = synonyms if synonyms is not None else DOMAIN_SYNONYMS
+        self.max_queries = max_queries
+        # longest terms first so "grease trap" wins over shorter overlaps
+        terms = sorted(self.synonyms, key=len, reverse=True)
+        alternatives = [re.escape(t) if t != t.lower() else f"(?i:{re.escape(t)})" for t in terms]
+        self._term_re = re.compile(r"\b(" + "|".join(alternatives) + r")\b") if terms else None
+
+    def _term(self, matched: str) -> str:
+        return matched if matched in self.synonyms else matched.lower()
+
+    def expand(self, query: str) -> List[str]:
+        queries = [query]
+        if self._term_re is not None:
+            found = list(dict.fromkeys(m.group(1) for m in self._term_re.finditer(query)))
+            # one variant with every term spelled out, then one per extra alternative
+            if found:
+                queries.append(self._term_re.sub(lambda m: self.synonyms[self._term(m.group(1))][0], query))
+                for matched in found:
+                    for alt in self.synonyms[self._term(matched)][1:]:
+                        queries.append(query.replace(matched, alt))
+        # references (annex k, drawing no. 5, ...) resolved to the document's own wording
+        refs = extract_annex_refs(query)
+        if refs:
+            labels = " ".join(self.label_map.get(r, r).replace("\n", " ") for r in refs)
+            queries.append(f"{labels} {query}")
+        return list(dict.fromkeys(queries))[: self.max_queries]
+
+
+LLM_EXPANSION_PROMPT = (
+    "You are helping search the PUB Codes of Practice (Singapore). Write {n} different rephrasings of the "
+    "question below that use the wording a code of practice would use (spell out abbreviations, use "
+    "synonyms for technical terms). Return one rephrasing per line, with no numbering and no other text.\n\n"
+    "Question: {question}"
+)
+
+
+class LLMExpander:
+    def __init__(self, llm, n: int = 3):
+        self.llm = llm
+        self.n = n
+
+    def expand(self, query: str) -> List[str]:
+        text = self.llm.invoke(LLM_EXPANSION_PROMPT.format(n=self.n, question=query)).content
+        variants = [re.sub(r"^\s*(?:\d+[.)]|[-*•])\s*", "", line).strip() for line in text.splitlines()]
+        return list(dict.fromkeys([query] + [v for v in variants if v]))[: self.n + 1]
+
+
+class CachedExpander:
+    def __init__(self, inner, max_entries: int = 2048):
+        self.inner = inner
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def expand(self, query: str) -> List[str]:
+        key = normalize_query(query)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                tracing.count("expansion", cache_hit=1)
+                # the original wording always goes first, the cached variants after it
+                return list(dict.fromkeys([query] + self._cache[key]))
+        variants = self.inner.expand(query)
+        tracing.count("expansion", cache_miss=1)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = variants[1:] if variants and variants[0] == query else variants
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return variants
+
+
+def _doc_key(d: Document) -> Hashable:
+    md = d.metadata or {}
+    return (md.get("source"), md.get("page"), d.page_content)
+
+
+#reciprocal-rank fusion: score(d) = sum over lists of 1 / (k + rank)
+def rrf_fuse(result_lists: Sequence[Sequence[Document]], k: int = 60,
+             key: Callable[[Document], Hashable] = _doc_key) -> List[Document]:
+    scores: Dict[Hashable, float] = {}
+    docs: Dict[Hashable, Document] = {}
+    for results in result_lists:
+        for rank, d in enumerate(results):
+            dk = key(d)
+            scores[dk] = scores.get(dk, 0.0) + 1.0 / (k + rank + 1)
+            docs.setdefault(dk, d)
+    return [docs[dk] for dk in sorted(scores, key=scores.get, reverse=True)]
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+#shared by all sessions; retrieval is I/O bound (embedding API + Chroma) so threads are enough
+def get_retrieval_pool(max_workers: int = 8) -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+    return _pool
+
+
+#`prefetch` (QueryEmbeddings.prefetch) embeds all sub-queries in one call before the searches start,
+#instead of one embedding round trip per sub-query
+class ParallelMultiQueryRetriever(BaseRetriever):
+    def __init__(self, base_retriever, expander, max_docs: Optional[int] = None,
+                 prefetch: Optional[Callable[[List[str]], object]] = None):
+        super().__init__()
+        self._base_retriever = base_retriever
+        self._expander = expander
+        self._max_docs = max_docs
+        self._prefetch = prefetch
+
+    def get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: Optional[CallbackManagerForRetrieverRun] = None
+    ) -> List[Document]:
+        t0 = time.perf_counter()
+        with tracing.span("expansion") as sp:
+            sub_queries = self._expander.expand(query) or [query]
+            sp.set(sub_queries=len(sub_queries))
+        t1 = time.perf_counter()
+        if hasattr(self._base_retriever, "search_many"):
+            # mmap_index.MmapMMRRetriever: every sub-query in one embedding call and one search
+            with tracing.span("mmr", sub_queries=len(sub_queries)) as sp:
+                result_lists = self._base_retriever.search_many(sub_queries)
+                sp.set(docs=sum(len(r) for r in result_lists))
+        else:
+            if self._prefetch is not None and len(sub_queries) > 1:
+                self._prefetch(sub_queries)
+            pool = get_retrieval_pool()
+            result_lists = list(pool.map(tracing.propagate(self._search), sub_queries))
+        t2 = time.perf_counter()
+        fused = rrf_fuse(result_lists)
+        latency_logger.info(
+            "query_expansion expander=%s sub_queries=%d expansion_ms=%.1f retrieval_ms=%.1f docs=%d",
+            type(self._expander).__name__, len(sub_queries), (t1 - t0) * 1000, (t2 - t1) * 1000, len(fused),
+        )
+        return fused[: self._max_docs] if self._max_docs else fused
+
+    def _search(self, sub_query: str) -> List[Document]:
+        with tracing.span("mmr") as sp:
+            docs = self._base_retriever.invoke(sub_query)
+            sp.set(docs=len(docs))
+        return docs
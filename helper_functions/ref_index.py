@@ -0,0 +1,96 @@
+#Inverted index from normalized reference label (annex k, drawing no 5, figure 2, ...) to the ids of
+#the chunks that mention it and the figure docs that depict it.
+#Built at ingestion time and saved next to label_map.json, so the annex boost in AnnexAwareRetriever
+#is a dict lookup + a get-by-id instead of a metadata where-scan over the whole collection.
+#(The ingestion notebook stores chunk refs as the scalar `annex_refs_csv`; the list-valued `annex_refs`
+#the old where-filter looked for never made it into Chroma.)
+import json
+import os
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from .refs import normalize_label
+
+REF_INDEX_FILENAME = "ref_index.json"
+
+
+#"Drawing No.1", "drawing no. 1" and "drawing  no 1" all become "drawing no 1"
+def ref_key(label: str) -> str:
+    return re.sub(r"[.\s]+", " ", normalize_label(label)).strip()
+
+
+def _refs_from_metadata(md: Dict) -> List[str]:
+    refs = md.get("annex_refs")
+    if isinstance(refs, (list, tuple, set)):
+        return [str(r) for r in refs]
+    csv = md.get("annex_refs_csv") or (refs if isinstance(refs, str) else "")
+    return [r for r in (x.strip() for x in csv.split(";")) if r]
+
+
+#stable, readable ids for the persistent store: "<source>::p<page>::c<n>" for text chunks,
+#"<source>::fig::p<page>::<n>" for figure docs
+def stable_doc_ids(metadatas: Iterable[Dict]) -> List[str]:
+    ids, counters = [], defaultdict(int)
+    for md in metadatas:
+        if md.get("is_diagram"):
+            prefix = f"{md.get('source')}::fig::p{md.get('page_number', md.get('page'))}"
+        else:
+            prefix = f"{md.get('source')}::p{md.get('page')}"
+        ids.append(f"{prefix}::{'' if md.get('is_diagram') else 'c'}{counters[prefix]}")
+        counters[prefix] += 1
+    return ids
+
+
+def build_ref_index(ids: Sequence[str], metadatas: Sequence[Dict]) -> Dict[str, Dict[str, List[str]]]:
+    chunks: Dict[str, List[tuple]] = defaultdict(list)
+    figures: Dict[str, List[str]] = defaultdict(list)
+    for doc_id, md in zip(ids, metadatas):
+        md = md or {}
+        if md.get("figure_label_norm"):
+            figures[ref_key(md["figure_label_norm"])].append(doc_id)
+        for ref in _refs_from_metadata(md):
+            page = md.get("page")
+            chunks[ref_key(ref)].append((-(int(page) if page is not None else -1), doc_id))
+    # the last mention of a reference is usually the annex/drawing itself (same assumption as
+    # detect_last_occurrences in the notebook), so chunks are kept latest page first
+    return {
+        "chunks": {k: list(dict.fromkeys(i for _, i in sorted(v))) for k, v in chunks.items()},
+        "figures": {k: list(dict.fromkeys(v)) for k, v in figures.items()},
+    }
+
+
+def build_ref_index_from_chroma(collection) -> Dict[str, Dict[str, List[str]]]:
+    res = collection.get(include=["metadatas"])
+    return build_ref_index(res["ids"], res["metadatas"])
+
+
+def save_ref_index(index: Dict, path: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_ref_index(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+#ids to boost for the query's references: figure docs first, then the chunks, capped and deduplicated
+def resolve_boost_ids(index: Dict, query_refs: Iterable[str], cap: int = 6,
+                      exclude: Optional[Iterable[str]] = None) -> List[str]:
+    keys = [ref_key(r) for r in query_refs]
+    candidates = [i for k in keys for i in index.get("figures", {}).get(k, [])]
+    candidates += [i for k in keys for i in index.get("chunks", {}).get(k, [])]
+    skip = set(exclude or ())
+    out = []
+    for i in dict.fromkeys(candidates):
+        if i in skip:
+            continue
+        out.append(i)
+        if len(out) >= cap:
+            break
+    return out
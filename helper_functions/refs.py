@@ -0,0 +1,25 @@
+#Annex / appendix / drawing / figure references, shared by the app (LLM.py) and the offline tools
+#(ingest, page scanner, BM25 index, reference index, query expansion). No app imports here, so the CLIs and
+#the page scanner's worker processes do not load streamlit or LangChain just to match a reference.
+import re
+from typing import List
+
+# references in documents come in many different forms and need to be normalized. e.g. annex K, AnnexK, Annex  K -> annex k
+ref_regex = re.compile(
+    r"\b(?:annex|appendix)\s+[a-z\d]+\b"
+    r"|\bdrawing\s+no\.?\s*\d+\b"
+    r"|\bfigure\s+\d+(?:\.\d+)*\b",
+    re.IGNORECASE
+)
+
+
+def normalize_label(label: str) -> str:
+    label = label.lower().replace("\n", " ")
+    label = re.sub(r"\s+", " ", label.strip())
+    label = re.sub(r"(\bno)\s*(\d)", r"\1 \2", label)
+    return label
+
+
+def extract_annex_refs(text) -> List[str]:
+    matches = ref_regex.findall(text)
+    return list(set([normalize_label(m) for m in matches]))
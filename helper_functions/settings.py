@@ -0,0 +1,42 @@
+# Shared paths and tunables for the helper functions.
+# Every knob can be overridden with an environment variable so deployments can tune without code changes.
+import os
+
+#persistent vector store built by create_vector_db.ipynb
+VECTOR_DB_DIR = os.getenv("PUB_RAG_VECTOR_DB_DIR", "chroma_parent_child")
+#label map of annex/figure references produced at ingestion
+LABEL_MAP_PATH = os.getenv("PUB_RAG_LABEL_MAP", "./helper_functions/label_map.json")
+#users allowed to open the admin pages (comma separated); nobody unless configured
+ADMIN_USERS = {u.strip() for u in os.getenv("PUB_RAG_ADMIN_USERS", "").split(",") if u.strip()}
+#compressed copy of the memory-mapped vector export (VECTOR_BACKEND=mmap), built by ingest:
+#none, int8 or pca<dims> (e.g. pca256); see mmap_index.py
+VECTOR_COMPRESSION = os.getenv("VECTOR_COMPRESSION", "none")
+#local on-disk caches (answers, embeddings, ...). safe to delete at any time
+CACHE_DIR = os.getenv("PUB_RAG_CACHE_DIR", ".cache")
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    v = os.getenv(name)
+    if v is None:
+        return default
+    return v.strip().lower() in ("1", "true", "yes", "on")
+
+
+def cache_path(*parts: str) -> str:
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
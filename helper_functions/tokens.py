@@ -0,0 +1,41 @@
+#Token counting for prompt budgets.
+#tiktoken is loaded on first use; without it we fall back to the usual ~4 characters per token estimate.
+#Hugging Face models ("sentence-transformers/all-MiniLM-L6-v2") are counted in their own word pieces; without
+#their tokenizer the cl100k count is scaled by _WORDPIECE_MARGIN, since word pieces run longer.
+import math
+from functools import lru_cache
+
+_WORDPIECE_MARGIN = 1.3
+
+
+@lru_cache(maxsize=4)
+def _encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=4)
+def _hf_tokenizer(model: str):
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model)
+    except Exception:
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    if "/" in model:
+        tok = _hf_tokenizer(model)
+        if tok is not None:
+            return len(tok.tokenize(text)) if text else 0
+        return math.ceil(count_tokens(text, "text-embedding-ada-002") * _WORDPIECE_MARGIN)
+    enc = _encoding(model)
+    if enc is None:
+        return max(1, len(text) // 4) if text else 0
+    return len(enc.encode(text, disallowed_special=()))
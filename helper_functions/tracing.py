@@ -0,0 +1,249 @@
+#Structured per-request tracing.
+#A trace covers one request (an answered question, an upload being indexed) and aggregates its stages:
+#every `span(name)` inside it adds its wall time, a call count and any numbers recorded on it (tokens,
+#chunks, cache hits) to stages[name]. Finished traces are appended as one JSON line to a rotating log
+#(TRACE_LOG_PATH, default logs/requests_trace.jsonl) that pages/3_Metrics.py aggregates into p50/p95.
+#Disabled by default (TRACE_ENABLED); span() then returns a shared no-op object, so instrumented code
+#pays one flag check per stage.
+import contextvars
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from . import settings
+
+TRACE_ENABLED = settings.env_bool("TRACE_ENABLED", False)
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join("logs", "requests_trace.jsonl"))
+TRACE_MAX_BYTES = settings.env_int("TRACE_MAX_BYTES", 5_000_000)
+TRACE_BACKUPS = settings.env_int("TRACE_BACKUPS", 5)
+
+_current: contextvars.ContextVar = contextvars.ContextVar("pub_rag_trace", default=None)
+_logger: Optional[logging.Logger] = None
+_logger_lock = threading.Lock()
+
+
+def _trace_logger() -> logging.Logger:
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            os.makedirs(os.path.dirname(TRACE_LOG_PATH) or ".", exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(TRACE_LOG_PATH, maxBytes=TRACE_MAX_BYTES,
+                                                           backupCount=TRACE_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("pub_rag.trace")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _logger = logger
+    return _logger
+
+
+class _Noop:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **values):
+        pass
+
+
+_NOOP = _Noop()
+
+
+class Trace:
+    def __init__(self, kind: str, **attrs):
+        self.kind = kind
+        self.attrs = dict(attrs)
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._token = None
+        self._t0 = 0.0
+
+    def add(self, name: str, ms: float, values: Dict, calls: int = 1):
+        with self._lock:
+            stage = self.stages.setdefault(name, {"ms": 0.0, "n": 0})
+            stage["ms"] += ms
+            stage["n"] += calls
+            for k, v in values.items():
+                if isinstance(v, bool) or not isinstance(v, (int, float)):
+                    stage[k] = v
+                else:
+                    stage[k] = stage.get(k, 0) + v
+
+    def set(self, **values):
+        with self._lock:
+            self.attrs.update(values)
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        total_ms = (time.perf_counter() - self._t0) * 1000
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            _current.set(None)  # generator closed from another context (abandoned stream)
+        record = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "trace_id": uuid.uuid4().hex[:12],
+            "kind": self.kind,
+            "total_ms": round(total_ms, 2),
+            "error": exc_type.__name__ if exc_type else None,
+            "attrs": self.attrs,
+            "stages": {k: {kk: round(vv, 2) if isinstance(vv, float) else vv for kk, vv in v.items()}
+                       for k, v in self.stages.items()},
+        }
+        try:
+            _trace_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+        except Exception:
+            pass  # tracing must never break a request
+        return False
+
+
+class _Span:
+    __slots__ = ("trace", "name", "values", "_t0")
+
+    def __init__(self, trace: Trace, name: str, values: Dict):
+        self.trace = trace
+        self.name = name
+        self.values = values
+
+    def set(self, **values):
+        self.values.update(values)
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add(self.name, (time.perf_counter() - self._t0) * 1000, self.values)
+        return False
+
+
+def enabled() -> bool:
+    return TRACE_ENABLED and _current.get() is not None
+
+
+#start a trace for one request; inside an active trace (e.g. ask_stream called from an upload question)
+#it is recorded as a stage of the outer trace instead
+def trace(kind: str, **attrs):
+    if not TRACE_ENABLED:
+        return _NOOP
+    current = _current.get()
+    if current is not None:
+        return _Span(current, kind, dict(attrs))
+    return Trace(kind, **attrs)
+
+
+def span(name: str, **values):
+    if not TRACE_ENABLED:
+        return _NOOP
+    current = _current.get()
+    if current is None:
+        return _NOOP
+    return _Span(current, name, values)
+
+
+#add counters to a stage without timing anything (cache hits, ...)
+def count(name: str, **values):
+    if TRACE_ENABLED:
+        current = _current.get()
+        if current is not None:
+            current.add(name, 0.0, values, calls=0)
+
+
+#add numbers/attributes to the request itself (model, temp_context, ...)
+def annotate(**attrs):
+    if TRACE_ENABLED:
+        current = _current.get()
+        if current is not None:
+            current.set(**attrs)
+
+
+#time spent producing the items of a (lazy) iterable, e.g. pages coming out of the pdf parser
+def timed_iter(name: str, items: Iterable) -> Iterator:
+    current = _current.get() if TRACE_ENABLED else None
+    if current is None:
+        yield from items
+        return
+    it = iter(items)
+    while True:
+        t0 = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            current.add(name, (time.perf_counter() - t0) * 1000, {})
+            return
+        current.add(name, (time.perf_counter() - t0) * 1000, {"items": 1})
+        yield item
+
+
+#thread pools do not inherit context variables: run `fn` in a copy of the caller's context so spans
+#from worker threads land in the caller's trace
+def propagate(fn: Callable) -> Callable:
+    if not TRACE_ENABLED or _current.get() is None:
+        return fn
+    ctx = contextvars.copy_context()
+    lock = threading.Lock()
+
+    def run(*args, **kwargs):
+        # a Context can only be entered by one thread at a time; workers get their own copy
+        with lock:
+            local = ctx.copy()
+        return local.run(fn, *args, **kwargs)
+    return run
+
+
+#--- reading the log back (metrics page)
+def load_traces(path: str = TRACE_LOG_PATH, limit: Optional[int] = None) -> List[Dict]:
+    # rotated backups are path.1 (newest) .. path.N (oldest); read oldest first
+    backups = [p for p in glob.glob(f"{glob.escape(path)}.*") if p.rsplit(".", 1)[-1].isdigit()]
+    files = sorted(backups, key=lambda p: int(p.rsplit(".", 1)[-1]), reverse=True)
+    files += [path] if os.path.exists(path) else []
+    traces = []
+    for fp in files:
+        with open(fp, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    traces.append(json.loads(line))
+                except ValueError:
+                    continue
+    return traces[-limit:] if limit else traces
+
+
+def _pct(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else 0.0
+
+
+#one row per (request kind, stage) with p50/p95 latency and the mean of the recorded counters
+def summarize(traces: Iterable[Dict]) -> List[Dict]:
+    groups: Dict[tuple, Dict[str, List[float]]] = {}
+    for t in traces:
+        kind = t.get("kind", "?")
+        groups.setdefault((kind, "(total)"), {}).setdefault("ms", []).append(t.get("total_ms", 0.0))
+        for name, stage in (t.get("stages") or {}).items():
+            g = groups.setdefault((kind, name), {})
+            for k, v in stage.items():
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    g.setdefault(k, []).append(float(v))
+                elif isinstance(v, bool):
+                    g.setdefault(k, []).append(1.0 if v else 0.0)
+    rows = []
+    for (kind, name), g in sorted(groups.items()):
+        ms = g.pop("ms", [])
+        row = {"kind": kind, "stage": name, "count": len(ms), "p50_ms": round(_pct(ms, .5), 1),
+               "p95_ms": round(_pct(ms, .95), 1)}
+        row.update({f"avg_{k}": round(sum(v) / len(v), 2) for k, v in g.items() if k != "n" and v})
+        rows.append(row)
+    return rows
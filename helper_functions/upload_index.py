@@ -0,0 +1,216 @@
+#Process-wide index for uploaded documents, shared by every Streamlit session.
+#Every session gets its own namespace, so uploads stay isolated between users while the client count,
+#disk writes and index-open latency no longer grow with the number of sessions. Nothing is written to
+#disk; everything is gone when the process exits.
+#Backends ("auto" by default): a session starts on a NumpyVectorIndex (vector_index.py, exact search, no
+#client at all) and is moved to a collection "upl_<session id>" of one shared in-memory Chroma client
+#(EphemeralClient) once it holds more than `numpy_max_chunks` chunks. "numpy" / "chroma" pin one backend.
+#Each session has quotas (chunks and approximate bytes: text + float32 vector + metadata); going over one
+#raises UploadQuotaExceeded. Sessions that have not been used for `ttl_s` are dropped by a background
+#sweeper thread, so abandoned browser tabs do not keep their uploads in memory forever.
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from .vector_index import NumpyVectorIndex
+
+#chunks copied per upsert when a session moves to Chroma (below chroma's max batch size)
+_PROMOTE_BATCH = 1000
+
+
+class UploadQuotaExceeded(Exception):
+    pass
+
+
+class SessionIndex:
+    """One session's namespace: its collection plus what has been indexed into it."""
+
+    def __init__(self, session_id: str, collection, backend: str):
+        self.session_id = session_id
+        self.collection = collection
+        self.backend = backend
+        self.files: Dict[str, Dict] = {}  # source name -> {"digest", "chunks", "bytes"}
+        self.chunks = 0
+        self.bytes = 0
+        self.last_used = time.time()
+        self.busy = 0
+        self.lock = threading.RLock()
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def file_digest(self, name: str) -> Optional[str]:
+        entry = self.files.get(name)
+        return entry.get("digest") if entry else None
+
+    def set_digest(self, name: str, digest: str):
+        self.files.setdefault(name, {"digest": None, "chunks": 0, "bytes": 0})["digest"] = digest
+
+    def indexed_files(self) -> List[str]:
+        return [name for name, entry in self.files.items() if entry.get("digest")]
+
+    def count(self) -> int:
+        return self.chunks
+
+
+#rough in-memory footprint of one chunk: text, float32 vector, metadata
+def estimate_bytes(text: str, embedding, metadata: Optional[Dict]) -> int:
+    meta = len(json.dumps(metadata, default=str)) if metadata else 0
+    return len(text.encode("utf-8")) + 4 * len(embedding) + meta
+
+
+class UploadIndexRegistry:
+    def __init__(self, client_factory: Callable, ttl_s: float = 3600.0, max_chunks: int = 20_000,
+                 max_bytes: int = 64 * 2**20, sweep_interval_s: float = 60.0, backend: str = "auto",
+                 numpy_max_chunks: int = 10_000, numpy_dtype: str = "float32"):
+        if backend not in ("auto", "numpy", "chroma"):
+            raise ValueError(f"unknown upload index backend {backend!r} (auto, numpy or chroma)")
+        self._client_factory = client_factory
+        self.backend = backend
+        self.numpy_max_chunks = numpy_max_chunks
+        self.numpy_dtype = numpy_dtype
+        self._client = None
+        self.ttl_s = ttl_s
+        self.max_chunks = max_chunks
+        self.max_bytes = max_bytes
+        self.sweep_interval_s = sweep_interval_s
+        self._sessions: Dict[str, SessionIndex] = {}
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.evicted = 0
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._client_factory()
+            return self._client
+
+    @staticmethod
+    def collection_name(session_id: str) -> str:
+        # chroma: 3-63 chars of [a-zA-Z0-9._-], starting and ending with an alphanumeric
+        safe = "".join(c if c.isalnum() else "-" for c in session_id)[:56].strip("-") or "anon"
+        return f"upl_{safe}"
+
+    def get(self, session_id: str) -> SessionIndex:
+        client = self.client if self.backend == "chroma" else None
+        with self._lock:
+            sess = self._sessions.get(session_id)
+            if sess is None:
+                name = self.collection_name(session_id)
+                if client is not None:
+                    sess = SessionIndex(session_id, client.get_or_create_collection(name), "chroma")
+                else:
+                    sess = SessionIndex(session_id, NumpyVectorIndex(name, dtype=self.numpy_dtype), "numpy")
+                self._sessions[session_id] = sess
+        sess.touch()
+        return sess
+
+    #call before inserting `incoming` chunks: moves an "auto" session to Chroma when it would outgrow numpy
+    def prepare_insert(self, sess: SessionIndex, incoming: int):
+        with sess.lock:
+            if (self.backend == "auto" and sess.backend == "numpy"
+                    and sess.collection.count() + incoming > self.numpy_max_chunks):
+                self._promote(sess)
+
+    def _promote(self, sess: SessionIndex):
+        old = sess.collection
+        coll = self.client.get_or_create_collection(old.name)
+        data = old.get(include=("documents", "metadatas", "embeddings"))
+        for i in range(0, len(data["ids"]), _PROMOTE_BATCH):
+            j = i + _PROMOTE_BATCH
+            coll.upsert(ids=data["ids"][i:j], embeddings=data["embeddings"][i:j].tolist(),
+                        documents=data["documents"][i:j], metadatas=[m or None for m in data["metadatas"][i:j]])
+        sess.collection, sess.backend = coll, "chroma"
+
+    #hold a session while it is being indexed or queried, so the sweeper never drops it mid-request
+    @contextmanager
+    def use(self, session_id: str) -> Iterator[SessionIndex]:
+        sess = self.get(session_id)
+        with self._lock:
+            sess.busy += 1
+        try:
+            yield sess
+        finally:
+            with self._lock:
+                sess.busy -= 1
+            sess.touch()
+
+    #reserve room for a batch of chunks from `source`; raises UploadQuotaExceeded when it does not fit
+    def reserve(self, sess: SessionIndex, source: str, chunks: int, nbytes: int):
+        with sess.lock:
+            if sess.chunks + chunks > self.max_chunks:
+                raise UploadQuotaExceeded(
+                    f"Uploaded documents are limited to {self.max_chunks} chunks per session "
+                    f"({sess.chunks} already indexed). Remove some files or clear the uploaded context.")
+            if sess.bytes + nbytes > self.max_bytes:
+                raise UploadQuotaExceeded(
+                    f"Uploaded documents are limited to {self.max_bytes / 2**20:.0f} MB per session "
+                    f"({sess.bytes / 2**20:.1f} MB already indexed). Remove some files or clear the uploaded context.")
+            entry = sess.files.setdefault(source, {"digest": None, "chunks": 0, "bytes": 0})
+            entry["chunks"] += chunks
+            entry["bytes"] += nbytes
+            sess.chunks += chunks
+            sess.bytes += nbytes
+
+    #delete everything indexed from `source` in this session and give its quota back
+    def remove_file(self, sess: SessionIndex, source: str):
+        with sess.lock:
+            sess.collection.delete(where={"source": source})
+            entry = sess.files.pop(source, None)
+            if entry:
+                sess.chunks -= entry["chunks"]
+                sess.bytes -= entry["bytes"]
+
+    def drop(self, session_id: str) -> bool:
+        with self._lock:
+            sess = self._sessions.pop(session_id, None)
+        if sess is None:
+            return False
+        if sess.backend == "chroma":
+            try:
+                self.client.delete_collection(sess.collection.name)
+            except Exception:
+                pass  # already gone
+        return True
+
+    #drop sessions idle for longer than ttl_s; returns their ids
+    def sweep(self, now: Optional[float] = None) -> List[str]:
+        now = time.time() if now is None else now
+        with self._lock:
+            idle = [sid for sid, s in self._sessions.items() if not s.busy and now - s.last_used > self.ttl_s]
+        dropped = [sid for sid in idle if self.drop(sid)]
+        self.evicted += len(dropped)
+        return dropped
+
+    def start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._stop.clear()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="upload-index-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval_s):
+            try:
+                self.sweep()
+            except Exception:
+                pass  # keep sweeping; a failed drop is retried next round
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            "sessions": len(sessions),
+            "chroma_sessions": sum(1 for s in sessions if s.backend == "chroma"),
+            "chunks": sum(s.chunks for s in sessions),
+            "mb": round(sum(s.bytes for s in sessions) / 2**20, 2),
+            "evicted": self.evicted,
+        }
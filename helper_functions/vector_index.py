@@ -0,0 +1,204 @@
+#In-memory exact vector index for small uploads, with the subset of the Chroma collection API that the upload
+#path uses (upsert / query / delete / get / count), so it can stand in for a collection in upload_index.py.
+#Vectors live in one contiguous matrix (float32, or int8 with a per-row scale), documents and metadata in
+#parallel lists. A query is one matrix-vector product plus argpartition for the top k; with a few hundred
+#384-dim MiniLM vectors that takes microseconds, where a Chroma collection pays for its client, SQLite
+#and HNSW bookkeeping. Exact search is O(n) per query, so upload_index.py moves a session to Chroma
+#once it grows past UPLOAD_NUMPY_MAX_CHUNKS.
+#Distances follow Chroma's default space ("l2", squared): for unit vectors 2 - 2 * cosine.
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+#rows scored per block on int8 storage, bounding the float32 temporary
+_INT8_BLOCK = 8192
+
+
+def _matches(meta: Dict, where: Optional[Dict]) -> bool:
+    return not where or all(meta.get(k) == v for k, v in where.items())
+
+
+#maximal marginal relevance over candidate rows: `k` indices into `cand`, most relevant first.
+#query and candidates are expected to be unit vectors (MiniLM embeddings are normalized)
+def mmr_select(query: np.ndarray, cand: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    if len(cand) == 0 or k <= 0:
+        return []
+    rel = cand @ query
+    chosen = [int(np.argmax(rel))]
+    max_sim = cand @ cand[chosen[0]]
+    while len(chosen) < min(k, len(cand)):
+        score = lambda_mult * rel - (1 - lambda_mult) * max_sim
+        score[chosen] = -np.inf
+        nxt = int(np.argmax(score))
+        chosen.append(nxt)
+        max_sim = np.maximum(max_sim, cand @ cand[nxt])
+    return chosen
+
+
+class NumpyVectorIndex:
+    def __init__(self, name: str = "numpy", dtype: str = "float32", initial_capacity: int = 256):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"unsupported dtype {dtype!r} (float32 or int8)")
+        self.name = name
+        self.dtype = dtype
+        self._initial_capacity = max(1, initial_capacity)
+        self._vecs: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None  # int8 only: row = q * scale
+        self._n = 0
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict] = []
+        self._row: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def dim(self) -> Optional[int]:
+        return None if self._vecs is None else self._vecs.shape[1]
+
+    def count(self) -> int:
+        return self._n
+
+    def nbytes(self) -> int:
+        if self._vecs is None:
+            return 0
+        return self._n * self._vecs.shape[1] * self._vecs.itemsize + (self._n * 4 if self._scales is not None else 0)
+
+    def _encode(self, vecs: np.ndarray):
+        if self.dtype == "float32":
+            return vecs, None
+        scales = np.abs(vecs).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vecs / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _ensure_capacity(self, rows: int, dim: int):
+        if self._vecs is None:
+            cap = max(self._initial_capacity, rows)
+            self._vecs = np.zeros((cap, dim), dtype=np.float32 if self.dtype == "float32" else np.int8)
+            if self.dtype == "int8":
+                self._scales = np.zeros(cap, dtype=np.float32)
+            return
+        if dim != self._vecs.shape[1]:
+            raise ValueError(f"embedding dimension {dim} does not match the index ({self._vecs.shape[1]})")
+        if rows <= len(self._vecs):
+            return
+        cap = max(rows, 2 * len(self._vecs))
+        grown = np.zeros((cap, dim), dtype=self._vecs.dtype)
+        grown[:self._n] = self._vecs[:self._n]
+        self._vecs = grown
+        if self._scales is not None:
+            scales = np.zeros(cap, dtype=np.float32)
+            scales[:self._n] = self._scales[:self._n]
+            self._scales = scales
+
+    def upsert(self, ids: Sequence[str], embeddings, documents: Optional[Sequence[str]] = None,
+               metadatas: Optional[Sequence[Dict]] = None):
+        vecs = np.asarray(embeddings, dtype=np.float32)
+        if vecs.ndim != 2 or len(vecs) != len(ids):
+            raise ValueError("embeddings must be a (len(ids), dim) array")
+        documents = list(documents) if documents is not None else [""] * len(ids)
+        metadatas = list(metadatas) if metadatas is not None else [{}] * len(ids)
+        enc, scales = self._encode(vecs)
+        with self._lock:
+            new = [i for i, id_ in enumerate(ids) if id_ not in self._row]
+            self._ensure_capacity(self._n + len(new), vecs.shape[1])
+            for i, id_ in enumerate(ids):
+                row = self._row.get(id_)
+                if row is None:
+                    row = self._row[id_] = self._n
+                    self._n += 1
+                    self.ids.append(id_)
+                    self.documents.append(documents[i])
+                    self.metadatas.append(dict(metadatas[i] or {}))
+                else:
+                    self.documents[row] = documents[i]
+                    self.metadatas[row] = dict(metadatas[i] or {})
+                self._vecs[row] = enc[i]
+                if scales is not None:
+                    self._scales[row] = scales[i]
+
+    add = upsert
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict] = None):
+        with self._lock:
+            drop = set(ids or [])
+            keep = [r for r in range(self._n)
+                    if self.ids[r] not in drop and not (where and _matches(self.metadatas[r], where))]
+            if len(keep) == self._n:
+                return
+            idx = np.asarray(keep, dtype=np.int64)
+            self._vecs[:len(keep)] = self._vecs[idx]
+            if self._scales is not None:
+                self._scales[:len(keep)] = self._scales[idx]
+            self.ids = [self.ids[r] for r in keep]
+            self.documents = [self.documents[r] for r in keep]
+            self.metadatas = [self.metadatas[r] for r in keep]
+            self._n = len(keep)
+            self._row = {id_: r for r, id_ in enumerate(self.ids)}
+
+    #rows as float32 (dequantized for int8)
+    def vectors(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        if self._vecs is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        rows = np.arange(self._n) if rows is None else rows
+        if self._scales is None:
+            return self._vecs[rows]
+        return self._vecs[rows].astype(np.float32) * self._scales[rows, None]
+
+    def _scores(self, q: np.ndarray) -> np.ndarray:
+        if self._scales is None:
+            return self._vecs[:self._n] @ q
+        out = np.empty(self._n, dtype=np.float32)
+        for s in range(0, self._n, _INT8_BLOCK):
+            e = min(self._n, s + _INT8_BLOCK)
+            out[s:e] = (self._vecs[s:e].astype(np.float32) @ q) * self._scales[s:e]
+        return out
+
+    #indices of the k best rows for one query, best first (optionally only rows matching `where`)
+    def _top_k(self, q: np.ndarray, k: int, where: Optional[Dict]) -> tuple:
+        scores = self._scores(q)
+        if where:
+            mask = np.fromiter((_matches(m, where) for m in self.metadatas), dtype=bool, count=self._n)
+            scores = np.where(mask, scores, -np.inf)
+            k = min(k, int(mask.sum()))
+        k = min(k, self._n)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), scores
+        top = np.argpartition(-scores, k - 1)[:k] if k < self._n else np.arange(self._n)
+        return top[np.argsort(-scores[top], kind="stable")], scores
+
+    def query(self, query_embeddings, n_results: int = 8, where: Optional[Dict] = None,
+              include: Sequence[str] = ("documents", "metadatas", "distances"),
+              mmr: bool = False, fetch_k: Optional[int] = None, lambda_mult: float = 0.5) -> Dict:
+        qs = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        out: Dict[str, List] = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        with self._lock:
+            for q in qs:
+                if self._n == 0:
+                    rows, scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+                elif mmr:
+                    cand, scores = self._top_k(q, max(n_results, fetch_k or 4 * n_results), where)
+                    rows = cand[mmr_select(q, self.vectors(cand), n_results, lambda_mult)]
+                else:
+                    rows, scores = self._top_k(q, n_results, where)
+                out["ids"].append([self.ids[r] for r in rows])
+                out["documents"].append([self.documents[r] for r in rows])
+                out["metadatas"].append([self.metadatas[r] for r in rows])
+                out["distances"].append([float(2.0 - 2.0 * scores[r]) for r in rows])
+                out["embeddings"].append(self.vectors(rows) if "embeddings" in include else None)
+        return {k: v for k, v in out.items() if k == "ids" or k in include}
+
+    def get(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict] = None,
+            include: Sequence[str] = ("documents", "metadatas")) -> Dict:
+        with self._lock:
+            wanted = set(ids) if ids is not None else None
+            rows = [r for r in range(self._n)
+                    if (wanted is None or self.ids[r] in wanted) and _matches(self.metadatas[r], where)]
+            out = {"ids": [self.ids[r] for r in rows]}
+            if "documents" in include:
+                out["documents"] = [self.documents[r] for r in rows]
+            if "metadatas" in include:
+                out["metadatas"] = [self.metadatas[r] for r in rows]
+            if "embeddings" in include:
+                out["embeddings"] = self.vectors(np.asarray(rows, dtype=np.int64))
+        return out
@@ -0,0 +1,49 @@
+import streamlit as st
+from helper_functions import llm, settings, tracing
+
+st.set_page_config(page_title="Metrics", layout="wide")
+
+#admin only: same login as Home.py, and the user must be listed in PUB_RAG_ADMIN_USERS
+if not st.session_state.get("logged_in") or st.session_state.get("username") not in settings.ADMIN_USERS:
+    st.error("This page is only available to administrators. Please log in on the Home page.")
+    st.stop()
+
+st.title("Metrics")
+if not tracing.TRACE_ENABLED:
+    st.info("Tracing is disabled. Set TRACE_ENABLED=1 to record new requests; showing what is already logged.")
+
+limit = st.slider("Most recent requests to include", 50, 5000, 500, step=50)
+traces = tracing.load_traces(limit=limit)
+if not traces:
+    st.warning(f"No traces found in {tracing.TRACE_LOG_PATH}.")
+    st.stop()
+
+kinds = sorted({t.get("kind", "?") for t in traces})
+selected = st.multiselect("Request kinds", kinds, default=kinds)
+traces = [t for t in traces if t.get("kind", "?") in selected]
+
+col_a, col_b, col_c = st.columns(3)
+col_a.metric("Requests", len(traces))
+errors = sum(1 for t in traces if t.get("error"))
+col_b.metric("Errors", errors)
+cached = [t.get("attrs", {}).get("cache_hit") for t in traces if "cache_hit" in t.get("attrs", {})]
+col_c.metric("Answer cache hit rate", f"{(sum(map(bool, cached)) / len(cached)):.0%}" if cached else "n/a")
+
+#live counters of this server process, not from the trace log
+emb_stats = llm.get_embedding().stats()
+if emb_stats["lookups"]:
+    st.subheader("Query embeddings (this server process)")
+    col_a, col_b, col_c, col_d = st.columns(4)
+    col_a.metric("Hit rate", f"{emb_stats['hit_rate']:.0%}")
+    col_b.metric("Memory / disk hits", f"{emb_stats['memory_hits']} / {emb_stats['disk_hits']}")
+    col_c.metric("Embedded", emb_stats["misses"])
+    col_d.metric("Embedding calls", emb_stats["model_calls"])
+
+st.subheader("Latency per stage (p50 / p95)")
+st.caption("Stage times are summed per request (e.g. every sub-query's MMR search). avg_* columns are per-request "
+           "means of the recorded counters: tokens, chunks, docs, cache hits.")
+st.dataframe(tracing.summarize(traces), use_container_width=True, hide_index=True)
+
+with st.expander("Latest requests"):
+    for t in reversed(traces[-20:]):
+        st.json(t, expanded=False)
@@ -0,0 +1,5 @@
+#Offline tests: no OpenAI calls, no network. Run from the repo root with `python -m pytest -q tests`.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
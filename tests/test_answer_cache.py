@@ -0,0 +1,105 @@
+import pytest
+
+from helper_functions import answer_cache
+from helper_functions.answer_cache import AnswerCache, query_specifics, store_fingerprint
+from helper_functions.refs import extract_annex_refs
+
+FP = "store-1"
+
+
+class _Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        self.now += 0.001
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(answer_cache, "time", c)
+    return c
+
+
+def _cache(tmp_path, **kwargs):
+    # same specifics as the app: numbers with units plus annex / figure / table references
+    kwargs.setdefault("specifics", lambda q: query_specifics(q) | frozenset(extract_annex_refs(q)))
+    return AnswerCache(str(tmp_path / "answers.sqlite3"), **kwargs)
+
+
+def test_exact_hit_ignores_case_whitespace_and_punctuation(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put("What is the minimum sewer size?", FP, "150 mm", "p.3")
+    hit = cache.get_exact("  what is the MINIMUM sewer   size ", FP)
+    assert hit["answer"] == "150 mm" and hit["similarity"] == 1.0
+    assert cache.get_exact("What is the minimum sewer size?", "store-2") is None
+
+
+def test_similar_hit_above_threshold(tmp_path):
+    cache = _cache(tmp_path, similarity_threshold=0.95)
+    cache.put("How far must a building be from a sewer?", FP, "3 m", "p.10", query_embedding=[1.0, 0.0, 0.0])
+    hit = cache.get_similar("How far should buildings be from sewers?", [0.99, 0.05, 0.0], FP)
+    assert hit["answer"] == "3 m" and hit["similarity"] > 0.95
+    assert cache.get_similar("Who approves plans?", [0.0, 1.0, 0.0], FP) is None
+
+
+def test_similar_requires_same_numbers_and_references(tmp_path):
+    cache = _cache(tmp_path, similarity_threshold=0.9)
+    cache.put("Clearance for a 600 mm sewer?", FP, "1.0 m", "", query_embedding=[1.0, 0.0])
+    cache.put("What does Annex J show?", FP, "grease trap", "", query_embedding=[0.0, 1.0])
+    assert cache.get_similar("Clearance for a 900 mm sewer?", [1.0, 0.0], FP) is None
+    assert cache.get_similar("What does Annex K show?", [0.0, 1.0], FP) is None
+    assert cache.get_similar("Clearance for a 600mm sewer", [1.0, 0.0], FP)["answer"] == "1.0 m"
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_seconds=60)
+    cache.put("q", FP, "a", "", query_embedding=[1.0, 0.0])
+    clock.now += 30
+    assert cache.get_exact("q", FP) is not None
+    clock.now += 31
+    assert cache.get_exact("q", FP) is None
+    assert cache.get_similar("q", [1.0, 0.0], FP) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    cache = _cache(tmp_path, max_entries=2)
+    cache.put("first", FP, "1", "")
+    cache.put("second", FP, "2", "")
+    assert cache.get_exact("first", FP) is not None  # "second" is now the least recently used
+    cache.put("third", FP, "3", "")
+    assert len(cache) == 2
+    assert cache.get_exact("second", FP) is None
+    assert cache.get_exact("first", FP) is not None and cache.get_exact("third", FP) is not None
+
+
+def test_store_fingerprint_follows_build_file_only(tmp_path):
+    store = tmp_path / "db"
+    store.mkdir()
+    (store / "chroma.sqlite3").write_bytes(b"x" * 10)
+    (store / "manifest.json").write_text('{"updated_at": 1}')
+    fp = store_fingerprint(str(store), "prompt", build_file="manifest.json")
+
+    (store / "bm25.pkl").write_bytes(b"derived")
+    (store / "chroma.sqlite3").write_bytes(b"x" * 20)
+    assert store_fingerprint(str(store), "prompt", build_file="manifest.json") == fp
+    assert store_fingerprint(str(store), "other prompt", build_file="manifest.json") != fp
+
+    (store / "manifest.json").write_text('{"updated_at": 2}')
+    assert store_fingerprint(str(store), "prompt", build_file="manifest.json") != fp
+
+
+def test_store_fingerprint_without_build_file_skips_excluded(tmp_path):
+    store = tmp_path / "db"
+    store.mkdir()
+    (store / "chroma.sqlite3").write_bytes(b"x" * 10)
+    fp = store_fingerprint(str(store), build_file="manifest.json", exclude=("bm25.pkl", "mmap_index"))
+    (store / "bm25.pkl").write_bytes(b"derived")
+    (store / "mmap_index").mkdir()
+    (store / "mmap_index" / "vectors.f32.npy").write_bytes(b"derived")
+    assert store_fingerprint(str(store), build_file="manifest.json", exclude=("bm25.pkl", "mmap_index")) == fp
+    (store / "chroma.sqlite3").write_bytes(b"x" * 20)
+    assert store_fingerprint(str(store), build_file="manifest.json", exclude=("bm25.pkl", "mmap_index")) != fp
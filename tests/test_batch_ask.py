@@ -0,0 +1,33 @@
+import json
+
+from helper_functions.batch_ask import JsonlWriter, load_checkpoint, read_questions
+
+
+def test_checkpoint_skips_errored_and_torn_rows(tmp_path):
+    out = tmp_path / "answers.jsonl"
+    out.write_text(
+        json.dumps({"id": "1", "question": "q1", "answer": "a1"}) + "\n"
+        + json.dumps({"id": "2", "question": "q2", "error": "TimeoutError"}) + "\n"
+        + json.dumps({"id": "3", "question": "q3", "answer": "a3"}) + "\n"
+        + '{"id": "4", "question": "q4", "ans', encoding="utf-8")
+    assert sorted(load_checkpoint(str(out))) == ["1", "3"]
+    assert load_checkpoint(str(tmp_path / "missing.jsonl")) == {}
+
+
+def test_writer_starts_a_new_line_after_a_torn_row(tmp_path):
+    out = tmp_path / "answers.jsonl"
+    out.write_text(json.dumps({"id": "1", "answer": "a1"}) + "\n" + '{"id": "2", "ans', encoding="utf-8")
+    writer = JsonlWriter(str(out))
+    writer.write({"id": "2", "answer": "a2"})
+    writer.close()
+    assert load_checkpoint(str(out)) == {"1": {"id": "1", "answer": "a1"}, "2": {"id": "2", "answer": "a2"}}
+
+
+def test_read_questions_accepts_objects_and_strings(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    path.write_text('{"id": 7, "question": " Minimum sewer size? "}\n\n"What is Annex J?"\n{"id": 9}\n',
+                    encoding="utf-8")
+    skipped = []
+    records = read_questions(str(path), log=skipped.append)
+    assert records == [{"id": "7", "question": "Minimum sewer size?"}, {"id": "line-3", "question": "What is Annex J?"}]
+    assert len(skipped) == 1
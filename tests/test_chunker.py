@@ -0,0 +1,84 @@
+import pytest
+
+from helper_functions.chunker import StructureChunker, heading_label, locator
+from helper_functions.ingest import chunk_page
+from helper_functions.page_scanner import find_refs
+
+CLAUSES = """1.2.4 Structures over Sewer
+No building or structure shall be erected over or within 3 m of a public sewer of 600 mm or larger.
+The developer shall submit plans showing the sewer alignment and the proposed structures for approval.
+1.2.5 Diversion of Sewers
+Where a sewer must be diverted, the diversion works shall be carried out by a licensed contractor at the
+developer's cost and handed over to the Board upon completion and acceptance.
+"""
+
+TABLE = """The minimum clearances are given below.
+Table 2- Minimum horizontal clearance from sewers
+Sewer size (mm) Depth (m) Clearance (m)
+≤ 600 ≤ 3 1.0
+≤ 600 > 3 1.5
+> 600 to 1500 All 2.0
+> 1500 All 3.0
+* measured from the outer face of the pipe
+Where the ground is soft, a larger clearance may be required by the Board after site inspection.
+"""
+
+
+def test_heading_labels():
+    assert heading_label("1.2.4 Structures over Sewer") == "1.2.4"
+    assert heading_label("4 SEWERAGE WORKS") == "4"
+    assert heading_label("ANNEX J - PUB'S RECOMMENDED GREASE TRAP") == "Annex J"
+    assert heading_label("Annex K Grease Traps") == "Annex K"
+    assert heading_label("1.5 m from the sewer") is None
+    assert heading_label("Annex J for grease traps. See Figure 3") is None
+    assert heading_label("section a of the form") is None
+
+
+def test_chunks_follow_clauses():
+    chunks = StructureChunker(max_tokens=60, overlap_tokens=8).chunk(CLAUSES)
+    assert [c.section for c in chunks] == ["1.2.4", "1.2.5"]
+    assert chunks[0].heading == "1.2.4 Structures over Sewer"
+    assert chunks[1].text.startswith("1.2.5 Diversion of Sewers")
+
+
+def test_open_clause_is_carried_to_the_next_page():
+    chunker = StructureChunker(max_tokens=200, overlap_tokens=8)
+    heading = chunker.last_heading(CLAUSES)
+    [chunk] = chunker.chunk("Existing sewers shall remain accessible at all times.", heading)
+    assert chunk.section == "1.2.5" and chunk.heading == "1.2.5 Diversion of Sewers"
+    assert locator({"page": 10, "section": chunk.section}) == "p.10 §1.2.5"
+
+
+def test_table_stays_in_one_chunk_with_its_caption():
+    chunks = StructureChunker(max_tokens=120, overlap_tokens=8).chunk(TABLE)
+    [table] = [c for c in chunks if "Table 2" in c.text]
+    for row in ("> 1500 All 3.0", "≤ 600 ≤ 3 1.0", "* measured"):
+        assert row in table.text
+
+
+def test_split_table_repeats_caption_and_header():
+    rows = "\n".join(f"{d} {d * 2} {d / 10:.1f}" for d in range(100, 2100, 50))
+    text = f"Table 3- Pipe gradients\nDiameter Depth Gradient\n{rows}\n"
+    chunks = StructureChunker(max_tokens=80, overlap_tokens=8).chunk(text)
+    assert len(chunks) > 1
+    assert all(c.tokens <= 80 for c in chunks)
+    assert all("Diameter Depth Gradient" in c.text for c in chunks)
+
+
+@pytest.mark.parametrize("max_tokens", [40, 60, 120])
+def test_no_chunk_exceeds_max_tokens(max_tokens):
+    long_clause = "2.1 Materials\n" + " ".join(f"Pipes of class {i} shall be tested." for i in range(80))
+    oversize = "x" * 5000
+    chunker = StructureChunker(max_tokens=max_tokens, overlap_tokens=8)
+    chunks = chunker.chunk(f"{long_clause}\n{oversize}\n{CLAUSES}\n{TABLE}")
+    assert all(c.tokens <= max_tokens for c in chunks)
+    assert "".join(c.text for c in chunks).count("x") >= 5000
+
+
+def test_chunk_page_matches_refs_across_line_breaks():
+    text = "4.2 Grease Traps\nFood outlets shall install the grease trap shown in Annex\nJ and Figure  3."
+    chunker = StructureChunker(max_tokens=200, overlap_tokens=8)
+    [(cid, _, md)] = chunk_page("COP.pdf", 7, text, chunker, page_refs=find_refs(text))
+    assert cid == "COP.pdf::p7::c0"
+    assert md["section"] == "4.2" and md["parent_id"]
+    assert md["annex_refs_csv"] == "; ".join(sorted(n for _, n in find_refs(text)))
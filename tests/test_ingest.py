@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from helper_functions import ingest
+from helper_functions.page_scanner import PageScan
+
+PAGES = [
+    "1.1 Scope\nThis code covers sewerage works and sanitary plumbing for all premises.",
+    "1.2 Structures over Sewer\nNo structure shall be built over a public sewer of 600 mm or larger.",
+    "1.3 Grease Traps\nFood shops shall provide a grease trap as shown in Annex J.",
+]
+
+
+def _pdf(tmp_path, texts, name="COP.pdf"):
+    path = tmp_path / name
+    path.write_bytes("\f".join(texts).encode("utf-8"))
+    return str(path), {str(path): [PageScan(i, t, "", [], [], "") for i, t in enumerate(texts)]}
+
+
+#the manifest entries run_ingest would write for a completed plan
+def _commit(db_dir, plan):
+    files = {}
+    for item in plan["work"]:
+        entry = files.setdefault(item["file"], {"pages": {}})
+        entry["pages"][item["key"]] = {"hash": item["hash"], "ids": [c[0] for c in item["chunks"]]}
+    for source, sha in plan["file_hashes"].items():
+        files.setdefault(source, {"pages": {}}).update(sha256=sha, chunker=plan["chunker"])
+    ingest.save_manifest(db_dir, {"version": 1, "files": files})
+
+
+def _embed(texts):
+    return [[float(len(t)), 1.0, float(sum(map(ord, t)) % 97)] for t in texts]
+
+
+def test_plan_without_manifest_resets_and_plans_every_page(tmp_path):
+    path, scans = _pdf(tmp_path, PAGES)
+    plan = ingest.plan_ingest([path], str(tmp_path / "db"), scans=scans)
+    assert plan["reset"]
+    assert [item["key"] for item in plan["work"]] == ["0", "1", "2"]
+    assert all(c[0].startswith("COP.pdf::p") for item in plan["work"] for c in item["chunks"])
+
+
+def test_plan_diffs_against_manifest(tmp_path):
+    db = str(tmp_path / "db")
+    path, scans = _pdf(tmp_path, PAGES)
+    _commit(db, ingest.plan_ingest([path], db, scans=scans))
+
+    plan = ingest.plan_ingest([path], db, scans=scans)
+    assert not plan["reset"] and plan["unchanged_files"] == ["COP.pdf"] and not plan["work"]
+
+    changed = PAGES[:1] + [PAGES[1].replace("600 mm", "900 mm")] + PAGES[2:]
+    path, scans = _pdf(tmp_path, changed)
+    plan = ingest.plan_ingest([path], db, scans=scans)
+    assert [item["key"] for item in plan["work"]] == ["1"]
+    assert not plan["deletions"]
+
+    path, scans = _pdf(tmp_path, PAGES[:2])
+    plan = ingest.plan_ingest([path], db, scans=scans)
+    assert not plan["work"]
+    assert plan["deletions"] and all(i.startswith("COP.pdf::p2::") for i in plan["deletions"])
+
+    assert ingest.plan_ingest([path], db, scans=scans, rebuild=True)["reset"]
+
+
+def test_summary_counts_only_nonempty_embedding_calls(tmp_path):
+    path, scans = _pdf(tmp_path, ["", "", PAGES[0]])
+    summary = ingest.summarize_plan(ingest.plan_ingest([path], str(tmp_path / "db"), scans=scans), 1)
+    assert summary["embedding_calls"] == 1
+
+
+def test_run_ingest_resets_store_without_manifest(tmp_path):
+    chromadb = pytest.importorskip("chromadb")
+    db = str(tmp_path / "db")
+    # a store built by the old notebook: random ids and no manifest
+    coll = chromadb.PersistentClient(path=db).get_or_create_collection("langchain")
+    coll.add(ids=["0b7f-uuid"], documents=["old chunk"], embeddings=[[1.0, 0.0, 0.0]])
+
+    calls = []
+
+    def embed(texts):
+        calls.append(len(texts))
+        return _embed(texts)
+
+    path, scans = _pdf(tmp_path, PAGES + [""])
+    kwargs = dict(scans=scans, embed_fn=embed, ref_index_path=str(tmp_path / "refs.json"), log=lambda _: None)
+    summary = ingest.run_ingest([path], db, **kwargs)
+    assert summary["ids_reset"] == 1
+    ids = ingest._open_collection(db).get(include=[])["ids"]
+    assert "0b7f-uuid" not in ids and all(i.startswith("COP.pdf::p") for i in ids)
+    assert ingest.manifest_exists(db)
+    assert sum(calls) == len(ids)
+
+    calls.clear()
+    again = ingest.run_ingest([path], db, **kwargs)
+    assert again["chunks_to_embed"] == 0 and not calls
+
+    rebuilt = ingest.run_ingest([path], db, rebuild=True, **kwargs)
+    assert rebuilt["ids_reset"] == len(ids)
+    assert sorted(ingest._open_collection(db).get(include=[])["ids"]) == sorted(ids)
+    assert os.path.exists(os.path.join(db, ingest.MANIFEST_FILENAME))
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from helper_functions.mmap_index import MmapVectorIndex, compress_export, export_from_chroma, parse_compression
+
+
+class _Collection:
+    """The part of a Chroma collection export_from_chroma reads."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def count(self):
+        return len(self.vectors)
+
+    def get(self, include, limit, offset):
+        rows = range(offset, min(offset + limit, len(self.vectors)))
+        return {"ids": [f"id{i}" for i in rows], "embeddings": self.vectors[offset:offset + limit].tolist(),
+                "documents": [f"doc {i}" for i in rows], "metadatas": [{"row": i} for i in rows]}
+
+
+@pytest.fixture(scope="module")
+def export(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    # clustered, like real embeddings: nearest neighbours are close together
+    centers = rng.normal(size=(40, 64))
+    vectors = (centers[rng.integers(0, 40, 3000)] + 0.3 * rng.normal(size=(3000, 64))).astype(np.float32)
+    path = str(tmp_path_factory.mktemp("mmap"))
+    assert export_from_chroma(_Collection(vectors), path, batch_size=700) == {"rows": 3000, "dim": 64}
+    compress_export(path, "int8")
+    queries = vectors[rng.integers(0, 3000, 50)] + 0.1 * rng.normal(size=(50, 64)).astype(np.float32)
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    exact = np.argsort(-(queries @ unit.T), axis=1)[:, :5]
+    return path, queries, exact
+
+
+def _recall(found, exact):
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact)])
+
+
+def test_uncompressed_search_is_exact(export):
+    path, queries, exact = export
+    index = MmapVectorIndex.load(path)
+    assert index.count() == 3000 and index.ids[:2] == ["id0", "id1"]
+    assert _recall(index.search(queries, k=5, mmr=False), exact) == 1.0
+
+
+def test_int8_recall(export):
+    path, queries, exact = export
+    index = MmapVectorIndex.load(path, compression="int8")
+    assert index.scan_nbytes() < index.nbytes() / 3
+    assert _recall(index.search(queries, k=5, mmr=False, rescore=0), exact) >= 0.9
+    assert _recall(index.search(queries, k=5, mmr=False), exact) == 1.0
+
+
+def test_mmr_picks_from_the_fetched_candidates(export):
+    path, queries, _ = export
+    index = MmapVectorIndex.load(path)
+    fetched = index.search(queries, k=20, mmr=False)
+    for picked, pool in zip(index.search(queries, k=5, fetch_k=20), fetched):
+        assert len(set(picked)) == 5 and set(picked) <= set(pool)
+
+
+def test_unknown_compression_is_rejected():
+    assert parse_compression("PCA128") == ("pca", 128)
+    with pytest.raises(ValueError):
+        parse_compression("int4")
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from helper_functions.upload_index import UploadIndexRegistry, UploadQuotaExceeded
+
+
+def _no_client():
+    raise AssertionError("the numpy backend must not open a Chroma client")
+
+
+def _rows(n, source="a.pdf", start=0):
+    ids = [f"{source}::{i}" for i in range(start, start + n)]
+    return dict(ids=ids, embeddings=[[1.0, float(i), 0.5] for i in range(start, start + n)],
+                documents=[f"chunk {i}" for i in range(start, start + n)], metadatas=[{"source": source}] * n)
+
+
+def test_reserve_enforces_chunk_and_byte_quotas():
+    reg = UploadIndexRegistry(_no_client, max_chunks=10, max_bytes=1000)
+    sess = reg.get("s1")
+    reg.reserve(sess, "a.pdf", 8, 100)
+    with pytest.raises(UploadQuotaExceeded):
+        reg.reserve(sess, "b.pdf", 3, 100)
+    with pytest.raises(UploadQuotaExceeded):
+        reg.reserve(sess, "b.pdf", 1, 901)
+    assert (sess.chunks, sess.bytes) == (8, 100)
+
+    sess.collection.upsert(**_rows(8))
+    reg.remove_file(sess, "a.pdf")
+    assert (sess.chunks, sess.bytes) == (0, 0) and sess.collection.count() == 0
+    reg.reserve(sess, "b.pdf", 10, 1000)
+
+
+def test_sweep_drops_idle_sessions_but_not_busy_ones():
+    reg = UploadIndexRegistry(_no_client, ttl_s=10)
+    reg.get("idle")
+    with reg.use("busy"):
+        later = time.time() + 11
+        assert reg.sweep(now=later) == ["idle"]
+    assert reg.sweep(now=time.time() + 11) == ["busy"]
+    assert reg.stats()["sessions"] == 0 and reg.evicted == 2
+
+
+def test_numpy_session_is_promoted_to_chroma_when_it_outgrows_numpy():
+    chromadb = pytest.importorskip("chromadb")
+    reg = UploadIndexRegistry(chromadb.EphemeralClient, numpy_max_chunks=4)
+    sess = reg.get(f"promote-{time.time_ns()}")
+    assert sess.backend == "numpy"
+    reg.prepare_insert(sess, 3)
+    sess.collection.upsert(**_rows(3))
+    assert sess.backend == "numpy"
+
+    reg.prepare_insert(sess, 2)
+    assert sess.backend == "chroma" and sess.collection.count() == 3
+    sess.collection.upsert(**_rows(2, start=3))
+    res = sess.collection.query(query_embeddings=[[1.0, 4.0, 0.5]], n_results=1)
+    assert res["ids"][0] == ["a.pdf::4"]
+    assert reg.stats()["chroma_sessions"] == 1
+    assert reg.drop(sess.session_id)
+
+
+def test_numpy_backend_never_promotes():
+    reg = UploadIndexRegistry(_no_client, backend="numpy", numpy_max_chunks=1)
+    sess = reg.get("s1")
+    sess.collection.upsert(**_rows(2))
+    reg.prepare_insert(sess, 5)
+    assert sess.backend == "numpy" and sess.collection.count() == 2